@@ -0,0 +1,221 @@
+import logging
+import math
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from pretix.base.models import Event
+
+from .config import get_int_setting, get_setting
+from .models import EventGeoAggregate, OrderGeocodeData
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# distance_rings: Comma separated outer edges (km) of the rings around the venue, the last ring is open-ended.
+DEFAULT_DISTANCE_RINGS = (10.0, 25.0, 50.0, 100.0, 250.0, 500.0)
+# aggregates_delay: Seconds between a write to an event's geocode data and the rebuild of its aggregates,
+# collecting further writes meanwhile.
+DEFAULT_AGGREGATES_DELAY = 30
+AGGREGATES_SCHEDULED_CACHE_PREFIX = 'pretix_mapplugin:aggregates:scheduled'
+EARTH_RADIUS_KM = 6371.0088
+# Rows read per round trip while counting an event's orders
+AGGREGATES_CHUNK_SIZE = 2000
+# Length of EventGeoAggregate.key, longer keys are cut while counting so keys sharing their start are merged
+AGGREGATE_KEY_LENGTH = 190
+
+
+# --- Distance Rings ---
+def get_distance_rings() -> list[float]:
+    """Returns the outer ring edges in km, ascending (distance_rings in pretix.cfg)."""
+    value = get_setting('distance_rings')
+    if not value:
+        return list(DEFAULT_DISTANCE_RINGS)
+    try:
+        edges = sorted({float(edge) for edge in value.split(',') if edge.strip()})
+    except ValueError as e:
+        logger.warning(f"Invalid distance_rings '{value}' under [pretix_mapplugin] in pretix.cfg: {e}. Using default.")
+        return list(DEFAULT_DISTANCE_RINGS)
+    return [edge for edge in edges if edge > 0] or list(DEFAULT_DISTANCE_RINGS)
+
+
+def get_ring_key(distance: float, edges: list[float]) -> str:
+    """Returns the key of the ring containing `distance` (km), e.g. '10-25' or '500+'."""
+    lower = 0.0
+    for edge in edges:
+        if distance < edge:
+            return f'{lower:g}-{edge:g}'
+        lower = edge
+    return f'{lower:g}+'
+
+
+def ring_sort_key(key: str) -> float:
+    """Sorts ring keys by their inner edge."""
+    return float(key.split('-')[0].rstrip('+'))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in km."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def get_venue_location(event) -> tuple[float, float] | None:
+    """Returns the event's location (geo_lat, geo_lon from the event settings), or None if not set."""
+    if event.geo_lat is None or event.geo_lon is None:
+        return None
+    return float(event.geo_lat), float(event.geo_lon)
+
+
+def get_aggregates_basis(event) -> str:
+    """
+    Describes what the distance rings of an event are counted from: its
+    venue location and the ring edges, or '' without a venue. Stored as the
+    key of the total row, so aggregates are rebuilt once either changes.
+    """
+    venue = get_venue_location(event)
+    if venue is None:
+        return ''
+    edges = ','.join(f'{edge:g}' for edge in get_distance_rings())
+    return f'{venue[0]:g},{venue[1]:g} {edges}'[:AGGREGATE_KEY_LENGTH]
+
+
+# --- Computing ---
+def compute_event_aggregates(event) -> dict[str, Counter]:
+    """
+    Counts the event's geocoded orders per country, city, postcode and
+    distance ring around the venue, reading all needed columns with a single
+    streamed query. Cities are grouped case-insensitively per country and
+    labelled with their most common spelling. Without a venue location there
+    are no rings.
+
+    Returns:
+        A dict mapping each dimension (see EventGeoAggregate) to a Counter of keys.
+    """
+    venue = get_venue_location(event)
+    edges = get_distance_rings()
+    counts = {dimension: Counter() for dimension, _ in EventGeoAggregate.DIMENSION_CHOICES}
+    city_spellings = {}  # (country, case-folded city) -> Counter of spellings
+
+    rows = OrderGeocodeData.objects.filter(
+        event=event,
+        latitude__isnull=False,
+        longitude__isnull=False,
+    ).values_list(
+        'latitude', 'longitude',
+        'order__invoice_address__country', 'order__invoice_address__city', 'order__invoice_address__zipcode',
+    ).order_by()
+    for latitude, longitude, country, city, zipcode in rows.iterator(chunk_size=AGGREGATES_CHUNK_SIZE):
+        counts[EventGeoAggregate.DIMENSION_TOTAL][''] += 1
+        country = str(country or '').upper()
+        if country:
+            counts[EventGeoAggregate.DIMENSION_COUNTRY][country] += 1
+        city = ' '.join((city or '').split())
+        if city:
+            city_spellings.setdefault((country, city.casefold()), Counter())[city] += 1
+        zipcode = ''.join((zipcode or '').split()).upper()
+        if zipcode:
+            counts[EventGeoAggregate.DIMENSION_POSTCODE][f'{country} {zipcode}'.strip()[:AGGREGATE_KEY_LENGTH]] += 1
+        if venue is not None:
+            distance = haversine_km(venue[0], venue[1], latitude, longitude)
+            counts[EventGeoAggregate.DIMENSION_RING][get_ring_key(distance, edges)] += 1
+
+    for (country, _), spellings in city_spellings.items():
+        spelling = min(spellings, key=lambda s: (-spellings[s], s))
+        suffix = f' ({country})' if country else ''
+        key = spelling[:AGGREGATE_KEY_LENGTH - len(suffix)] + suffix
+        counts[EventGeoAggregate.DIMENSION_CITY][key] += sum(spellings.values())
+    return counts
+
+
+def refresh_event_aggregates(event, if_outdated: bool = False) -> int:
+    """
+    Rebuilds the stored aggregates of one event in a single transaction.
+    The total row marks the aggregates as built, its key records the venue
+    and rings they were counted with (see `get_aggregates_basis`).
+
+    Rebuilds of the same event (the task and the statistics view) are
+    serialized by locking the event's row, otherwise both could insert the
+    same keys after deleting the old ones. With `if_outdated`, aggregates
+    another rebuild made up to date while waiting for the lock are kept.
+
+    Returns:
+        The number of geocoded orders counted.
+    """
+    with transaction.atomic():
+        # FOR NO KEY UPDATE does not block orders being created for the event meanwhile
+        list(Event.objects.select_for_update(no_key=True).filter(pk=event.pk).values_list('pk', flat=True))
+        basis = get_aggregates_basis(event)
+        if if_outdated:
+            existing = EventGeoAggregate.objects.filter(
+                event=event, dimension=EventGeoAggregate.DIMENSION_TOTAL, key=basis
+            ).values_list('count', flat=True).first()
+            if existing is not None:
+                return existing
+
+        counts = compute_event_aggregates(event)
+        total = counts[EventGeoAggregate.DIMENSION_TOTAL].pop('', 0)
+        counts[EventGeoAggregate.DIMENSION_TOTAL][basis] = total  # Stored even if 0
+        rows = [
+            EventGeoAggregate(event=event, dimension=dimension, key=key, count=count)
+            for dimension, counter in counts.items()
+            for key, count in counter.items()
+        ]
+        EventGeoAggregate.objects.filter(event=event).delete()
+        EventGeoAggregate.objects.bulk_create(rows)
+    logger.debug(f"Rebuilt geo aggregates of event {event.pk}: {total} orders, {len(rows)} rows.")
+    return total
+
+
+def schedule_aggregate_refresh(event_ids):
+    """
+    Debounced trigger for `refresh_event_aggregates_task`: per event, only one
+    rebuild is queued per `aggregates_delay` window, no matter how many of its
+    orders are geocoded meanwhile.
+    """
+    # tasks.py imports persistence.py, which calls this function
+    from .tasks import refresh_event_aggregates_task
+
+    delay = get_int_setting('aggregates_delay', DEFAULT_AGGREGATES_DELAY)
+    for event_id in set(event_ids):
+        if cache.add(f'{AGGREGATES_SCHEDULED_CACHE_PREFIX}:{event_id}', 1, timeout=max(delay * 2, 60)):
+            refresh_event_aggregates_task.apply_async(args=[event_id], countdown=delay)
+            logger.debug(f"Geo aggregates of event {event_id} scheduled for a rebuild in {delay}s.")
+
+
+# --- Reading ---
+def get_event_aggregates(event, limit: int) -> dict:
+    """
+    Returns the stored aggregates of an event: the total, all distance rings
+    (innermost first) and the `limit` largest countries, cities and postcodes.
+    Aggregates of events that were never built, or built before the venue
+    location or the distance rings changed, are rebuilt first.
+    """
+    basis = get_aggregates_basis(event)
+    rows = list(EventGeoAggregate.objects.filter(event=event).values_list('dimension', 'key', 'count', 'updated_at'))
+    if (EventGeoAggregate.DIMENSION_TOTAL, basis) not in {(dimension, key) for dimension, key, _, _ in rows}:
+        refresh_event_aggregates(event, if_outdated=True)
+        rows = list(
+            EventGeoAggregate.objects.filter(event=event).values_list('dimension', 'key', 'count', 'updated_at')
+        )
+
+    by_dimension = {dimension: [] for dimension, _ in EventGeoAggregate.DIMENSION_CHOICES}
+    updated_at = None
+    for dimension, key, count, row_updated_at in rows:
+        by_dimension.setdefault(dimension, []).append({'key': key, 'count': count})
+        updated_at = max(updated_at, row_updated_at) if updated_at else row_updated_at
+
+    def top(dimension):
+        return sorted(by_dimension[dimension], key=lambda item: (-item['count'], item['key']))[:limit]
+
+    totals = by_dimension[EventGeoAggregate.DIMENSION_TOTAL]
+    return {
+        'total': totals[0]['count'] if totals else 0,
+        'updated_at': updated_at,
+        'rings': sorted(by_dimension[EventGeoAggregate.DIMENSION_RING], key=lambda item: ring_sort_key(item['key'])),
+        'countries': top(EventGeoAggregate.DIMENSION_COUNTRY),
+        'cities': top(EventGeoAggregate.DIMENSION_CITY),
+        'postcodes': top(EventGeoAggregate.DIMENSION_POSTCODE),
+    }
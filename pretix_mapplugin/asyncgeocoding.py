@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import random
+import time
+
+from geopy.adapters import AioHTTPAdapter
+from geopy.exc import GeocoderRateLimited, GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
+
+from .backends import GeocoderBackend, GeopyBackend
+from .config import get_bool_setting, get_float_setting, get_int_setting
+from .geocoding import GeocodeOutcome, get_query_ladder
+from .metrics import geocode_request_duration, geocode_request_retries, inc, observe
+from .models import OrderGeocodeData
+from .ratelimit import get_rate_limiter
+
+try:
+    import aiohttp
+except ImportError:  # Optional (pretix-map[async]), only needed for the async engine
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# async_geocoding: Use the async engine in the batch task (the management command has --async).
+# async_retries: Retries of a request that timed out, was rate limited or hit an unavailable service.
+# async_backoff: Seconds before the first retry, doubled for every further one (plus jitter).
+# <identifier>_per_host_limit: Open connections per host (default: the backend's concurrency).
+DEFAULT_ASYNC_RETRIES = 3
+DEFAULT_ASYNC_BACKOFF = 0.5
+RETRYABLE_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited)
+
+
+def async_geocoding_enabled() -> bool:
+    return get_bool_setting('async_geocoding', False)
+
+
+class LimitedAioHTTPAdapter(AioHTTPAdapter):
+    """geopy's aiohttp adapter with a bounded, keep-alive connection pool per host."""
+
+    def __init__(self, *, proxies, ssl_context, limit: int = 100, limit_per_host: int = 0):
+        super().__init__(proxies=proxies, ssl_context=ssl_context)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+
+    @property
+    def session(self):
+        session = self.__dict__.get('session')
+        if session is None:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host),
+                trust_env=False,
+                raise_for_status=False,
+            )
+            self.__dict__['session'] = session
+        return session
+
+
+class AsyncGeocodingEngine:
+    """
+    Geocodes many addresses with many requests in flight, for providers that
+    allow it (e.g. self-hosted Nominatim or Photon). At most `concurrency`
+    requests run at once and at most `per_host_limit` connections are opened
+    per host. Requests that time out, are rate limited or hit an unavailable
+    service are retried with exponential backoff. The shared rate limiters
+    of the backend and its fallback are respected, so the engine never
+    exceeds their configured rates.
+
+    Backends without an async geopy geocoder are run in threads.
+    """
+
+    def __init__(self, backend: GeocoderBackend, rate_limiter=None, concurrency: int | None = None,
+                 per_host_limit: int | None = None, max_retries: int | None = None, backoff: float | None = None,
+                 fallback_rate_limiter=None):
+        if aiohttp is None and isinstance(backend, GeopyBackend):
+            raise ImportError("The async geocoding engine requires aiohttp (pip install pretix-map[async]).")
+        self.backend = backend
+        self.rate_limiter = rate_limiter if rate_limiter is not None and rate_limiter.enabled else None
+        # Same limiter as geocode_address_with_status uses for the fallback, e.g. 1/s for public Nominatim
+        if fallback_rate_limiter is None and backend.fallback is not None and backend.fallback.get_rate_limit() > 0:
+            fallback_rate_limiter = get_rate_limiter(backend=backend.fallback.identifier)
+        self.fallback_rate_limiter = (fallback_rate_limiter if fallback_rate_limiter is not None
+                                      and fallback_rate_limiter.enabled else None)
+        self.concurrency = max(1, concurrency or backend.concurrency)
+        self.per_host_limit = max(1, per_host_limit or backend.get_int_option('per_host_limit', self.concurrency))
+        self.max_retries = max(0, max_retries if max_retries is not None
+                               else get_int_setting('async_retries', DEFAULT_ASYNC_RETRIES))
+        self.backoff = backoff if backoff is not None else get_float_setting('async_backoff', DEFAULT_ASYNC_BACKOFF)
+
+    def create_adapter(self, proxies, ssl_context):
+        return LimitedAioHTTPAdapter(proxies=proxies, ssl_context=ssl_context,
+                                     limit=self.concurrency, limit_per_host=self.per_host_limit)
+
+    # --- Single Request ---
+    async def _wait_for_rate_limiter(self, rate_limiter=None):
+        rate_limiter = rate_limiter or self.rate_limiter
+        if rate_limiter is None:
+            return
+        # The limiter talks to the Django cache, keep that off the event loop
+        wait = await asyncio.to_thread(rate_limiter.reserve)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _request(self, geocoder, address_string: str, components: dict | None):
+        await self._wait_for_rate_limiter()
+        started = time.perf_counter()
+        status = OrderGeocodeData.STATUS_SERVICE_ERROR
+        try:
+            if geocoder is None:
+                coordinates = await asyncio.to_thread(self.backend.geocode, address_string, components)
+            else:
+                query, options = self.backend.build_query(address_string, components)
+                location = await geocoder.geocode(query, timeout=self.backend.timeout, **options)
+                coordinates = (location.latitude, location.longitude) if location else None
+            status = OrderGeocodeData.STATUS_OK if coordinates else OrderGeocodeData.STATUS_NOT_FOUND
+            return coordinates
+        except GeocoderTimedOut:
+            status = OrderGeocodeData.STATUS_TIMEOUT
+            raise
+        finally:
+            observe(geocode_request_duration, time.perf_counter() - started,
+                    backend=self.backend.identifier, status=status)
+
+    async def _geocode_query(self, geocoder, address_string: str,
+                             components: dict | None) -> tuple[tuple[float, float] | None, str]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                coordinates = await self._request(geocoder, address_string, components)
+                return coordinates, OrderGeocodeData.STATUS_OK if coordinates else OrderGeocodeData.STATUS_NOT_FOUND
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"Geocoding failed for '{address_string}' after {attempt + 1} attempts: {e!r}")
+                    if isinstance(e, GeocoderTimedOut):
+                        return None, OrderGeocodeData.STATUS_TIMEOUT
+                    return None, OrderGeocodeData.STATUS_SERVICE_ERROR
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                if isinstance(e, GeocoderRateLimited) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                logger.debug(f"Retrying '{address_string}' in {delay:.2f}s after {e!r}")
+                inc(geocode_request_retries, backend=self.backend.identifier)
+                await asyncio.sleep(delay)
+            except GeocoderServiceError as e:
+                logger.error(f"Geocoding service error for address '{address_string}': {e}")
+                return None, OrderGeocodeData.STATUS_SERVICE_ERROR
+            except Exception as e:
+                logger.exception(f"An unexpected error occurred during geocoding for address '{address_string}': {e}")
+                return None, OrderGeocodeData.STATUS_SERVICE_ERROR
+
+    async def _geocode_fallback(self, address_string: str, components: dict | None) -> tuple[float, float] | None:
+        if self.fallback_rate_limiter is not None:
+            await self._wait_for_rate_limiter(self.fallback_rate_limiter)
+        try:
+            return await asyncio.to_thread(self.backend.fallback.geocode, address_string, components)
+        except Exception as e:
+            logger.error(f"Fallback geocoder {self.backend.fallback.identifier} failed for '{address_string}': {e}")
+            return None
+
+    async def _geocode_one(self, geocoder, semaphore: asyncio.Semaphore, address_string: str,
+                           components: dict | None) -> GeocodeOutcome:
+        # Same ladder as geocode_address_with_status: coarser queries only for addresses that were not found
+        status = OrderGeocodeData.STATUS_NOT_FOUND
+        async with semaphore:
+            for level, query, query_components in get_query_ladder(address_string, components):
+                coordinates, status = await self._geocode_query(geocoder, query, query_components)
+                if coordinates:
+                    return GeocodeOutcome(coordinates, OrderGeocodeData.STATUS_OK, self.backend.match_level or level)
+                if self.backend.fallback is not None:
+                    coordinates = await self._geocode_fallback(query, query_components)
+                    if coordinates:
+                        return GeocodeOutcome(coordinates, OrderGeocodeData.STATUS_OK,
+                                              self.backend.fallback.match_level or level)
+                if status != OrderGeocodeData.STATUS_NOT_FOUND:
+                    break
+        logger.warning(f"Could not geocode address: {address_string} ({status})")
+        return GeocodeOutcome(None, status)
+
+    # --- Many Requests ---
+    async def geocode_many_async(self, queries: dict) -> dict:
+        """
+        Geocodes all queries concurrently.
+
+        Args:
+            queries: Mapping of any key (e.g. the address cache key) to a tuple
+                (address_string, components).
+
+        Returns:
+            A dict mapping the same keys to a `GeocodeOutcome`, see
+            `geocode_address_with_status`.
+        """
+        if not queries:
+            return {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        keys = list(queries)
+
+        async def run(geocoder):
+            results = await asyncio.gather(*(
+                self._geocode_one(geocoder, semaphore, *queries[key]) for key in keys
+            ))
+            return dict(zip(keys, results))
+
+        if not isinstance(self.backend, GeopyBackend):
+            return await run(None)
+        # The async geocoder owns one aiohttp session for all requests, closed on exit
+        async with self.backend.create_geocoder(adapter_factory=self.create_adapter) as geocoder:
+            return await run(geocoder)
+
+    def geocode_many(self, queries: dict) -> dict:
+        """Synchronous entry point for tasks and commands, see `geocode_many_async`."""
+        return asyncio.run(self.geocode_many_async(queries))
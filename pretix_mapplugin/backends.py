@@ -0,0 +1,270 @@
+import logging
+import os
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from geopy.adapters import RequestsAdapter
+from geopy.exc import GeocoderServiceError
+from geopy.geocoders import Nominatim, Photon
+
+from .config import get_float_setting, get_int_setting, get_setting
+from .models import OrderGeocodeData
+from .postcodes import get_postcode_table
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# geocoder: Identifier of a built-in backend (see GEOCODER_BACKENDS) or dotted path to a GeocoderBackend subclass.
+# Per backend, <identifier>_rate_limit, <identifier>_timeout and <identifier>_concurrency override the
+# backend's defaults, e.g. photon_url=http://photon.internal:2322 and photon_concurrency=16.
+DEFAULT_GEOCODER = 'nominatim'
+# geocoder_fallback: Backend tried when the primary one finds nothing or fails, e.g. postcode (unset: none).
+# postcode_file: Table used by the postcode backend, default in pretix' data directory.
+DEFAULT_POSTCODE_FILE_NAME = 'pretix_mapplugin_postcodes.bin'
+# <identifier>_pool_size: Keep-alive connections kept open to the service (default: the backend's concurrency).
+# <identifier>_http_retries: Retries of failed connections (not of HTTP errors) by the HTTP session.
+DEFAULT_HTTP_RETRIES = 2
+
+
+class GeocoderBackend:
+    """
+    Base class of the services addresses are geocoded with. A backend turns an
+    address into (latitude, longitude) and declares how it may be used: the
+    request rate shared by all workers, the timeout of a single request and
+    how many requests may be in flight at once.
+
+    Subclasses set `identifier` (used as prefix of their settings) and
+    implement `geocode`. Errors of the service are raised as geopy exceptions
+    (GeocoderTimedOut, GeocoderServiceError, ...), "not found" returns None.
+    """
+    identifier = None
+    verbose_name = None
+    default_rate_limit = 0.0  # Requests per second, 0 disables limiting
+    default_timeout = 10.0
+    default_concurrency = 1
+    match_level = None  # Precision of every result if coarser than the query, e.g. postcode centroids
+
+    def __init__(self, user_agent: str | None = None):
+        self.user_agent = user_agent
+        self.fallback = None  # Set by get_geolocator if geocoder_fallback is configured
+        self.timeout = self.get_float_option('timeout', self.default_timeout)
+        self.concurrency = max(1, self.get_int_option('concurrency', self.default_concurrency))
+
+    # --- Per-backend Settings ---
+    @classmethod
+    def option_name(cls, option: str) -> str:
+        return f'{cls.identifier}_{option}'
+
+    @classmethod
+    def get_option(cls, option: str, fallback: str | None = None) -> str | None:
+        return get_setting(cls.option_name(option), fallback)
+
+    @classmethod
+    def get_int_option(cls, option: str, fallback: int) -> int:
+        return get_int_setting(cls.option_name(option), fallback)
+
+    @classmethod
+    def get_float_option(cls, option: str, fallback: float) -> float:
+        return get_float_setting(cls.option_name(option), fallback)
+
+    @classmethod
+    def get_rate_limit(cls) -> float:
+        """Requests per second allowed across all workers, 0 for no limit."""
+        return cls.get_float_option('rate_limit', cls.default_rate_limit)
+
+    # --- Geocoding ---
+    def geocode(self, address_string: str, components: dict | None = None) -> tuple[float, float] | None:
+        """
+        Geocodes a single address.
+
+        Args:
+            address_string: The formatted address (see `get_formatted_address_from_order`).
+            components: Optional address parts (see `get_address_components_from_order`),
+                for backends that do not work with free-form addresses.
+
+        Returns:
+            A tuple (latitude, longitude), or None if the address was not found.
+        """
+        raise NotImplementedError()
+
+
+class GeopyBackend(GeocoderBackend):
+    """
+    Backend delegating to a geopy geocoder, created on first use and reused for
+    all requests. Its requests session keeps a pool of keep-alive connections,
+    large enough for `concurrency` parallel requests, so only the first
+    requests pay for the TCP and TLS handshakes.
+    """
+
+    def __init__(self, user_agent: str | None = None):
+        super().__init__(user_agent)
+        self.pool_size = max(1, self.get_int_option('pool_size', self.concurrency))
+        self.http_retries = max(0, self.get_int_option('http_retries', DEFAULT_HTTP_RETRIES))
+        self._geocoder = None
+
+    def create_adapter(self, proxies, ssl_context):
+        """Adapter factory passed to geopy, see geopy.adapters."""
+        return RequestsAdapter(proxies=proxies, ssl_context=ssl_context, pool_maxsize=self.pool_size,
+                               max_retries=self.http_retries)
+
+    def create_geocoder(self, adapter_factory=None):
+        """
+        Creates the geopy geocoder. `adapter_factory` defaults to the pooled
+        requests session, the async engine passes an asyncio adapter instead.
+        """
+        raise NotImplementedError()
+
+    @property
+    def geocoder(self):
+        if self._geocoder is None:
+            self._geocoder = self.create_geocoder()
+        return self._geocoder
+
+    def build_query(self, address_string: str, components: dict | None = None) -> tuple[str | dict, dict]:
+        """Returns the query and extra keyword arguments for the geopy geocoder's `geocode`."""
+        return address_string, {}
+
+    def geocode(self, address_string: str, components: dict | None = None) -> tuple[float, float] | None:
+        query, options = self.build_query(address_string, components)
+        location = self.geocoder.geocode(query, timeout=self.timeout, **options)
+        if not location:
+            return None
+        return location.latitude, location.longitude
+
+
+def build_nominatim_query(address_string: str, components: dict | None) -> tuple[str | dict, dict]:
+    """
+    Returns a structured Nominatim query (street, postalcode, city, state,
+    restricted to the country) if the address parts are known. Structured
+    queries cannot be misread the way a comma separated string can.
+    """
+    if not components:
+        return address_string, {}
+    query = {
+        field: components[key]
+        for field, key in (('street', 'street'), ('postalcode', 'zipcode'), ('city', 'city'), ('state', 'state'))
+        if components.get(key)
+    }
+    if not query:
+        return address_string, {}
+    options = {'country_codes': components['country'].lower()} if components.get('country') else {}
+    return query, options
+
+
+class NominatimBackend(GeopyBackend):
+    """Public Nominatim (OpenStreetMap). Its usage policy allows one request per second."""
+    identifier = 'nominatim'
+    verbose_name = 'Nominatim (nominatim.openstreetmap.org)'
+    default_rate_limit = 1.0
+
+    def build_query(self, address_string: str, components: dict | None = None) -> tuple[str | dict, dict]:
+        return build_nominatim_query(address_string, components)
+
+    @classmethod
+    def get_rate_limit(cls) -> float:
+        # rate_limit predates per-backend settings and keeps applying to the public service
+        return cls.get_float_option('rate_limit', get_float_setting('rate_limit', cls.default_rate_limit))
+
+    def create_geocoder(self, adapter_factory=None):
+        return Nominatim(user_agent=self.user_agent, timeout=self.timeout,
+                         adapter_factory=adapter_factory or self.create_adapter)
+
+
+class SelfHostedGeopyBackend(GeopyBackend):
+    """
+    Base for self-hosted services configured with <identifier>_url. These are
+    not throttled by default and serve several requests at once.
+    """
+    default_rate_limit = 0.0
+    default_concurrency = 8
+    geocoder_class = None
+
+    def __init__(self, user_agent: str | None = None):
+        super().__init__(user_agent)
+        url = self.get_option('url')
+        if not url:
+            raise ValueError(f"Geocoder '{self.identifier}' requires '{self.option_name('url')}' "
+                             f"under [pretix_mapplugin] in pretix.cfg.")
+        parts = urlsplit(url if '://' in url else f'https://{url}')
+        self.scheme = parts.scheme
+        self.domain = f'{parts.netloc}{parts.path}'.rstrip('/')
+
+    def create_geocoder(self, adapter_factory=None):
+        return self.geocoder_class(domain=self.domain, scheme=self.scheme, user_agent=self.user_agent,
+                                   timeout=self.timeout, adapter_factory=adapter_factory or self.create_adapter)
+
+
+class SelfHostedNominatimBackend(SelfHostedGeopyBackend):
+    identifier = 'nominatim_selfhosted'
+    verbose_name = 'Nominatim (self-hosted)'
+    geocoder_class = Nominatim
+
+    def build_query(self, address_string: str, components: dict | None = None) -> tuple[str | dict, dict]:
+        return build_nominatim_query(address_string, components)
+
+
+class PhotonBackend(SelfHostedGeopyBackend):
+    identifier = 'photon'
+    verbose_name = 'Photon (self-hosted)'
+    geocoder_class = Photon
+
+
+class PostcodeCentroidBackend(GeocoderBackend):
+    """
+    Offline backend resolving (country, postcode) to the centroid of the
+    postcode area, without any network request. Looks up the binary table
+    configured with postcode_file, built from a GeoNames postal code dump
+    with the import_postcode_centroids command (see postcodes.py).
+    """
+    identifier = 'postcode'
+    verbose_name = 'Postcode centroids (offline)'
+    default_concurrency = 1
+    default_timeout = 0.0
+    match_level = OrderGeocodeData.MATCH_POSTCODE
+
+    def __init__(self, user_agent: str | None = None):
+        super().__init__(user_agent)
+        self.path = get_postcode_file_path()
+
+    def geocode(self, address_string: str, components: dict | None = None) -> tuple[float, float] | None:
+        if not components or not components.get('country') or not components.get('zipcode'):
+            logger.debug(f"No country or postcode to look up for '{address_string}'.")
+            return None
+        try:
+            table = get_postcode_table(self.path)
+        except (OSError, ValueError) as e:
+            raise GeocoderServiceError(f"Postcode table {self.path} not available: {e}")
+        return table.lookup(components['country'], components['zipcode'])
+
+
+def get_postcode_file_path() -> str:
+    """Returns the postcode table location: postcode_file from pretix.cfg or a file in pretix' data directory."""
+    return get_setting('postcode_file') or os.path.join(settings.DATA_DIR, DEFAULT_POSTCODE_FILE_NAME)
+
+
+# --- Backend Registry ---
+GEOCODER_BACKENDS = {
+    backend.identifier: backend
+    for backend in (NominatimBackend, SelfHostedNominatimBackend, PhotonBackend, PostcodeCentroidBackend)
+}
+
+
+def get_backend_class(identifier: str | None = None) -> type[GeocoderBackend]:
+    """
+    Returns the backend class configured with `geocoder` in pretix.cfg (or the
+    given identifier). Unknown identifiers are imported as dotted paths, so
+    other plugins or deployments can provide their own backends.
+    """
+    identifier = identifier or get_setting('geocoder', DEFAULT_GEOCODER)
+    if identifier in GEOCODER_BACKENDS:
+        return GEOCODER_BACKENDS[identifier]
+    try:
+        backend_class = import_string(identifier)
+    except ImportError as e:
+        logger.error(f"Unknown geocoder '{identifier}' configured in pretix.cfg: {e}. Using {DEFAULT_GEOCODER}.")
+        return GEOCODER_BACKENDS[DEFAULT_GEOCODER]
+    if not (isinstance(backend_class, type) and issubclass(backend_class, GeocoderBackend)):
+        logger.error(f"Geocoder '{identifier}' is not a GeocoderBackend subclass. Using {DEFAULT_GEOCODER}.")
+        return GEOCODER_BACKENDS[DEFAULT_GEOCODER]
+    return backend_class
@@ -0,0 +1,102 @@
+import logging
+import math
+
+from .aggregates import EARTH_RADIUS_KM, get_distance_rings
+from .density import load_event_coordinates
+
+try:
+    import numpy as np
+except ImportError:  # Optional (pretix-map[density]), only needed for the catchment analysis
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Percentiles of the distances between buyers and the venue that are reported
+CATCHMENT_PERCENTILES = (10, 25, 50, 75, 90, 95, 99)
+# Bins of the distance histogram, ?bins= may ask for up to MAX_HISTOGRAM_BINS
+DEFAULT_HISTOGRAM_BINS = 20
+MAX_HISTOGRAM_BINS = 200
+# The histogram ends at this percentile (one of CATCHMENT_PERCENTILES), so a few buyers from other continents don't squash it
+HISTOGRAM_RANGE_PERCENTILE = 99
+# Decimal places of distances in km (10m)
+DISTANCE_PRECISION = 2
+
+
+def catchment_available() -> bool:
+    return np is not None
+
+
+def haversine_km_many(latitude: float, longitude: float, latitudes, longitudes):
+    """Great-circle distances in km from one point to arrays of points, vectorized (see `haversine_km`)."""
+    phi1 = math.radians(latitude)
+    phi2 = np.radians(latitudes)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * np.cos(phi2) * np.sin(np.radians(longitudes - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def compute_catchment(latitudes, longitudes, venue: tuple[float, float], edges: list[float],
+                      bins: int = DEFAULT_HISTOGRAM_BINS) -> dict:
+    """
+    Describes how far buyers travel to the venue: percentiles of the
+    distances, the number of orders per distance ring (as in the statistics,
+    plus the cumulative number within its outer edge) and a histogram.
+    All computed on whole arrays, without a loop over the orders.
+
+    Args:
+        latitudes, longitudes: NumPy arrays of the orders' coordinates.
+        venue: (latitude, longitude) distances are measured from.
+        edges: Outer ring edges in km, ascending (see `get_distance_rings`).
+        bins: Number of equal-width histogram bins.
+    """
+    distances = haversine_km_many(venue[0], venue[1], latitudes, longitudes)
+    count = len(distances)
+
+    # Ring i holds distances from edges[i - 1] (inclusive) up to edges[i], the last one is open-ended
+    ring_counts = np.bincount(np.searchsorted(edges, distances, side='right'), minlength=len(edges) + 1)
+    rings = []
+    within = 0
+    for i, ring_count in enumerate(ring_counts.tolist()):
+        inner = edges[i - 1] if i else 0.0
+        outer = edges[i] if i < len(edges) else None
+        within += ring_count
+        rings.append({
+            'key': f'{inner:g}-{outer:g}' if outer is not None else f'{inner:g}+',
+            'inner_km': inner,
+            'outer_km': outer,
+            'count': ring_count,
+            'within': within,
+            'share': round(within / count, 4) if count else 0.0,
+        })
+
+    data = {
+        'venue': {'lat': venue[0], 'lon': venue[1]},
+        'count': count,
+        'rings': rings,
+        'percentiles': {},
+        'mean_km': None,
+        'max_km': None,
+        'histogram': None,
+    }
+    if not count:
+        return data
+
+    values = np.percentile(distances, CATCHMENT_PERCENTILES)
+    data['percentiles'] = {f'p{p}': round(float(v), DISTANCE_PRECISION) for p, v in zip(CATCHMENT_PERCENTILES, values)}
+    data['mean_km'] = round(float(distances.mean()), DISTANCE_PRECISION)
+    data['max_km'] = round(float(distances.max()), DISTANCE_PRECISION)
+
+    upper = max(float(values[CATCHMENT_PERCENTILES.index(HISTOGRAM_RANGE_PERCENTILE)]), 1.0)
+    counts, bin_edges = np.histogram(distances, bins=bins, range=(0.0, upper))
+    data['histogram'] = {
+        'edges_km': [round(float(edge), DISTANCE_PRECISION) for edge in bin_edges],
+        'counts': counts.tolist(),
+        'overflow': int(np.count_nonzero(distances > upper)),
+    }
+    return data
+
+
+def get_event_catchment(event, venue: tuple[float, float], bins: int = DEFAULT_HISTOGRAM_BINS) -> dict:
+    """Loads the event's coordinates with a single query and computes its catchment around `venue`."""
+    latitudes, longitudes = load_event_coordinates(event)
+    return compute_catchment(latitudes, longitudes, venue, get_distance_rings(), bins)
@@ -0,0 +1,50 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Section in pretix.cfg holding all settings of this plugin, e.g.
+#
+#   [pretix_mapplugin]
+#   cache_ttl_days=180
+PLUGIN_CONFIG_SECTION = 'pretix_mapplugin'
+
+
+# --- Generic Accessors for [pretix_mapplugin] in pretix.cfg ---
+def _read_setting(getter_name: str, option: str, fallback):
+    """
+    Reads a single option from the plugin's section of pretix.cfg using the
+    given getter of pretix' config object ('get', 'getint', ...).
+
+    Falls back (and logs) if the config is unavailable or the value is invalid,
+    so a typo in pretix.cfg never breaks geocoding or the map.
+    """
+    config = getattr(settings, 'CONFIG_FILE', None)
+    if config is None:
+        return fallback
+    try:
+        return getattr(config, getter_name)(PLUGIN_CONFIG_SECTION, option, fallback=fallback)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid value for '{option}' under [{PLUGIN_CONFIG_SECTION}] in pretix.cfg: {e}. "
+                       f"Using default ({fallback}).")
+        return fallback
+    except Exception as e:
+        logger.error(f"Could not read '{option}' under [{PLUGIN_CONFIG_SECTION}] from pretix.cfg: {e}")
+        return fallback
+
+
+def get_setting(option: str, fallback: str | None = None) -> str | None:
+    return _read_setting('get', option, fallback)
+
+
+def get_int_setting(option: str, fallback: int) -> int:
+    return _read_setting('getint', option, fallback)
+
+
+def get_float_setting(option: str, fallback: float) -> float:
+    return _read_setting('getfloat', option, fallback)
+
+
+def get_bool_setting(option: str, fallback: bool) -> bool:
+    return _read_setting('getboolean', option, fallback)
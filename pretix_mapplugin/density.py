@@ -0,0 +1,336 @@
+import logging
+import math
+import struct
+import time
+import zlib
+from functools import lru_cache
+from itertools import chain
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from .config import get_float_setting, get_int_setting
+from .geohash import bbox_prefixes
+from .metrics import density_tile_render_duration, observe
+from .models import OrderGeocodeData
+
+try:
+    import numpy as np
+except ImportError:  # Optional, only needed for the density tiles
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# density_radius: Kernel radius in pixels of tiles requested without ?radius=.
+# density_saturation: Orders per kernel at which the heatmap reaches full intensity (log scale below).
+# density_tile_cache_timeout: Seconds rendered tiles are kept in the cache.
+# density_prerender_max_zoom: Tiles up to this zoom level are rendered in the background after new
+#   coordinates arrive (-1 to only render tiles on request).
+# density_prerender_delay: Seconds between a write to an event's geocode data and pre-rendering its tiles,
+#   collecting further writes meanwhile.
+DEFAULT_DENSITY_RADIUS = 25
+DEFAULT_DENSITY_SATURATION = 100.0
+DEFAULT_DENSITY_TILE_CACHE_TIMEOUT = 24 * 3600
+DEFAULT_DENSITY_PRERENDER_MAX_ZOOM = 7
+DEFAULT_DENSITY_PRERENDER_DELAY = 60
+DENSITY_TILE_CACHE_PREFIX = 'pretix_mapplugin:density'
+DENSITY_PRERENDER_SCHEDULED_CACHE_PREFIX = 'pretix_mapplugin:density:scheduled'
+
+TILE_SIZE = 256
+# Highest zoom level served, matching the tile layer's maxZoom
+DENSITY_MAX_ZOOM = 18
+MIN_DENSITY_RADIUS = 1
+MAX_DENSITY_RADIUS = 100
+# Web Mercator is cut off at this latitude
+MAX_LATITUDE = 85.0511287798
+# Rows read per round trip while loading coordinates
+COORDINATES_CHUNK_SIZE = 5000
+# Colour stops of the heatmap (intensity -> RGB), the same as leaflet.heat's default gradient
+GRADIENT = ((0.0, (0, 0, 255)), (0.4, (0, 0, 255)), (0.6, (0, 255, 255)), (0.7, (0, 255, 0)),
+            (0.8, (255, 255, 0)), (1.0, (255, 0, 0)))
+# Opacity stops (intensity -> alpha), so sparse areas stay see-through
+OPACITY = ((0.0, 0), (0.02, 0), (0.4, 160), (1.0, 220))
+
+
+def density_tiles_available() -> bool:
+    return np is not None
+
+
+# --- Loading Coordinates ---
+def load_event_coordinates(event, bbox: tuple[float, float, float, float] | None = None, timestamps: bool = False):
+    """
+    Loads the coordinates of an event's geocoded orders, optionally only
+    inside a bounding box (west, south, east, north), with a single query.
+
+    Returns:
+        Two float64 NumPy arrays (latitudes, longitudes), with `timestamps`
+        a third one of their last_geocoded_at (POSIX time, 0 if unknown).
+    """
+    rows = OrderGeocodeData.objects.filter(
+        event=event,
+        latitude__isnull=False,
+        longitude__isnull=False,
+    )
+    if bbox is not None:
+        rows = rows.filter(_bbox_filter(*bbox))
+    if not timestamps:
+        rows = rows.values_list('latitude', 'longitude').order_by()
+        flat = np.fromiter(chain.from_iterable(rows.iterator(chunk_size=COORDINATES_CHUNK_SIZE)), dtype=np.float64)
+        points = flat.reshape(-1, 2)
+        return points[:, 0], points[:, 1]
+
+    rows = rows.values_list('latitude', 'longitude', 'last_geocoded_at').order_by()
+    flat = np.fromiter(chain.from_iterable(
+        (latitude, longitude, geocoded_at.timestamp() if geocoded_at else 0.0)
+        for latitude, longitude, geocoded_at in rows.iterator(chunk_size=COORDINATES_CHUNK_SIZE)
+    ), dtype=np.float64)
+    points = flat.reshape(-1, 3)
+    return points[:, 0], points[:, 1], points[:, 2]
+
+
+def _bbox_filter(west: float, south: float, east: float, north: float) -> Q:
+    # Range scans on the (event, geohash) index, refined by the exact bounding box
+    prefix_filter = Q()
+    for prefix in bbox_prefixes(west, south, east, north):
+        prefix_filter |= Q(geohash__startswith=prefix)
+    return prefix_filter & Q(latitude__gte=south, latitude__lte=north, longitude__gte=west, longitude__lte=east)
+
+
+# --- Tile Geometry (Web Mercator, as used by the map's tile layers) ---
+def project(latitudes, longitudes, zoom: int):
+    """Converts coordinates to global pixel positions at `zoom`, vectorized."""
+    scale = TILE_SIZE * 2 ** zoom
+    sin = np.sin(np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE)))
+    x = (longitudes + 180.0) / 360.0 * scale
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def tile_bbox(zoom: int, x: int, y: int, margin: int = 0) -> tuple[float, float, float, float]:
+    """Returns (west, south, east, north) of a tile, grown by `margin` pixels on each side."""
+    scale = TILE_SIZE * 2 ** zoom
+
+    def longitude(px):
+        return min(max(px, 0), scale) / scale * 360.0 - 180.0
+
+    def latitude(py):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * min(max(py, 0), scale) / scale))))
+
+    return (longitude(x * TILE_SIZE - margin), latitude((y + 1) * TILE_SIZE + margin),
+            longitude((x + 1) * TILE_SIZE + margin), latitude(y * TILE_SIZE - margin))
+
+
+def get_covered_tiles(px, py, timestamps, zoom: int, radius: int) -> list[tuple[int, int, int, float]]:
+    """
+    Returns (x, y, count, last) of all tiles a kernel of `radius` around any
+    of the pixel positions reaches: the number of positions within the tile
+    grown by `radius` (see `tile_bbox`) and their latest timestamp. Computed
+    on whole arrays, as `get_tile_version` would from the database per tile.
+    """
+    tiles_per_axis = 2 ** zoom
+    # With radius < TILE_SIZE, the grown tiles containing a position are at most two in each direction
+    xs = [np.clip(np.floor((px + d) / TILE_SIZE), 0, tiles_per_axis - 1).astype(np.int64) for d in (-radius, radius)]
+    ys = [np.clip(np.floor((py + d) / TILE_SIZE), 0, tiles_per_axis - 1).astype(np.int64) for d in (-radius, radius)]
+    # Each position counts once per tile, even if several corners of its kernel fall into it
+    other_x, other_y = xs[1] != xs[0], ys[1] != ys[0]
+    masks = {(0, 0): np.ones(len(px), dtype=bool), (1, 0): other_x, (0, 1): other_y, (1, 1): other_x & other_y}
+    indices = np.concatenate([(xs[i] * tiles_per_axis + ys[j])[mask] for (i, j), mask in masks.items()])
+    stamps = np.concatenate([timestamps[mask] for mask in masks.values()])
+
+    tiles, inverse, counts = np.unique(indices, return_inverse=True, return_counts=True)
+    last = np.zeros(len(tiles))
+    np.maximum.at(last, inverse, stamps)
+    return [(int(tile) // tiles_per_axis, int(tile) % tiles_per_axis, int(count), float(stamp))
+            for tile, count, stamp in zip(tiles, counts, last)]
+
+
+# --- Kernel Density ---
+@lru_cache(maxsize=16)
+def _kernel_band(radius: int):
+    """
+    Banded matrix applying a 1-D Gaussian kernel (peak 1, sigma radius/3) to
+    a row of TILE_SIZE + 2 * radius pixels, giving the TILE_SIZE pixels of the tile.
+    """
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / (radius / 3)) ** 2)
+    band = np.zeros((TILE_SIZE, TILE_SIZE + 2 * radius))
+    rows = np.arange(TILE_SIZE)[:, None]
+    band[rows, rows + offsets + radius] = kernel
+    band.setflags(write=False)
+    return band
+
+
+def render_density_grid(px, py, x: int, y: int, radius: int):
+    """
+    Kernel density of one tile: the points (global pixel positions) are
+    binned into pixels, including a margin of `radius` so kernels of points
+    on neighbouring tiles reach in, and blurred with a separable Gaussian as
+    two matrix products.
+
+    Returns:
+        A TILE_SIZE x TILE_SIZE float array, 1.0 is the peak of a single order.
+    """
+    size = TILE_SIZE + 2 * radius
+    cols = px - (x * TILE_SIZE - radius)
+    rows = py - (y * TILE_SIZE - radius)
+    inside = (cols >= 0) & (cols < size) & (rows >= 0) & (rows < size)
+    cells = rows[inside].astype(np.int64) * size + cols[inside].astype(np.int64)
+    counts = np.bincount(cells, minlength=size * size).reshape(size, size).astype(np.float64)
+    band = _kernel_band(radius)
+    return band @ counts @ band.T
+
+
+@lru_cache(maxsize=1)
+def _colour_table():
+    """RGBA colour per intensity step (0..255), see GRADIENT and OPACITY."""
+    steps = np.linspace(0.0, 1.0, 256)
+    table = np.empty((256, 4), dtype=np.uint8)
+    for channel in range(3):
+        table[:, channel] = np.interp(steps, [s for s, _ in GRADIENT], [c[channel] for _, c in GRADIENT])
+    table[:, 3] = np.interp(steps, [s for s, _ in OPACITY], [a for _, a in OPACITY])
+    table.setflags(write=False)
+    return table
+
+
+def colourize(density, saturation: float):
+    """Maps densities to RGBA pixels on a log scale reaching full intensity at `saturation` orders."""
+    intensity = np.clip(np.log1p(density) / math.log1p(saturation), 0.0, 1.0)
+    return _colour_table()[(intensity * 255).astype(np.uint8)]
+
+
+def encode_png(rgba) -> bytes:
+    """Encodes an RGBA image (height x width x 4, uint8) as PNG, without an imaging library."""
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)  # Filter type 0 (none) per scanline
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)),
+        chunk(b'IEND', b''),
+    ))
+
+
+@lru_cache(maxsize=1)
+def empty_tile() -> bytes:
+    return encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def render_tile_png(px, py, x: int, y: int, radius: int, saturation: float) -> bytes:
+    return encode_png(colourize(render_density_grid(px, py, x, y, radius), saturation))
+
+
+# --- Cached Tiles ---
+def get_density_radius(radius: int | None = None) -> int:
+    """Returns `radius` (or the configured default) limited to MIN_DENSITY_RADIUS..MAX_DENSITY_RADIUS."""
+    if radius is None:
+        radius = get_int_setting('density_radius', DEFAULT_DENSITY_RADIUS)
+    return min(max(radius, MIN_DENSITY_RADIUS), MAX_DENSITY_RADIUS)
+
+
+def get_tile_version(event, zoom: int, x: int, y: int, radius: int) -> str:
+    """
+    Returns the version of a tile's data: the count and latest
+    last_geocoded_at of the orders whose kernels reach the tile, plus the
+    rendering settings. Writes elsewhere leave it unchanged, so only tiles
+    around new or moved coordinates are rendered again.
+    """
+    version = OrderGeocodeData.objects.filter(
+        _bbox_filter(*tile_bbox(zoom, x, y, radius)),
+        event=event,
+    ).aggregate(count=Count('order_id'), last=Max('last_geocoded_at'))
+    last = version['last'].timestamp() if version['last'] else 0
+    return _format_tile_version(version['count'], last, radius,
+                                get_float_setting('density_saturation', DEFAULT_DENSITY_SATURATION))
+
+
+def _format_tile_version(count: int, last: float, radius: int, saturation: float) -> str:
+    return f"{count}-{last or 0}-{radius}-{saturation:g}"
+
+
+def _tile_cache_key(event, zoom: int, x: int, y: int, version: str) -> str:
+    return f'{DENSITY_TILE_CACHE_PREFIX}:{event.pk}:{zoom}:{x}:{y}:{version}'
+
+
+def get_density_tile(event, zoom: int, x: int, y: int, radius: int | None = None) -> tuple[bytes, str]:
+    """
+    Returns a heatmap tile of the event as PNG, rendered from the orders
+    around it or read from the cache, and its version (see `get_tile_version`).
+    """
+    radius = get_density_radius(radius)
+    version = get_tile_version(event, zoom, x, y, radius)
+    if version.startswith('0-'):
+        return empty_tile(), version
+    cache_key = _tile_cache_key(event, zoom, x, y, version)
+    content = cache.get(cache_key)
+    if content is None:
+        started = time.perf_counter()
+        latitudes, longitudes = load_event_coordinates(event, tile_bbox(zoom, x, y, radius))
+        px, py = project(latitudes, longitudes, zoom)
+        content = render_tile_png(px, py, x, y, radius,
+                                  get_float_setting('density_saturation', DEFAULT_DENSITY_SATURATION))
+        cache.set(cache_key, content, get_int_setting('density_tile_cache_timeout', DEFAULT_DENSITY_TILE_CACHE_TIMEOUT))
+        observe(density_tile_render_duration, time.perf_counter() - started, mode='request')
+    return content, version
+
+
+def prerender_density_tiles(event) -> int:
+    """
+    Renders the event's tiles with the default radius up to
+    `density_prerender_max_zoom` from a single load of its coordinates.
+    Tiles whose version is already cached are skipped, so after new
+    coordinates arrive only the tiles around them are rendered again. Tile
+    versions are computed from the loaded coordinates as well, the same
+    as `get_tile_version` reads them for tiles requested by the map.
+
+    Returns:
+        The number of tiles rendered.
+    """
+    max_zoom = min(get_int_setting('density_prerender_max_zoom', DEFAULT_DENSITY_PRERENDER_MAX_ZOOM), DENSITY_MAX_ZOOM)
+    if np is None or max_zoom < 0:
+        return 0
+    radius = get_density_radius()
+    saturation = get_float_setting('density_saturation', DEFAULT_DENSITY_SATURATION)
+    timeout = get_int_setting('density_tile_cache_timeout', DEFAULT_DENSITY_TILE_CACHE_TIMEOUT)
+    latitudes, longitudes, timestamps = load_event_coordinates(event, timestamps=True)
+    # Like the bounding boxes of requested tiles, leave out the poles the map does not show
+    shown = np.abs(latitudes) <= tile_bbox(0, 0, 0)[3]
+    latitudes, longitudes, timestamps = latitudes[shown], longitudes[shown], timestamps[shown]
+    if not len(latitudes):
+        return 0
+
+    rendered = 0
+    for zoom in range(max_zoom + 1):
+        px, py = project(latitudes, longitudes, zoom)
+        for x, y, count, last in get_covered_tiles(px, py, timestamps, zoom, radius):
+            cache_key = _tile_cache_key(event, zoom, x, y, _format_tile_version(count, last, radius, saturation))
+            if cache.get(cache_key) is not None:
+                continue
+            started = time.perf_counter()
+            cache.set(cache_key, render_tile_png(px, py, x, y, radius, saturation), timeout)
+            observe(density_tile_render_duration, time.perf_counter() - started, mode='prerender')
+            rendered += 1
+    logger.debug(f"Pre-rendered {rendered} density tiles of event {event.pk} up to zoom {max_zoom}.")
+    return rendered
+
+
+def schedule_density_prerender(event_ids):
+    """
+    Debounced trigger for `prerender_density_tiles_task`: per event, only one
+    run is queued per `density_prerender_delay` window.
+    """
+    if np is None or get_int_setting('density_prerender_max_zoom', DEFAULT_DENSITY_PRERENDER_MAX_ZOOM) < 0:
+        return
+    # tasks.py imports persistence.py, which calls this function
+    from .tasks import prerender_density_tiles_task
+
+    delay = get_int_setting('density_prerender_delay', DEFAULT_DENSITY_PRERENDER_DELAY)
+    for event_id in set(event_ids):
+        if cache.add(f'{DENSITY_PRERENDER_SCHEDULED_CACHE_PREFIX}:{event_id}', 1, timeout=max(delay * 2, 60)):
+            prerender_density_tiles_task.apply_async(args=[event_id], countdown=delay)
+            logger.debug(f"Density tiles of event {event_id} scheduled for pre-rendering in {delay}s.")
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import re
+from datetime import timedelta
+
+from django.utils.timezone import now
+
+from .config import get_int_setting
+from .geocoding import (
+    GeocodeOutcome,
+    format_cache_address,
+    geocode_address_with_status,
+    get_address_components_from_order,
+)
+from .metrics import geocode_cache_lookups, inc
+from .models import GeocodeCacheEntry, OrderGeocodeData
+from .ratelimit import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# cache_ttl_days: How long a successful geocoding result is reused.
+# cache_negative_ttl_hours: How long an address the geocoder did not find is reused before trying again.
+# Timeouts and service errors are never cached, the retry task attempts them again (see tasks.py).
+DEFAULT_CACHE_TTL_DAYS = 180
+DEFAULT_CACHE_NEGATIVE_TTL_HOURS = 24
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_SEPARATOR_RE = re.compile(r'\s*,\s*')
+
+
+# --- Address Normalization ---
+def normalize_address(address_string: str) -> str:
+    """
+    Normalizes a formatted address (see `format_cache_address`) so
+    that trivially different spellings of the same address share a cache entry.
+
+    Lowercases, collapses whitespace (including line breaks in street fields)
+    and removes empty or surplus separators.
+    """
+    address = _WHITESPACE_RE.sub(' ', address_string or '').strip().lower()
+    parts = [part.strip(' .') for part in _SEPARATOR_RE.split(address)]
+    return ', '.join(part for part in parts if part)
+
+
+def address_cache_key(address_string: str) -> str:
+    """
+    Returns the hash under which the given address is stored in the cache.
+    Callers pass the language-neutral form (see `format_cache_address`), so
+    one address shares a single entry whatever language was active.
+    """
+    return hashlib.sha256(normalize_address(address_string).encode('utf-8')).hexdigest()
+
+
+def get_order_address_hash(order) -> str | None:
+    """
+    Returns the fingerprint of an order's current invoice address, as stored
+    in `OrderGeocodeData.address_hash`, or None if the order has no address.
+    It is built from language-neutral parts (see `format_cache_address`), so
+    it does not change with the language of the request that modified the order.
+    """
+    components = get_address_components_from_order(order)
+    address_string = format_cache_address(components) if components else None
+    return address_cache_key(address_string) if address_string else None
+
+
+# --- Cache Access ---
+def lookup_cached_outcomes_many(address_strings) -> dict[str, GeocodeOutcome]:
+    """
+    Looks up non-expired cache entries for many addresses with a single query.
+
+    Returns:
+        A dict mapping `address_cache_key(address)` to a `GeocodeOutcome`,
+        containing only the cache hits. Cached negative results have no
+        coordinates and STATUS_NOT_FOUND.
+    """
+    keys = {address_cache_key(address) for address in address_strings}
+    if not keys:
+        return {}
+    entries = GeocodeCacheEntry.objects.filter(
+        address_hash__in=keys,
+        expires_at__gt=now(),
+    ).values_list('address_hash', 'latitude', 'longitude', 'match_level')
+    outcomes = {key: _cached_outcome(latitude, longitude, match_level)
+                for key, latitude, longitude, match_level in entries}
+    inc(geocode_cache_lookups, len(outcomes), result='hit')
+    inc(geocode_cache_lookups, len(keys) - len(outcomes), result='miss')
+    return outcomes
+
+
+def _cached_outcome(latitude, longitude, match_level) -> GeocodeOutcome:
+    # Only found and not found results are cached, see store_cached_coordinates
+    if latitude is None or longitude is None:
+        return GeocodeOutcome(None, OrderGeocodeData.STATUS_NOT_FOUND)
+    return GeocodeOutcome((latitude, longitude), OrderGeocodeData.STATUS_OK, match_level)
+
+
+def store_cached_coordinates(address_string: str, coordinates: tuple[float, float] | None,
+                             status: str | None = None, match_level: str | None = None):
+    """
+    Stores (or refreshes) the geocoding result for the given address. A result
+    of None is stored as a negative entry with the shorter negative TTL, unless
+    `status` marks it as a transient failure, which is not stored at all.
+    `match_level` records how precise the coordinates are (see `get_query_ladder`).
+    """
+    if status in OrderGeocodeData.TRANSIENT_STATUSES:
+        return
+    if coordinates:
+        ttl = timedelta(days=get_int_setting('cache_ttl_days', DEFAULT_CACHE_TTL_DAYS))
+    else:
+        ttl = timedelta(hours=get_int_setting('cache_negative_ttl_hours', DEFAULT_CACHE_NEGATIVE_TTL_HOURS))
+
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            address_hash=address_cache_key(address_string),
+            defaults={
+                'normalized_address': normalize_address(address_string),
+                'latitude': coordinates[0] if coordinates else None,
+                'longitude': coordinates[1] if coordinates else None,
+                'match_level': match_level if coordinates else None,
+                'expires_at': now() + ttl,
+            }
+        )
+    except Exception as e:
+        # The cache is an optimization only, never fail the geocoding because of it
+        logger.exception(f"Could not store geocode cache entry for address '{address_string}': {e}")
+
+
+def geocode_address_cached(address_string: str, nominatim_user_agent: str | None = None,
+                           rate_limiter=None, geolocator=None,
+                           components: dict | None = None) -> tuple[GeocodeOutcome, bool]:
+    """
+    Geocodes an address, consulting the shared cache before sending any
+    request to the geocoding service and storing the outcome afterwards.
+    Requests are throttled by `rate_limiter`, or the shared limiter
+    configured in pretix.cfg if none is given. With `components`, the cache
+    is keyed by their language-neutral form (see `format_cache_address`)
+    and `address_string` is only sent to the geocoder.
+
+    Returns:
+        A tuple (outcome, from_cache). `outcome` is a `GeocodeOutcome` (see
+        `geocode_address_with_status`), `from_cache` tells whether the
+        geocoding service was skipped.
+    """
+    cache_address = (format_cache_address(components) if components else None) or address_string
+    cached = lookup_cached_outcomes_many([cache_address])
+    if cached:
+        outcome = next(iter(cached.values()))
+        logger.debug(f"Geocode cache hit for '{cache_address}': {outcome.coordinates}")
+        return outcome, True
+
+    if rate_limiter is None:
+        rate_limiter = get_rate_limiter()
+    outcome = geocode_address_with_status(address_string, nominatim_user_agent=nominatim_user_agent,
+                                          rate_limiter=rate_limiter, geolocator=geolocator, components=components)
+    store_cached_coordinates(cache_address, outcome.coordinates, outcome.status, outcome.match_level)
+    return outcome, False
+
+
+def purge_expired_cache_entries() -> int:
+    """Deletes expired cache entries. Returns the number of deleted entries."""
+    deleted, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=now()).delete()
+    if deleted:
+        logger.info(f"Purged {deleted} expired geocode cache entries.")
+    return deleted
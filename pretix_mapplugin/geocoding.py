@@ -1,33 +1,63 @@
 import logging
-from geopy.geocoders import Nominatim
+import os
+import re
+import threading
+import time
+from typing import NamedTuple
+
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-from time import sleep
 
-# DO NOT import settings here, as it won't work reliably in Celery
+from .backends import GeocoderBackend, NominatimBackend, get_backend_class
+from .config import get_bool_setting, get_setting
+from .metrics import geocode_request_duration, observe
+from .models import OrderGeocodeData
+from .ratelimit import get_rate_limiter
+
+# Settings are read through config.py when a function runs, never at import time, so Celery workers see pretix.cfg
 
 logger = logging.getLogger(__name__)
 
 # Define a default/fallback User-Agent. Users *should* override this in pretix.cfg.
 DEFAULT_NOMINATIM_USER_AGENT = "pretix-map-plugin/unknown (Please configure nominatim_user_agent in pretix.cfg)"
 
+# query_ladder: Retry addresses that were not found with postcode+city and city only queries (default: on).
 
-# --- Geocoding Function (Accepts user_agent) ---
-def geocode_address(address_string: str, nominatim_user_agent: str | None = None) -> tuple[float, float] | None:
-    """
-    Tries to geocode a given address string using Nominatim, using the
-    provided User-Agent string.
+_WHITESPACE_RE = re.compile(r'\s+')
+_STREET_SEPARATOR_RE = re.compile(r'[\n,;]')
+# "c/o Miller", "z. Hd. Frau Meier", "Attn: Accounting" name a recipient, not a place
+_CARE_OF_RE = re.compile(r'^(?:c/o|c\.\s*o\.|care of|z\.\s*hd\.?|zu h(?:ä|ae)nden|attn\.?|attention)(?:\s|:|$)',
+                         re.IGNORECASE)
+# "Apt 4B", "Whg. 12", "Flat C", "#12", "3. OG": parts of a building geocoders do not know
+_UNIT_RE = re.compile(
+    r'\b(?:apt|apartment|app|appt|unit|suite|flat|wohnung|whg|room|zimmer)\b\.?\s*(?:no\.?|nr\.?)?\s*#?\s*'
+    r'(?:[\w-]*\d[\w-]*|[a-z])\b'
+    r'|#\s*\w+'
+    r'|\b\d+\.\s*(?:og|stock|etage|obergeschoss)\b',
+    re.IGNORECASE,
+)
 
-    Args:
-        address_string: A single string representing the address.
-        nominatim_user_agent: The User-Agent string to use for Nominatim.
 
-    Returns:
-        A tuple (latitude, longitude) if successful, otherwise None.
+class GeocodeOutcome(NamedTuple):
+    """Result of geocoding one address, see `geocode_address_with_status`."""
+    coordinates: tuple[float, float] | None
+    status: str  # One of the OrderGeocodeData statuses
+    match_level: str | None = None  # Ladder level that found the coordinates (see get_query_ladder)
+
+
+# --- Geolocator Factory ---
+def get_geolocator(nominatim_user_agent: str | None = None, backend: str | None = None) -> GeocoderBackend:
     """
+    Creates the geocoder backend configured with `geocoder` in pretix.cfg
+    (public Nominatim by default), or the backend with the given identifier.
+    Callers geocoding many addresses should create one and pass it to every
+    `geocode_address` call to reuse its HTTP session. If `geocoder_fallback`
+    is configured, the backend carries a second one in its `fallback` attribute.
+    """
+    backend_class = get_backend_class(backend)
     # Use the provided User-Agent or the default
     user_agent = nominatim_user_agent or DEFAULT_NOMINATIM_USER_AGENT
 
-    if user_agent == DEFAULT_NOMINATIM_USER_AGENT:
+    if user_agent == DEFAULT_NOMINATIM_USER_AGENT and issubclass(backend_class, NominatimBackend):
         # Log warning if default is used - admins should configure this
         logger.warning(
             "Using default Nominatim User-Agent. Please set a specific "
@@ -35,42 +65,236 @@ def geocode_address(address_string: str, nominatim_user_agent: str | None = None
             "pretix.cfg according to Nominatim's usage policy."
         )
 
-    # Initialize the geolocator with the determined user_agent
-    geolocator = Nominatim(user_agent=user_agent)
+    geolocator = backend_class(user_agent=user_agent)
+
+    # Optional second backend for addresses the first one cannot resolve (only for the configured one)
+    fallback_identifier = get_setting('geocoder_fallback') if backend is None else None
+    if fallback_identifier and fallback_identifier != geolocator.identifier:
+        try:
+            geolocator.fallback = get_backend_class(fallback_identifier)(user_agent=user_agent)
+        except ValueError as e:
+            logger.error(f"Fallback geocoder '{fallback_identifier}' is not configured correctly: {e}")
+    return geolocator
+
+
+# Backends shared by all geocoding calls of this process, see get_shared_geolocator
+_shared_geolocators = {}
+_shared_geolocators_lock = threading.Lock()
+_shared_geolocators_pid = None
+
+
+def get_shared_geolocator(nominatim_user_agent: str | None = None) -> GeocoderBackend:
+    """
+    Returns the configured backend shared by all tasks and threads of this
+    process, so its pooled keep-alive HTTP connections are reused across
+    tasks instead of opening a new connection per address. Forked processes
+    (e.g. Celery's prefork pool) create their own, sessions are never shared.
+    """
+    global _shared_geolocators_pid
+    key = nominatim_user_agent or DEFAULT_NOMINATIM_USER_AGENT
+    with _shared_geolocators_lock:
+        if _shared_geolocators_pid != os.getpid():
+            _shared_geolocators.clear()
+            _shared_geolocators_pid = os.getpid()
+        geolocator = _shared_geolocators.get(key)
+        if geolocator is None:
+            geolocator = _shared_geolocators[key] = get_geolocator(nominatim_user_agent)
+        return geolocator
+
+
+def reset_shared_geolocators():
+    """Drops the shared backends, e.g. after the configuration changed."""
+    with _shared_geolocators_lock:
+        _shared_geolocators.clear()
+
+
+# --- Geocoding Function (Accepts user_agent) ---
+def geocode_address(address_string: str, nominatim_user_agent: str | None = None,
+                    rate_limiter=None, geolocator: GeocoderBackend | None = None,
+                    components: dict | None = None) -> tuple[float, float] | None:
+    """
+    Tries to geocode a given address string using the configured geocoder
+    backend, using the provided User-Agent string.
+
+    Args:
+        address_string: A single string representing the address.
+        nominatim_user_agent: The User-Agent string to use for Nominatim.
+        rate_limiter: Optional shared `RateLimiter` (see ratelimit.py) to wait
+            for before sending the request. Without one, no throttling is applied.
+        geolocator: Optional backend from `get_geolocator` to use. If not
+            given, the process' shared backend for `nominatim_user_agent` is used.
+        components: Optional address parts (see `get_address_components_from_order`),
+            required by backends that do not work with free-form addresses.
+
+    Returns:
+        A tuple (latitude, longitude) if successful, otherwise None.
+    """
+    return geocode_address_with_status(address_string, nominatim_user_agent=nominatim_user_agent,
+                                       rate_limiter=rate_limiter, geolocator=geolocator,
+                                       components=components).coordinates
+
+
+def geocode_address_with_status(address_string: str, nominatim_user_agent: str | None = None,
+                                rate_limiter=None, geolocator: GeocoderBackend | None = None,
+                                components: dict | None = None) -> GeocodeOutcome:
+    """
+    Like `geocode_address`, but also tells why no coordinates were found and
+    how precise the found ones are. Addresses that are not found are tried
+    again with coarser queries (see `get_query_ladder`), by the fallback
+    backend first if one is configured.
+
+    Returns:
+        A `GeocodeOutcome`. Its status is one of the `OrderGeocodeData` statuses:
+        STATUS_OK, STATUS_NOT_FOUND, or STATUS_TIMEOUT and STATUS_SERVICE_ERROR
+        for failures worth another attempt later.
+    """
+    # Reuse the process' backend (and its HTTP connections) with the determined user_agent
+    if geolocator is None:
+        geolocator = get_shared_geolocator(nominatim_user_agent)
+    fallback = getattr(geolocator, 'fallback', None)
+    # Fallback backends are usually offline/unthrottled, only wait if one has a limit configured
+    fallback_limiter = None
+    if fallback is not None and fallback.get_rate_limit() > 0:
+        fallback_limiter = get_rate_limiter(backend=fallback.identifier)
+
+    status = OrderGeocodeData.STATUS_NOT_FOUND
+    for level, query, query_components in get_query_ladder(address_string, components):
+        coordinates, status = _geocode_with_backend(geolocator, query, rate_limiter, query_components)
+        if coordinates:
+            return GeocodeOutcome(coordinates, OrderGeocodeData.STATUS_OK, geolocator.match_level or level)
+        if fallback is not None:
+            coordinates, _ = _geocode_with_backend(fallback, query, fallback_limiter, query_components)
+            if coordinates:
+                logger.info(f"Geocoded '{query}' with fallback geocoder {fallback.identifier}.")
+                return GeocodeOutcome(coordinates, OrderGeocodeData.STATUS_OK, fallback.match_level or level)
+        if status != OrderGeocodeData.STATUS_NOT_FOUND:
+            # Try the precise query again later instead of settling for a coarser one now
+            break
+    return GeocodeOutcome(None, status)
+
+
+def get_query_ladder(address_string: str, components: dict | None) -> list[tuple[str, str, dict | None]]:
+    """
+    Returns the queries tried for an address, from most to least precise:
+    the full address, then postcode, city and country, then city and
+    country. Levels missing the parts they need, or not coarser than the
+    previous one, are left out.
 
+    Returns:
+        A list of (match level, address string, components) tuples.
+    """
+    ladder = [(OrderGeocodeData.MATCH_ADDRESS, address_string, components)]
+    if not components or not get_bool_setting('query_ladder', True):
+        return ladder
+
+    street, zipcode, city = components.get('street'), components.get('zipcode'), components.get('city')
+    if street and zipcode and (city or components.get('country')):
+        postcode_components = {**components, 'street': ''}
+        ladder.append((OrderGeocodeData.MATCH_POSTCODE, format_address(postcode_components), postcode_components))
+    if city and (street or zipcode):
+        city_components = {**components, 'street': '', 'zipcode': ''}
+        ladder.append((OrderGeocodeData.MATCH_CITY, format_address(city_components), city_components))
+    return ladder
+
+
+def _geocode_with_backend(geolocator: GeocoderBackend, address_string: str, rate_limiter,
+                          components: dict | None) -> tuple[tuple[float, float] | None, str]:
+    started = None
+    status = OrderGeocodeData.STATUS_SERVICE_ERROR
     try:
-        # Add a 1-second delay to respect Nominatim's usage policy (1 req/sec)
-        sleep(1)
+        # Wait for a free slot of the shared limiter to respect the service's usage policy
+        if rate_limiter is not None:
+            waited = rate_limiter.acquire()
+            if waited:
+                logger.debug(f"Waited {waited:.2f}s for the geocoding rate limiter.")
 
         # Perform geocoding
-        location = geolocator.geocode(address_string, timeout=10)  # 10-second timeout
+        started = time.perf_counter()
+        coordinates = geolocator.geocode(address_string, components=components)
 
-        if location:
+        if coordinates:
             logger.debug(
-                f"Geocoded '{address_string}' to ({location.latitude}, {location.longitude}) using User-Agent: {user_agent}"
+                f"Geocoded '{address_string}' to {coordinates} using {geolocator.identifier}"
             )
-            return (location.latitude, location.longitude)
+            status = OrderGeocodeData.STATUS_OK
+            return coordinates, status
         else:
-            logger.warning(f"Could not geocode address: {address_string} (Address not found by Nominatim)")
-            return None
+            logger.warning(f"Could not geocode address: {address_string} (Address not found by {geolocator.identifier})")
+            status = OrderGeocodeData.STATUS_NOT_FOUND
+            return None, status
 
     except GeocoderTimedOut:
         logger.error(f"Geocoding timed out for address: {address_string}")
-        return None
+        status = OrderGeocodeData.STATUS_TIMEOUT
+        return None, status
     except GeocoderServiceError as e:
         # Log specific service errors (e.g., API limits, server issues)
         logger.error(f"Geocoding service error for address '{address_string}': {e}")
-        return None
+        return None, status
     except Exception as e:
         # Catch any other unexpected exceptions during geocoding
         logger.exception(f"An unexpected error occurred during geocoding for address '{address_string}': {e}")
-        return None
+        return None, status
+    finally:
+        # Request latency only, without the wait for the rate limiter
+        if started is not None:
+            observe(geocode_request_duration, time.perf_counter() - started,
+                    backend=geolocator.identifier, status=status)
+
+
+# --- Address Normalization ---
+def normalize_street(street: str) -> str:
+    """
+    Cleans up the street field of an invoice address for geocoding. Drops
+    c/o and attention lines and apartment, unit or floor details, which
+    make geocoders miss otherwise valid addresses, and collapses whitespace.
+    """
+    segments = []
+    for segment in _STREET_SEPARATOR_RE.split(street or ''):
+        segment = _WHITESPACE_RE.sub(' ', segment).strip()
+        if not segment or _CARE_OF_RE.match(segment):
+            continue
+        segment = _WHITESPACE_RE.sub(' ', _UNIT_RE.sub(' ', segment)).strip(' -/')
+        if segment:
+            segments.append(segment)
+    return ', '.join(segments)
+
+
+def _clean(value: str) -> str:
+    return _WHITESPACE_RE.sub(' ', value or '').strip(' ,')
 
 
 # --- Helper to Format Address from Pretix Order ---
+def format_address(components: dict) -> str | None:
+    """
+    Joins address parts (see `get_address_components_from_order`) into a
+    single string for geocoders that take free-form addresses.
+    """
+    # Add components in a likely useful order for geocoding
+    parts = [components.get(key) for key in ('street', 'city', 'zipcode', 'state')]
+    # Use the full country name if possible, geocoders often prefer it
+    parts.append(components.get('country_name') or components.get('country'))
+    # Join parts with commas. Geocoders are usually good at parsing this.
+    full_address = ", ".join(filter(None, parts))  # filter(None,...) removes empty strings
+    # Only return an address if we have useful parts
+    return full_address or None
+
+
+def format_cache_address(components: dict) -> str | None:
+    """
+    Joins address parts like `format_address`, but with the country's ISO
+    code instead of its name, which is translated into the active language.
+    The result identifies an address independently of the language of the
+    request or task that sees it (see geocache.address_cache_key).
+    """
+    parts = [components.get(key) for key in ('street', 'city', 'zipcode', 'state', 'country')]
+    return ", ".join(filter(None, parts)) or None
+
+
 def get_formatted_address_from_order(order) -> str | None:
     """
-    Creates a formatted address string from a Pretix order's invoice address.
+    Creates a formatted address string from a Pretix order's normalized
+    invoice address (see `get_address_components_from_order`).
 
     Args:
         order: A Pretix `Order` object.
@@ -78,25 +302,31 @@ def get_formatted_address_from_order(order) -> str | None:
     Returns:
         A formatted address string suitable for geocoding, or None if no address.
     """
-    # Ensure order and invoice_address exist
-    if not order or not order.invoice_address:
+    components = get_address_components_from_order(order)
+    if not components:
         return None
+    return format_address(components)
 
-    parts = []
-    addr = order.invoice_address  # Shortcut
 
-    # Add components in a likely useful order for geocoding
-    if addr.street: parts.append(addr.street)
-    if addr.city: parts.append(addr.city)
-    if addr.zipcode: parts.append(addr.zipcode)
-    if addr.state: parts.append(addr.state)
-    # Use the full country name if possible, geocoders often prefer it
-    if addr.country: parts.append(str(addr.country.name))
+def get_address_components_from_order(order) -> dict | None:
+    """
+    Returns the normalized parts of a Pretix order's invoice address: the
+    street without c/o lines and apartment numbers (see `normalize_street`),
+    collapsed whitespace and an uppercase postcode.
 
-    # Only return an address if we have useful parts
-    if not parts:
+    Returns:
+        A dict with street, zipcode, city, state, country (ISO code) and
+        country_name, or None if no address.
+    """
+    # Ensure order and invoice_address exist
+    if not order or not order.invoice_address:
         return None
-
-    # Join parts with commas. Geocoders are usually good at parsing this.
-    full_address = ", ".join(filter(None, parts))  # filter(None,...) removes empty strings
-    return full_address
+    addr = order.invoice_address  # Shortcut
+    return {
+        'street': normalize_street(addr.street),
+        'zipcode': _clean(addr.zipcode).upper(),
+        'city': _clean(addr.city),
+        'state': _clean(addr.state),
+        'country': str(addr.country.code) if addr.country else '',
+        'country_name': str(addr.country.name) if addr.country else '',
+    }
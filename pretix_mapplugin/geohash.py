@@ -0,0 +1,102 @@
+import math
+
+# Standard geohash alphabet (base32 without a, i, l, o)
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE_MAP = {c: i for i, c in enumerate(_BASE32)}
+
+# Precision stored in OrderGeocodeData.geohash (~3.7cm x 1.9cm cells)
+GEOHASH_PRECISION = 12
+# Upper bound for the number of prefixes used to cover a bounding box in queries
+MAX_COVER_PREFIXES = 32
+
+
+# --- Encoding / Decoding ---
+def encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """
+    Encodes a coordinate as a geohash. Nearby coordinates share common
+    prefixes, so a prefix describes a rectangular cell and a set of prefixes
+    can be queried as index range scans.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        value, rng = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def decode_bbox(geohash: str) -> tuple[float, float, float, float]:
+    """Returns the cell of a geohash as (west, south, east, north)."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _DECODE_MAP[char]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lon_range[0], lat_range[0], lon_range[1], lat_range[1]
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """Returns the (width, height) in degrees of a geohash cell of the given precision."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 360.0 / (2 ** lon_bits), 180.0 / (2 ** lat_bits)
+
+
+def precision_for_cell_width(width: float) -> int:
+    """Returns the highest precision whose cells are still at least `width` degrees wide."""
+    precision = 1
+    while precision < GEOHASH_PRECISION and cell_size(precision + 1)[0] >= width:
+        precision += 1
+    return precision
+
+
+# --- Bounding Box Cover ---
+def bbox_prefixes(west: float, south: float, east: float, north: float) -> list[str]:
+    """
+    Returns a list of geohash prefixes whose cells together cover the given
+    bounding box, using the highest precision that needs at most
+    MAX_COVER_PREFIXES prefixes. Rows matching any prefix are a superset of
+    the rows inside the box, so callers should still filter exactly.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        width, height = cell_size(precision)
+        columns = math.floor(east / width) - math.floor(west / width) + 1
+        rows = math.floor(north / height) - math.floor(south / height) + 1
+        if columns * rows <= MAX_COVER_PREFIXES:
+            break
+
+    prefixes = set()
+    # Step through cell centers, clamped to the box, so every cell touching it is included
+    lat = south
+    while True:
+        lon = west
+        while True:
+            prefixes.add(encode(min(lat, 90.0), min(lon, 180.0), precision))
+            if lon >= east:
+                break
+            lon = min(lon + width, east)
+        if lat >= north:
+            break
+        lat = min(lat + height, north)
+    return sorted(prefixes)
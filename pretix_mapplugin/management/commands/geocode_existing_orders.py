@@ -1,11 +1,14 @@
+import json
 import logging
-import time  # Import time for sleep
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
-from django.db import transaction
 
 # --- Import Pretix Global Settings accessor ---
-from django_scopes import scope
+from django_scopes import scopes_disabled
 
 # Check if Pretix version uses AbstractSettingsHolder or GlobalSettingsObject
 # Adjust import based on Pretix version if needed. Assume AbstractSettingsHolder for newer Pretix.
@@ -33,21 +36,43 @@ except ImportError:
 from pretix.base.models import Order, Event, Organizer
 
 # --- Import your Geocode model and geocoding functions ---
+from pretix_mapplugin.asyncgeocoding import AsyncGeocodingEngine
+from pretix_mapplugin.config import get_int_setting
 from pretix_mapplugin.models import OrderGeocodeData
+from pretix_mapplugin.persistence import GeocodeResult, save_geocode_results
 # --- Import geocoding functions directly, NOT the task ---
 from pretix_mapplugin.geocoding import (
-    geocode_address,
-    get_formatted_address_from_order,
+    format_address,
+    format_cache_address,
+    geocode_address_with_status,
+    get_address_components_from_order,
+    get_shared_geolocator,
     DEFAULT_NOMINATIM_USER_AGENT
 )
+from pretix_mapplugin.geocache import (
+    address_cache_key,
+    get_order_address_hash,
+    lookup_cached_outcomes_many,
+    store_cached_coordinates,
+)
+from pretix_mapplugin.ratelimit import get_rate_limiter
 
 logger = logging.getLogger(__name__)
 
+# --- Defaults ---
+# Orders loaded, geocoded and checkpointed together
+DEFAULT_CHUNK_SIZE = 500
+# Concurrent geocoding requests default to the geocoder backend's concurrency (see backends.py),
+# overridden by backfill_workers under [pretix_mapplugin] in pretix.cfg or --workers.
+# All workers share the rate limit, so more workers only help with a higher rate_limit (self-hosted geocoders).
+CHECKPOINT_FILE_NAME = 'pretix_mapplugin_geocode_checkpoint.json'
+
 
 class Command(BaseCommand):
     help = ('Scans paid orders and geocodes addresses for those missing geocode data directly '
-            'within the command, respecting Nominatim rate limits (approx 1 req/sec). '
-            'This can take a long time for many orders.')
+            'within the command, respecting the shared geocoding rate limit (default 1 req/sec). '
+            'Orders are processed in chunks ordered by ID, progress is checkpointed so an interrupted '
+            'run can be continued with --resume.')
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -64,18 +89,102 @@ class Command(BaseCommand):
             help='Geocode even for orders that already have geocode data.',
         )
         parser.add_argument(
-            '--delay', type=float, default=1.1,
-            help='Delay in seconds between geocoding requests (default: 1.1 to be safe). Set to 0 to disable.'
+            '--changed-only', action='store_true',
+            help='Geocode orders that already have geocode data again, but only if their invoice address changed '
+                 'since. Orders geocoded by earlier versions without an address fingerprint record the current one.',
+        )
+        parser.add_argument(
+            '--delay', type=float, default=None,
+            help='Minimum delay in seconds between geocoding requests. By default, the shared rate limit '
+                 'configured in pretix.cfg (rate_limit, default 1 req/sec) is used, which is also respected '
+                 'by running Celery workers. Set to 0 to disable.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help=f'Number of orders loaded and checkpointed at once (default: {DEFAULT_CHUNK_SIZE}).',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of concurrent geocoding requests, all sharing the rate limit '
+                 '(default: backfill_workers from pretix.cfg, or the concurrency of the configured geocoder).',
+        )
+        parser.add_argument(
+            '--async', action='store_true', dest='use_async',
+            help='Send the requests of a chunk with the asyncio engine instead of threads. With --workers '
+                 'requests in flight, retries with backoff; for self-hosted geocoders (requires pretix-map[async]).',
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Continue after the last order completed by a previous run with the same selection.',
+        )
+        parser.add_argument(
+            '--checkpoint-file', type=str, default=None,
+            help=f'File to record progress in (default: {CHECKPOINT_FILE_NAME} in the pretix data directory).',
         )
 
+    # --- Checkpoint Handling ---
+    def read_checkpoint(self, path: str, selection: dict) -> int:
+        """Returns the last completed order ID of a previous run with the same selection."""
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            self.stdout.write(self.style.WARNING(f"No checkpoint found at {path}, starting from the beginning."))
+            return 0
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read checkpoint file {path}: {e}")
+        if checkpoint.get('selection') != selection:
+            raise CommandError(f"Checkpoint in {path} was recorded for a different selection "
+                               f"({checkpoint.get('selection')}). Run without --resume to start over.")
+        return checkpoint.get('last_order_pk', 0)
+
+    def write_checkpoint(self, path: str, selection: dict, last_order_pk: int):
+        """Atomically records the last order ID whose chunk was completed."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'selection': selection, 'last_order_pk': last_order_pk}, f)
+        os.replace(tmp_path, path)
+
+    # --- Order Selection ---
+    def get_orders_queryset(self, organizer_slug, event_slug, force_recode, changed_only=False):
+        orders_qs = Order.objects.filter(status=Order.STATUS_PAID).select_related('invoice_address', 'event')
+        if organizer_slug:
+            try:
+                organizer = Organizer.objects.get(slug=organizer_slug)
+            except Organizer.DoesNotExist:
+                raise CommandError(f"Organizer with slug '{organizer_slug}' not found.")
+            orders_qs = orders_qs.filter(event__organizer=organizer)
+            self.stdout.write(f"Processing specified organizer: {organizer.name} ({organizer_slug})")
+            if event_slug:
+                try:
+                    event = Event.objects.get(organizer=organizer, slug=event_slug)
+                except Event.DoesNotExist:
+                    raise CommandError(f"Event '{event_slug}' not found for organizer '{organizer_slug}'.")
+                orders_qs = orders_qs.filter(event=event)
+                self.stdout.write(f"  Filtering for event: {event.name} ({event_slug})")
+        else:
+            self.stdout.write("Processing all organizers...")
+
+        if force_recode:
+            self.stdout.write(self.style.WARNING("  Will process all paid orders (--force-recode)..."))
+        elif changed_only:
+            self.stdout.write("  Will process geocoded orders whose address changed (--changed-only)...")
+            orders_qs = orders_qs.filter(geocode_data__isnull=False).select_related('geocode_data')
+        else:
+            orders_qs = orders_qs.filter(geocode_data__isnull=True)
+        return orders_qs.order_by('pk')
+
     def handle(self, *args, **options):
         organizer_slug = options['organizer']
         event_slug = options['event']
         dry_run = options['dry_run']
         force_recode = options['force_recode']
+        changed_only = options['changed_only']
         delay = options['delay']
+        chunk_size = options['chunk_size']
+        workers = options['workers']
 
-        if delay < 1.0 and delay != 0:  # Allow disabling delay with 0
+        if delay is not None and delay < 1.0 and delay != 0:  # Allow disabling delay with 0
             self.stdout.write(self.style.WARNING(
                 f"Delay is {delay}s, which is less than 1 second. This may violate Nominatim usage policy."))
         elif delay == 0:
@@ -84,6 +193,16 @@ class Command(BaseCommand):
 
         if event_slug and not organizer_slug:
             raise CommandError("You must specify --organizer when using --event.")
+        if force_recode and changed_only:
+            raise CommandError("--force-recode and --changed-only cannot be combined.")
+        if chunk_size < 1 or (workers is not None and workers < 1):
+            raise CommandError("--chunk-size and --workers must be at least 1.")
+
+        # --- Shared rate limiter (same bucket as the Celery workers and all threads) ---
+        if delay is None:
+            rate_limiter = get_rate_limiter()
+        else:
+            rate_limiter = get_rate_limiter(rate=(1.0 / delay) if delay > 0 else 0)
 
         # --- Read User-Agent using Pretix Settings accessor ---
         user_agent = DEFAULT_NOMINATIM_USER_AGENT
@@ -102,170 +221,207 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR(f"Failed to read plugin settings: {e}. Using default User-Agent."))
         # --- End Read User-Agent ---
 
-        # --- Determine which organizers to process ---
-        organizers_to_process = []
-        if organizer_slug:
-            try:
-                organizer = Organizer.objects.get(slug=organizer_slug)
-                organizers_to_process.append(organizer)
-                self.stdout.write(f"Processing specified organizer: {organizer.name} ({organizer_slug})")
-            except Organizer.DoesNotExist:
-                raise CommandError(f"Organizer with slug '{organizer_slug}' not found.")
-        else:
-            organizers_to_process = list(Organizer.objects.all())
-            self.stdout.write(f"Processing all {len(organizers_to_process)} organizers...")
+        # --- Checkpoint ---
+        checkpoint_path = options['checkpoint_file'] or os.path.join(settings.DATA_DIR, CHECKPOINT_FILE_NAME)
+        selection = {'organizer': organizer_slug, 'event': event_slug, 'force_recode': force_recode}
+        if changed_only:
+            selection['changed_only'] = True  # Only added when set, so existing checkpoints stay valid
+        start_after_pk = self.read_checkpoint(checkpoint_path, selection) if options['resume'] else 0
+        if start_after_pk:
+            self.stdout.write(f"Resuming after order ID {start_after_pk} (checkpoint: {checkpoint_path})")
 
         # --- Initialize counters ---
-        total_processed_count = 0  # Orders actually attempted (had address or forced)
-        total_geocoded_success = 0
-        total_geocode_failed = 0  # Geocoder returned None
-        total_skipped_no_address = 0
-        total_skipped_db_error = 0
-        total_checked_count = 0  # All orders matching initial filter
-
-        # --- Iterate through organizers ---
-        for organizer in organizers_to_process:
-            self.stdout.write(f"\n--- Processing Organizer: {organizer.name} ({organizer.slug}) ---")
-            # current_organizer_pk = organizer.pk # No longer needed for task
-
-            with scope(organizer=organizer):
-                # --- Get orders ---
-                orders_qs = Order.objects.filter(status=Order.STATUS_PAID).select_related(
-                    'invoice_address', 'event'
-                )
-
-                # --- Filter by event ---
-                if event_slug and organizer.slug == organizer_slug:
-                    try:
-                        event = Event.objects.get(slug=event_slug)
-                        orders_qs = orders_qs.filter(event=event)
-                        self.stdout.write(f"  Filtering for event: {event.name} ({event_slug})")
-                    except Event.DoesNotExist:
-                        self.stderr.write(
-                            self.style.WARNING(f"  Event '{event_slug}' not found. Skipping event filter."))
-                        if organizer_slug and event_slug: continue
-
-                # --- Determine which orders to process ---
-                relation_name = 'geocode_data'  # Check model
-                orders_to_geocode_list = []
-                current_checked_count = orders_qs.count()  # Count before filtering for geocode status
-                total_checked_count += current_checked_count
-
-                if force_recode:
-                    orders_to_geocode_list = list(orders_qs)
-                    self.stdout.write(self.style.WARNING(
-                        f"  Will process all {len(orders_to_geocode_list)} orders (--force-recode)..."))
-                else:
-                    try:
-                        Order._meta.get_field(relation_name)
-                        existing_pks = set(OrderGeocodeData.objects.filter(
-                            order__in=orders_qs
-                        ).values_list('order_id', flat=True))
-                        orders_to_geocode_list = list(orders_qs.exclude(pk__in=existing_pks))
-                        self.stdout.write(
-                            f"  Found {len(orders_to_geocode_list)} orders missing geocode data (out of {current_checked_count} checked).")
-                    except FieldDoesNotExist:
-                        self.stderr.write(
-                            self.style.ERROR(f"  Relation '{relation_name}' not found. Skipping organizer."))
-                        continue
-                    except Exception as e:
-                        self.stderr.write(self.style.ERROR(f"  Error checking relation: {e}. Skipping organizer."))
-                        continue
-
-                if not orders_to_geocode_list:
-                    self.stdout.write("  No orders require geocoding for this selection.")
-                    continue
+        self.totals = {
+            'checked': 0,  # All orders matching the filters
+            'processed': 0,  # Orders actually attempted (had address)
+            'geocoded': 0,
+            'failed': 0,  # Geocoder returned None
+            'retry_scheduled': 0,  # Of the failed: timeouts and service errors, attempted again later
+            'no_address': 0,
+            'db_error': 0,
+            'cache_hits': 0,  # Served from the shared geocode cache without a request
+            'unchanged': 0,  # --changed-only: address fingerprint matches, skipped
+            'fingerprinted': 0,  # --changed-only: fingerprint recorded for rows of earlier versions
+        }
 
-                # --- Process Orders Sequentially ---
-                count_this_org = 0
-                org_geocoded = 0
-                org_failed = 0
-                org_skipped_no_addr = 0
-                org_skipped_db = 0
-
-                for i, order in enumerate(orders_to_geocode_list):
-                    count_this_org += 1
-                    self.stdout.write(
-                        f"  Processing order {count_this_org}/{len(orders_to_geocode_list)}: {order.code} ...",
-                        ending="")
-
-                    address_str = get_formatted_address_from_order(order)
-                    if not address_str:
-                        self.stdout.write(self.style.WARNING(" No address. Skipping."))
-                        total_skipped_no_address += 1
-                        org_skipped_no_addr += 1
-                        # Save null coords to prevent re-processing if not forcing
-                        if not dry_run and not force_recode:
-                            try:
-                                with transaction.atomic():
-                                    OrderGeocodeData.objects.update_or_create(order=order, defaults={'latitude': None,
-                                                                                                     'longitude': None})
-                            except Exception as db_err:
-                                self.stdout.write(self.style.ERROR(f" FAILED (DB Error saving null: {db_err})"))
-                                logger.exception(
-                                    f"Failed to save null geocode data via command for order {order.code}: {db_err}")
-                                total_skipped_db_error += 1
-                                org_skipped_db += 1
-                        continue  # Move to next order
-
-                    # Only increment this if we actually attempt geocoding
-                    total_processed_count += 1
-
-                    if dry_run:
-                        self.stdout.write(self.style.SUCCESS(" [DRY RUN] Would geocode."))
-                        org_geocoded += 1  # Simulate success for dry run count
-                    else:
-                        # --- Perform Geocoding Directly ---
-                        coordinates = geocode_address(address_str, nominatim_user_agent=user_agent)
-
-                        # --- Save Result ---
-                        try:
-                            with transaction.atomic():
-                                obj, created = OrderGeocodeData.objects.update_or_create(
-                                    order=order,
-                                    defaults={'latitude': coordinates[0] if coordinates else None,
-                                              'longitude': coordinates[1] if coordinates else None}
-                                )
-                            if coordinates:
-                                self.stdout.write(
-                                    self.style.SUCCESS(f" OK ({coordinates[0]:.4f}, {coordinates[1]:.4f})"))
-                                org_geocoded += 1
-                            else:
-                                self.stdout.write(self.style.WARNING(" FAILED (Geocode returned None)"))
-                                org_failed += 1
-                        except Exception as e:
-                            self.stdout.write(self.style.ERROR(f" FAILED (DB Error: {e})"))
-                            logger.exception(f"Failed to save geocode data via command for order {order.code}: {e}")
-                            org_skipped_db += 1  # Count DB errors separately
-
-                        # --- Apply Delay ---
-                        if delay > 0 and i < len(
-                                orders_to_geocode_list) - 1:  # Don't sleep after the last one or if delay is 0
-                            time.sleep(delay)
-
-                # Add org counts to totals
-                total_geocoded_success += org_geocoded
-                total_geocode_failed += org_failed
-                total_skipped_db_error += org_skipped_db
-
-                self.stdout.write(f"  Finished Organizer: Succeeded: {org_geocoded}, Failed Geocode: {org_failed}, "
-                                  f"Skipped (No Addr): {org_skipped_no_addr}, Skipped (DB Err): {org_skipped_db}.")
-            # End scope
+        try:
+            geolocator = get_shared_geolocator(user_agent)
+        except ValueError as e:
+            raise CommandError(f"Geocoder is not configured correctly: {e}")
+        if workers is None:
+            # Self-hosted backends allow several requests in flight, public Nominatim only one
+            workers = get_int_setting('backfill_workers', geolocator.concurrency)
+        self.stdout.write(f"Using geocoder: {geolocator.verbose_name or geolocator.identifier}")
+        engine = None
+        if options['use_async'] and not dry_run:
+            try:
+                engine = AsyncGeocodingEngine(geolocator, rate_limiter=rate_limiter, concurrency=workers)
+            except ImportError as e:
+                raise CommandError(str(e))
+        with scopes_disabled(), ThreadPoolExecutor(max_workers=workers) as executor:
+            orders_qs = self.get_orders_queryset(organizer_slug, event_slug, force_recode, changed_only)
+            orders_qs = orders_qs.filter(pk__gt=start_after_pk)
+            self.stdout.write(f"Found {orders_qs.count()} orders to process, using {workers} worker(s).")
+
+            # --- Stream orders in ID order, one chunk at a time ---
+            orders_iter = orders_qs.iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(orders_iter, chunk_size))
+                if not chunk:
+                    break
+                last_order_pk = chunk[-1].pk
+                self.totals['checked'] += len(chunk)
+                if changed_only:
+                    chunk = self.select_changed_orders(chunk, dry_run)
+                saved = self.process_chunk(chunk, executor, geolocator, rate_limiter, dry_run, force_recode, engine)
+                if not saved:
+                    raise CommandError(f"Could not save the results for orders up to ID {last_order_pk}. "
+                                       f"Fix the database problem and continue with --resume.")
+                if not dry_run:
+                    # Everything up to here is saved, an interrupted run continues after this order
+                    self.write_checkpoint(checkpoint_path, selection, last_order_pk)
 
         # --- Final Overall Report ---
+        totals = self.totals
         self.stdout.write("=" * 40)
         self.stdout.write("Overall Geocoding Summary:")
-        self.stdout.write(f"  Organizers processed: {len(organizers_to_process)}")
-        self.stdout.write(f"  Total Orders Checked (paid, matching filters): {total_checked_count}")
-        self.stdout.write(f"  Total Orders Attempted (had address or forced): {total_processed_count}")
+        self.stdout.write(f"  Total Orders Checked (paid, matching filters): {totals['checked']}")
+        self.stdout.write(f"  Total Orders Attempted (had address): {totals['processed']}")
         if dry_run:
             self.stdout.write(self.style.SUCCESS(
-                f"[DRY RUN] Complete. Would have attempted geocoding for {total_processed_count} orders "
-                f"(+ {total_skipped_no_address} skipped due to no address)."))
+                f"[DRY RUN] Complete. Would have attempted geocoding for {totals['processed']} orders "
+                f"(+ {totals['no_address']} skipped due to no address)."))
         else:
-            self.stdout.write(self.style.SUCCESS(f"  Successfully Geocoded & Saved: {total_geocoded_success}"))
-            self.stdout.write(self.style.WARNING(f"  Geocoding Failed (None returned): {total_geocode_failed}"))
-            self.stdout.write(f"  Skipped (No Address): {total_skipped_no_address}")
-            if total_skipped_db_error > 0:
-                self.stdout.write(self.style.ERROR(f"  Skipped (DB Save Error): {total_skipped_db_error} (check logs)"))
+            self.stdout.write(self.style.SUCCESS(f"  Successfully Geocoded & Saved: {totals['geocoded']}"))
+            self.stdout.write(self.style.WARNING(f"  Geocoding Failed (None returned): {totals['failed']}"))
+            self.stdout.write(f"    of which Scheduled for Retry (timeout/service error): {totals['retry_scheduled']}")
+            self.stdout.write(f"  Skipped (No Address): {totals['no_address']}")
+            self.stdout.write(f"  Served from Geocode Cache: {totals['cache_hits']}")
+            if changed_only:
+                self.stdout.write(f"  Skipped (Address Unchanged): {totals['unchanged']}")
+                self.stdout.write(f"  Address Fingerprint Recorded: {totals['fingerprinted']}")
+            if totals['db_error'] > 0:
+                self.stdout.write(self.style.ERROR(f"  Skipped (DB Save Error): {totals['db_error']} (check logs)"))
         self.stdout.write("=" * 40)
+
+    # --- Address Change Detection ---
+    def select_changed_orders(self, chunk, dry_run) -> list:
+        """
+        Returns the orders of a chunk whose invoice address no longer matches
+        the fingerprint stored with their geocode data. Rows written before
+        fingerprints existed record the current one instead, their address is
+        assumed to be the one they were geocoded with.
+        """
+        changed, fingerprinted = [], []
+        for order in chunk:
+            data = order.geocode_data
+            address_hash = get_order_address_hash(order)
+            if data.address_hash == address_hash:
+                self.totals['unchanged'] += 1
+            elif data.address_hash is None and data.status != OrderGeocodeData.STATUS_NO_ADDRESS:
+                data.address_hash = address_hash
+                fingerprinted.append(data)
+            else:
+                changed.append(order)
+        if fingerprinted and not dry_run:
+            # Coordinates are unchanged, so last_geocoded_at (and the map's data version) stays as it is
+            OrderGeocodeData.objects.bulk_update(fingerprinted, ['address_hash'])
+        self.totals['fingerprinted'] += len(fingerprinted)
+        return changed
+
+    # --- Chunk Processing ---
+    def process_chunk(self, chunk, executor, geolocator, rate_limiter, dry_run, force_recode, engine=None) -> bool:
+        """
+        Geocodes and saves one chunk of orders. Addresses are looked up in the
+        shared cache with one query, the remaining unique addresses are geocoded
+        concurrently by the executor's threads (or the async engine, if given)
+        and all results are written with one bulk upsert. Only the main thread touches the database, the workers
+        just wait for the rate limiter and send requests.
+
+        Returns:
+            False if the results could not be saved.
+        """
+        components = {order.pk: get_address_components_from_order(order) for order in chunk}
+        # Sent to the geocoder, with the country's name in the active language
+        addresses = {pk: format_address(parts) if parts else None for pk, parts in components.items()}
+        # Language-neutral, what the cache is keyed by (see format_cache_address)
+        cache_addresses = {pk: format_cache_address(parts) if parts else None for pk, parts in components.items()}
+
+        results = {}  # address_cache_key -> (GeocodeOutcome, from_cache)
+        if not dry_run:
+            results = {key: (outcome, True)
+                       for key, outcome in lookup_cached_outcomes_many(filter(None, cache_addresses.values())).items()}
+            misses = {}  # address_cache_key -> (address, components of the first order with it)
+            miss_cache_addresses = {}  # address_cache_key -> language-neutral address
+            for order_pk, address in addresses.items():
+                if not address:
+                    continue
+                key = address_cache_key(cache_addresses[order_pk])
+                if key not in results and key not in misses:
+                    misses[key] = (address, components[order_pk])
+                    miss_cache_addresses[key] = cache_addresses[order_pk]
+            if engine is not None:
+                geocoded = engine.geocode_many(misses)
+            else:
+                geocoded = dict(zip(misses, executor.map(
+                    lambda miss: geocode_address_with_status(miss[0], rate_limiter=rate_limiter,
+                                                             geolocator=geolocator, components=miss[1]),
+                    misses.values()
+                )))
+            for key in misses:
+                outcome = geocoded[key]
+                store_cached_coordinates(miss_cache_addresses[key], outcome.coordinates, outcome.status, outcome.match_level)
+                results[key] = (outcome, False)
+
+        to_save = []  # GeocodeResult per order, written with one bulk upsert
+        chunk_totals = {'geocoded': 0, 'failed': 0, 'retry_scheduled': 0}
+        for order in chunk:
+            self.stdout.write(f"  Processing order {order.code} (ID {order.pk}) ...", ending="")
+            address_str = addresses[order.pk]
+            if not address_str:
+                self.stdout.write(self.style.WARNING(" No address. Skipping."))
+                self.totals['no_address'] += 1
+                # Save null coords to prevent re-processing if not forcing
+                if not dry_run and not force_recode:
+                    to_save.append(GeocodeResult(order.pk, None, None, OrderGeocodeData.STATUS_NO_ADDRESS))
+                continue
+
+            # Only increment this if we actually attempt geocoding
+            self.totals['processed'] += 1
+            if dry_run:
+                self.stdout.write(self.style.SUCCESS(" [DRY RUN] Would geocode."))
+                continue
+
+            # The cache key is the order's address fingerprint (see get_order_address_hash)
+            address_hash = address_cache_key(cache_addresses[order.pk])
+            (coordinates, status, match_level), from_cache = results[address_hash]
+            if from_cache:
+                self.totals['cache_hits'] += 1
+            cache_info = " [cached]" if from_cache else ""
+            if coordinates:
+                level_info = f" [{match_level}]" if match_level and match_level != OrderGeocodeData.MATCH_ADDRESS else ""
+                self.stdout.write(self.style.SUCCESS(
+                    f" OK ({coordinates[0]:.4f}, {coordinates[1]:.4f}){level_info}{cache_info}"))
+                to_save.append(GeocodeResult(order.pk, coordinates[0], coordinates[1], status, 1, match_level,
+                                             address_hash))
+                chunk_totals['geocoded'] += 1
+            else:
+                self.stdout.write(self.style.WARNING(f" FAILED ({status}){cache_info}"))
+                to_save.append(GeocodeResult(order.pk, None, None, status, address_hash=address_hash))
+                chunk_totals['failed'] += 1
+                if status in OrderGeocodeData.TRANSIENT_STATUSES:
+                    chunk_totals['retry_scheduled'] += 1
+
+        if not to_save:
+            return True
+        try:
+            save_geocode_results(to_save, event_ids={order.pk: order.event_id for order in chunk})
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"  FAILED to save {len(to_save)} results (DB Error: {e})"))
+            logger.exception(f"Failed to save geocode data via command for orders {chunk[0].pk}-{chunk[-1].pk}: {e}")
+            self.totals['db_error'] += len(to_save)
+            return False
+        self.totals['geocoded'] += chunk_totals['geocoded']
+        self.totals['failed'] += chunk_totals['failed']
+        self.totals['retry_scheduled'] += chunk_totals['retry_scheduled']
+        return True
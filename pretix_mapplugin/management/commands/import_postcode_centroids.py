@@ -0,0 +1,42 @@
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pretix_mapplugin.backends import get_postcode_file_path
+from pretix_mapplugin.postcodes import build_postcode_file
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Builds the offline postcode lookup table used by the "postcode" geocoder (geocoder=postcode or '
+            'geocoder_fallback=postcode in pretix.cfg) from a GeoNames postal code dump, e.g. allCountries.zip '
+            'or DE.zip from https://download.geonames.org/export/zip/.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source', type=str, help='GeoNames postal code dump (.txt or .zip).',
+        )
+        parser.add_argument(
+            '--output', type=str, default=None,
+            help='Table file to write (default: postcode_file from pretix.cfg, '
+                 'or pretix_mapplugin_postcodes.bin in the pretix data directory).',
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        output = options['output'] or get_postcode_file_path()
+        if not os.path.exists(source):
+            raise CommandError(f"Source file '{source}' not found.")
+
+        self.stdout.write(f"Importing postcode centroids from {source} ...")
+        try:
+            count = build_postcode_file(source, output)
+        except (OSError, ValueError) as e:
+            logger.exception(f"Failed to import postcode centroids from {source}: {e}")
+            raise CommandError(f"Import failed: {e}")
+
+        size = os.path.getsize(output) / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} postcodes to {output} ({size:.1f} MiB)."))
+        self.stdout.write("Running workers pick up the new table on their next lookup.")
@@ -0,0 +1,88 @@
+import logging
+
+from pretix.base.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Metrics are recorded with pretix' own metrics mechanism (stored in redis) and
+# exported by its Prometheus endpoint (/metrics, enabled with [metrics] in pretix.cfg).
+# Without redis, recording is a no-op.
+INF = float('inf')
+LATENCY_BUCKETS = (.05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, INF)
+LAG_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0, 1800.0, 3600.0, 6 * 3600.0, 24 * 3600.0, INF)
+RATE_LIMIT_WAIT_BUCKETS = (0, .1, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, INF)
+BUILD_BUCKETS = (.01, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, INF)
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 50000, 100000, 250000, 500000, INF)
+
+# --- Geocoding ---
+geocode_request_duration = Histogram(
+    'pretix_mapplugin_geocode_request_duration_seconds',
+    'Duration of single requests to the geocoding service, by backend and outcome.',
+    ['backend', 'status'], buckets=LATENCY_BUCKETS,
+)
+geocode_request_retries = Counter(
+    'pretix_mapplugin_geocode_request_retries_total',
+    'Requests of the async engine retried after a timeout, rate limit or unavailable service.',
+    ['backend'],
+)
+geocode_results = Counter(
+    'pretix_mapplugin_geocode_results_total',
+    'Geocoding results stored for orders, by status (ok, not_found, timeout, service_error, no_address).',
+    ['status'],
+)
+geocode_cache_lookups = Counter(
+    'pretix_mapplugin_geocode_cache_lookups_total',
+    'Lookups of the shared address cache, by result (hit, miss).',
+    ['result'],
+)
+rate_limiter_wait = Histogram(
+    'pretix_mapplugin_rate_limiter_wait_seconds',
+    'Time callers waited for a slot of the shared rate limiter.',
+    ['limiter'], buckets=RATE_LIMIT_WAIT_BUCKETS,
+)
+paid_to_geocoded = Histogram(
+    'pretix_mapplugin_paid_to_geocoded_seconds',
+    'Time from an order being paid to its geocoding result being stored.',
+    ['mode'], buckets=LAG_BUCKETS,
+)
+task_retries = Counter(
+    'pretix_mapplugin_task_retries_total',
+    'Celery task runs of this plugin that failed and were retried.',
+    ['task_name'],
+)
+
+# --- Map Data ---
+data_view_build_duration = Histogram(
+    'pretix_mapplugin_data_view_build_seconds',
+    'Time to build the map data of an event (cache misses only), by format.',
+    ['format'], buckets=BUILD_BUCKETS,
+)
+data_view_rows = Histogram(
+    'pretix_mapplugin_data_view_rows',
+    'Locations in built map data responses, by format.',
+    ['format'], buckets=ROW_BUCKETS,
+)
+density_tile_render_duration = Histogram(
+    'pretix_mapplugin_density_tile_render_seconds',
+    'Time to render one heatmap density tile, on request or pre-rendered in the background.',
+    ['mode'], buckets=BUILD_BUCKETS,
+)
+
+
+# --- Recording Helpers ---
+def observe(metric: Histogram, amount: float, **labels):
+    """Records a value, never raising: monitoring must not break geocoding or the map."""
+    try:
+        metric.observe(max(amount, 0), **labels)
+    except Exception as e:
+        logger.debug(f"Could not record metric {metric.name}: {e}")
+
+
+def inc(metric: Counter, amount: float = 1, **labels):
+    """Increments a counter, never raising, see `observe`."""
+    if not amount:
+        return
+    try:
+        metric.inc(amount, **labels)
+    except Exception as e:
+        logger.debug(f"Could not record metric {metric.name}: {e}")
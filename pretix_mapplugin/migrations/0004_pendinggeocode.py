@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0003_geocodecacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingGeocode',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='pretixbase.order')),
+                ('queued_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Pending Geocode',
+                'verbose_name_plural': 'Pending Geocodes',
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+from pretix_mapplugin.geohash import encode as encode_geohash
+
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def backfill_event_and_geohash(apps, schema_editor):
+    OrderGeocodeData = apps.get_model('pretix_mapplugin', 'OrderGeocodeData')
+    Order = apps.get_model('pretixbase', 'Order')
+
+    OrderGeocodeData.objects.filter(event__isnull=True).update(
+        event_id=Subquery(Order.objects.filter(pk=OuterRef('order_id')).values('event_id')[:1])
+    )
+
+    rows = OrderGeocodeData.objects.filter(
+        latitude__isnull=False, longitude__isnull=False, geohash__isnull=True
+    ).only('pk', 'latitude', 'longitude').order_by('pk')
+    batch = []
+    for row in rows.iterator(chunk_size=BACKFILL_CHUNK_SIZE):
+        row.geohash = encode_geohash(row.latitude, row.longitude)
+        batch.append(row)
+        if len(batch) >= BACKFILL_CHUNK_SIZE:
+            OrderGeocodeData.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        OrderGeocodeData.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0004_pendinggeocode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='event',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.event'),
+        ),
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='geohash',
+            field=models.CharField(max_length=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ordergeocodedata',
+            index=models.Index(fields=['event', 'geohash'], name='pretix_mapplugin_evt_geohash'),
+        ),
+        migrations.RunPython(backfill_event_and_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:41
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils.timezone import now
+
+# Old failures become due one every RETRY_SPACING_SECONDS, below public Nominatim's 1 request per second,
+# so the backlog drains over time instead of all in the first retry run.
+RETRY_SPACING_SECONDS = 2
+BATCH_SIZE = 1000
+
+
+def mark_missing_coordinates_for_retry(apps, schema_editor):
+    # Earlier versions stored every failure as null coordinates without a reason. Orders without an
+    # address were never sent to the geocoder; treat the others as transient, so the retry task
+    # attempts them once more and records the actual outcome.
+    OrderGeocodeData = apps.get_model('pretix_mapplugin', 'OrderGeocodeData')
+    failed = OrderGeocodeData.objects.filter(latitude__isnull=True)
+    no_address = Q(order__invoice_address__isnull=True) | Q(
+        order__invoice_address__street='', order__invoice_address__zipcode='',
+        order__invoice_address__city='', order__invoice_address__country='',
+    )
+    failed.filter(no_address).update(status='no_address', next_retry_at=None)
+
+    start = now()
+    pks = list(failed.exclude(no_address).order_by('pk').values_list('pk', flat=True))
+    for offset in range(0, len(pks), BATCH_SIZE):
+        batch = pks[offset:offset + BATCH_SIZE]
+        # Each batch becomes due at once, the retry task still sends its requests through the rate limiter
+        OrderGeocodeData.objects.filter(pk__in=batch).update(
+            status='service_error', next_retry_at=start + timedelta(seconds=offset * RETRY_SPACING_SECONDS),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0005_ordergeocodedata_event_geohash'),
+        # Invoice addresses with all fields read by mark_missing_coordinates_for_retry
+        ('pretixbase', '0132_auto_20190808_1253'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='status',
+            field=models.CharField(choices=[('ok', 'Geocoded'), ('not_found', 'Address not found'), ('timeout', 'Geocoding service timed out'), ('service_error', 'Geocoding service error'), ('no_address', 'No address')], default='ok', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(mark_missing_coordinates_for_retry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0006_ordergeocodedata_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geocodecacheentry',
+            name='match_level',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='match_level',
+            field=models.CharField(blank=True, choices=[('address', 'Full address'), ('postcode', 'Postcode and city'), ('city', 'City')], max_length=16, null=True),
+        ),
+    ]
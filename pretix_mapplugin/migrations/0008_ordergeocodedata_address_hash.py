@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0007_match_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordergeocodedata',
+            name='address_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0008_ordergeocodedata_address_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventGeoAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('dimension', models.CharField(max_length=16)),
+                ('key', models.CharField(max_length=190)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                            to='pretixbase.event')),
+            ],
+            options={
+                'verbose_name': 'Event Geo Aggregate',
+                'verbose_name_plural': 'Event Geo Aggregates',
+                'unique_together': {('event', 'dimension', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def recompute_address_hashes(apps, schema_editor):
+    """
+    Fingerprints used to contain the country name in the language active
+    while they were computed. Recompute them from the language-neutral parts,
+    so unchanged addresses are not geocoded again after upgrading.
+    """
+    from pretix_mapplugin.geocache import get_order_address_hash
+
+    OrderGeocodeData = apps.get_model('pretix_mapplugin', 'OrderGeocodeData')
+    rows = OrderGeocodeData.objects.filter(address_hash__isnull=False).select_related('order__invoice_address')
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        try:
+            row.address_hash = get_order_address_hash(row.order)
+        except ObjectDoesNotExist:  # Address deleted since
+            row.address_hash = None
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            OrderGeocodeData.objects.bulk_update(batch, ['address_hash'])
+            batch = []
+    if batch:
+        OrderGeocodeData.objects.bulk_update(batch, ['address_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0009_eventgeoaggregate'),
+        # Invoice addresses with all fields read by get_order_address_hash
+        ('pretixbase', '0132_auto_20190808_1253'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_address_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+import hashlib
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import translation
+from django_countries import countries
+
+BATCH_SIZE = 1000
+# Country names containing commas ("Korea, Republic of") span several parts of an address
+MAX_COUNTRY_PARTS = 3
+
+
+def _country_codes_by_name() -> dict:
+    """Maps every normalized country name, in all configured languages, to its lowercase ISO code."""
+    from pretix_mapplugin.geocache import normalize_address
+
+    codes = {}
+    for language, _ in settings.LANGUAGES:
+        with translation.override(language):
+            for code, name in countries:
+                codes.setdefault(normalize_address(str(name)), code.lower())
+    return codes
+
+
+def rekey_cache_entries(apps, schema_editor):
+    """
+    Cache entries used to be keyed by addresses ending in the country's name
+    in the language active while they were stored. Replace the name with the
+    ISO code, as format_cache_address does, so cached results keep being
+    used after upgrading. Of the entries that now collide, the most recently
+    stored one is kept.
+    """
+    GeocodeCacheEntry = apps.get_model('pretix_mapplugin', 'GeocodeCacheEntry')
+    codes = _country_codes_by_name()
+    seen = set()
+    updates, duplicates = [], []
+    entries = GeocodeCacheEntry.objects.only('normalized_address', 'address_hash').order_by('-stored_at', '-pk')
+    for entry in entries.iterator(chunk_size=BATCH_SIZE):
+        normalized, address_hash = entry.normalized_address, entry.address_hash
+        parts = normalized.split(', ')
+        for size in range(min(MAX_COUNTRY_PARTS, len(parts) - 1), 0, -1):
+            code = codes.get(', '.join(parts[-size:]))
+            if code:
+                normalized = ', '.join(parts[:-size] + [code])
+                address_hash = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+                break
+        if address_hash in seen:  # A newer entry for this address has been visited already
+            duplicates.append(entry.pk)
+            continue
+        seen.add(address_hash)
+        if address_hash != entry.address_hash:
+            entry.normalized_address, entry.address_hash = normalized, address_hash
+            updates.append(entry)
+    # Remove older duplicates first, they might still hold the hash a newer entry is moved to
+    for i in range(0, len(duplicates), BATCH_SIZE):
+        GeocodeCacheEntry.objects.filter(pk__in=duplicates[i:i + BATCH_SIZE]).delete()
+    GeocodeCacheEntry.objects.bulk_update(updates, ['normalized_address', 'address_hash'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0010_language_neutral_address_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_cache_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mapplugin', '0011_language_neutral_cache_keys'),
+    ]
+
+    operations = [
+        # Recreated with varchar_pattern_ops, so PostgreSQL serves geohash prefix matches (LIKE 'u33%') from it
+        migrations.RemoveIndex(
+            model_name='ordergeocodedata',
+            name='pretix_mapplugin_evt_geohash',
+        ),
+        migrations.AddIndex(
+            model_name='ordergeocodedata',
+            index=models.Index(fields=['event', 'geohash'], name='pretix_mapplugin_evt_geohash',
+                               opclasses=['', 'varchar_pattern_ops']),
+        ),
+    ]
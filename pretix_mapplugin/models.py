@@ -1,12 +1,40 @@
 from django.db import models
-from pretix.base.models import LoggedModel, Order
+from pretix.base.models import Event, LoggedModel, Order
+
+from .geohash import encode as encode_geohash
 
 
 class OrderGeocodeData(LoggedModel):  # Keep LoggedModel if you want audit logs
     """
     Stores the geocoded coordinates for a Pretix Order's invoice address.
-    Allows null coordinates for failed geocoding attempts.
+    Allows null coordinates for failed geocoding attempts, `status` tells why
+    they are missing. Transient failures (timeouts, service errors) are
+    retried by `retry_failed_geocodes_task` at `next_retry_at`.
     """
+    STATUS_OK = 'ok'
+    STATUS_NOT_FOUND = 'not_found'
+    STATUS_TIMEOUT = 'timeout'
+    STATUS_SERVICE_ERROR = 'service_error'
+    STATUS_NO_ADDRESS = 'no_address'
+    STATUS_CHOICES = (
+        (STATUS_OK, 'Geocoded'),
+        (STATUS_NOT_FOUND, 'Address not found'),
+        (STATUS_TIMEOUT, 'Geocoding service timed out'),
+        (STATUS_SERVICE_ERROR, 'Geocoding service error'),
+        (STATUS_NO_ADDRESS, 'No address'),
+    )
+    # Failures worth another attempt later, everything else is final
+    TRANSIENT_STATUSES = (STATUS_TIMEOUT, STATUS_SERVICE_ERROR)
+    # Query that found the coordinates, from most to least precise (see geocoding.get_query_ladder)
+    MATCH_ADDRESS = 'address'
+    MATCH_POSTCODE = 'postcode'
+    MATCH_CITY = 'city'
+    MATCH_LEVEL_CHOICES = (
+        (MATCH_ADDRESS, 'Full address'),
+        (MATCH_POSTCODE, 'Postcode and city'),
+        (MATCH_CITY, 'City'),
+    )
+
     order = models.OneToOneField(
         Order,
         on_delete=models.CASCADE,
@@ -22,6 +50,52 @@ class OrderGeocodeData(LoggedModel):  # Keep LoggedModel if you want audit logs
         blank=True  # Allow blank in forms/admin
     )
 
+    # Denormalized from order.event so spatial queries of an event can use the index below
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    geohash = models.CharField(
+        max_length=12,
+        null=True,  # NULL if geocoding failed
+        blank=True,
+        help_text="Geohash of the coordinates, nearby orders share common prefixes."
+    )
+
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_OK,
+        help_text="Outcome of the last geocoding attempt."
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Number of geocoding attempts so far."
+    )
+    match_level = models.CharField(
+        max_length=16,
+        choices=MATCH_LEVEL_CHOICES,
+        null=True,  # NULL if no coordinates were found
+        blank=True,
+        help_text="Precision of the query that found the coordinates."
+    )
+    next_retry_at = models.DateTimeField(
+        null=True,  # NULL if the outcome is final
+        blank=True,
+        db_index=True,  # Due retries are picked with a range scan
+        help_text="When a transient failure is attempted again."
+    )
+
+    address_hash = models.CharField(
+        max_length=64,
+        null=True,  # NULL if the order has no address, or was geocoded by an earlier version
+        blank=True,
+        help_text="Fingerprint of the geocoded address (see geocache.address_cache_key), to detect changes."
+    )
+
     # Change to auto_now to update timestamp on every save (successful or null)
     last_geocoded_at = models.DateTimeField(
         auto_now=True,  # Set/Update timestamp every time the record is saved
@@ -31,10 +105,33 @@ class OrderGeocodeData(LoggedModel):  # Keep LoggedModel if you want audit logs
     class Meta:
         verbose_name = "Order Geocode Data"
         verbose_name_plural = "Order Geocode Data"
-        # Optional: Indexing coordinates can speed up map data queries if you have many entries
-        # indexes = [
-        #     models.Index(fields=['latitude', 'longitude']),
-        # ]
+        # Spatial aggregation and bounding box filters of an event become range scans on this index.
+        # geohash__startswith is a LIKE 'prefix%', which PostgreSQL only serves from a pattern_ops index
+        # unless the database uses the C collation (the opclasses are ignored by other databases).
+        indexes = [
+            models.Index(fields=['event', 'geohash'], name='pretix_mapplugin_evt_geohash',
+                         opclasses=['', 'varchar_pattern_ops']),
+        ]
+
+    def update_derived_fields(self):
+        """
+        Fills the denormalized event and the geohash from the order and the
+        coordinates. Called by save(), must be called explicitly before bulk writes.
+        """
+        if self.event_id is None and self.order_id is not None:
+            self.event_id = self.order.event_id
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+
+    def save(self, *args, **kwargs):
+        self.update_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Keep derived fields in sync with partial updates of the coordinates
+            kwargs['update_fields'] = set(update_fields) | {'event', 'geohash'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         # Provide more informative string representation
@@ -44,4 +141,124 @@ class OrderGeocodeData(LoggedModel):  # Keep LoggedModel if you want audit logs
             # Indicate if it's pending (never attempted) or failed (null coords stored)
             # This requires knowing if the record exists but has nulls vs doesn't exist yet
             # The current __str__ assumes the record exists if called.
-            return f"Geocode data for Order {self.order.code} (Coordinates: None)"
+            return f"Geocode data for Order {self.order.code} (Coordinates: None, {self.get_status_display()})"
+
+
+class GeocodeCacheEntry(models.Model):
+    """
+    Caches the geocoding result for a normalized address string, so orders
+    sharing an address (repeat buyers, group bookings, company invoice
+    addresses) only cause a single request to the geocoding service.
+    Null coordinates are cached as a negative result with a shorter lifetime.
+    """
+    address_hash = models.CharField(
+        max_length=64,
+        unique=True,  # SHA-256 hex digest of the normalized address
+    )
+    normalized_address = models.TextField()
+    latitude = models.FloatField(
+        null=True,  # NULL marks a negative (not found / failed) result
+        blank=True
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True
+    )
+    match_level = models.CharField(
+        max_length=16,
+        null=True,  # See OrderGeocodeData.match_level
+        blank=True
+    )
+    stored_at = models.DateTimeField(
+        auto_now=True,
+        help_text="Timestamp when this result was (re-)stored."
+    )
+    expires_at = models.DateTimeField(
+        db_index=True,  # Used by lookups and the periodic cleanup
+        help_text="Entries are ignored and eventually purged after this point in time."
+    )
+
+    class Meta:
+        verbose_name = "Geocode Cache Entry"
+        verbose_name_plural = "Geocode Cache Entries"
+
+    @property
+    def is_negative(self) -> bool:
+        return self.latitude is None or self.longitude is None
+
+    def __str__(self):
+        if self.is_negative:
+            return f"Geocode cache for '{self.normalized_address}' (Coordinates: None)"
+        return f"Geocode cache for '{self.normalized_address}': ({self.latitude:.4f}, {self.longitude:.4f})"
+
+
+class PendingGeocode(models.Model):
+    """
+    Queue of paid orders waiting to be geocoded by the batch task
+    (`geocode_pending_orders_task`), used when `batch_mode` is enabled.
+    """
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='+',
+        primary_key=True  # An order is queued at most once
+    )
+    queued_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True  # The batch task drains the queue oldest first
+    )
+
+    class Meta:
+        verbose_name = "Pending Geocode"
+        verbose_name_plural = "Pending Geocodes"
+
+    def __str__(self):
+        return f"Pending geocode for Order PK {self.order_id}"
+
+
+class EventGeoAggregate(models.Model):
+    """
+    Materialized count of an event's geocoded orders for one key of one
+    dimension: a country, city, postcode or distance ring around the venue.
+    Rebuilt per event shortly after its geocode data is written (see
+    aggregates.py), so the statistics view never scans the raw rows.
+    """
+    DIMENSION_TOTAL = 'total'
+    DIMENSION_COUNTRY = 'country'
+    DIMENSION_CITY = 'city'
+    DIMENSION_POSTCODE = 'postcode'
+    DIMENSION_RING = 'ring'
+    DIMENSION_CHOICES = (
+        (DIMENSION_TOTAL, 'All geocoded orders'),
+        (DIMENSION_COUNTRY, 'Country'),
+        (DIMENSION_CITY, 'City'),
+        (DIMENSION_POSTCODE, 'Postcode'),
+        (DIMENSION_RING, 'Distance from the venue'),
+    )
+
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    dimension = models.CharField(
+        max_length=16,
+        choices=DIMENSION_CHOICES
+    )
+    key = models.CharField(
+        max_length=190,
+        help_text="Country code, 'City (CC)', 'CC postcode' or a ring like '10-25' (km)."
+    )
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="Timestamp when the event's aggregates were last rebuilt."
+    )
+
+    class Meta:
+        verbose_name = "Event Geo Aggregate"
+        verbose_name_plural = "Event Geo Aggregates"
+        unique_together = (('event', 'dimension', 'key'),)
+
+    def __str__(self):
+        return f"{self.get_dimension_display()} '{self.key}' of event {self.event_id}: {self.count}"
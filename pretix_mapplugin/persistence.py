@@ -0,0 +1,129 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import NamedTuple
+
+from django.db import transaction
+from django.utils.timezone import now
+from pretix.base.models import Order
+
+from .aggregates import schedule_aggregate_refresh
+from .config import get_int_setting
+from .density import schedule_density_prerender
+from .metrics import geocode_results, inc
+from .models import OrderGeocodeData
+
+logger = logging.getLogger(__name__)
+
+# Rows written per INSERT statement
+DEFAULT_BULK_CHUNK_SIZE = 1000
+# Fields refreshed when a row for the order already exists
+UPSERT_UPDATE_FIELDS = ['latitude', 'longitude', 'event', 'geohash', 'status', 'attempts', 'next_retry_at',
+                        'match_level', 'address_hash', 'last_geocoded_at']
+
+# --- Retry Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# retry_max_attempts: Attempts (including the first) after which a timeout or service error is final.
+# retry_base_delay: Minutes before the first retry, doubled for every further attempt.
+# retry_max_delay: Upper bound of the delay between two attempts, in minutes.
+DEFAULT_RETRY_MAX_ATTEMPTS = 6
+DEFAULT_RETRY_BASE_DELAY = 15
+DEFAULT_RETRY_MAX_DELAY = 60 * 24
+
+
+class GeocodeResult(NamedTuple):
+    """Outcome of geocoding one order, as written by `save_geocode_results`."""
+    order_pk: int
+    latitude: float | None
+    longitude: float | None
+    status: str | None = None  # Derived from the coordinates if not given: found or not found
+    attempts: int = 1
+    match_level: str | None = None  # See OrderGeocodeData.match_level
+    address_hash: str | None = None  # See OrderGeocodeData.address_hash
+
+
+def get_next_retry_at(status: str, attempts: int, base: datetime | None = None) -> datetime | None:
+    """
+    Returns when an order should be geocoded again after `attempts` attempts
+    ending with `status`: exponential backoff for transient failures, None
+    for final outcomes or once `retry_max_attempts` is reached.
+    """
+    if status not in OrderGeocodeData.TRANSIENT_STATUSES:
+        return None
+    if attempts >= get_int_setting('retry_max_attempts', DEFAULT_RETRY_MAX_ATTEMPTS):
+        return None
+    delay = get_int_setting('retry_base_delay', DEFAULT_RETRY_BASE_DELAY) * 2 ** max(attempts - 1, 0)
+    delay = min(delay, get_int_setting('retry_max_delay', DEFAULT_RETRY_MAX_DELAY))
+    return (base or now()) + timedelta(minutes=delay)
+
+
+# --- Bulk Persistence of Geocoding Results ---
+def save_geocode_results(results, event_ids: dict[int, int] | None = None, overwrite: bool = True,
+                         chunk_size: int = DEFAULT_BULK_CHUNK_SIZE) -> int:
+    """
+    Stores many geocoding results with one INSERT per chunk instead of a
+    SELECT plus INSERT/UPDATE per order. Derived fields (event, geohash) are
+    filled in as `OrderGeocodeData.save()` would and transient failures are
+    scheduled for a retry (see `get_next_retry_at`); no log entries are written.
+    The aggregates and density tiles of the affected events are rebuilt once
+    the transaction commits (see `schedule_aggregate_refresh` and
+    `schedule_density_prerender`).
+
+    Args:
+        results: Iterable of `GeocodeResult` or plain (order_pk, latitude, longitude)
+            tuples. Latitude and longitude are None for orders that could not be geocoded.
+        event_ids: Optional mapping of order_pk to event_id for orders the
+            caller already loaded. Missing ones are read with one query per chunk.
+        overwrite: Whether existing rows are updated (upsert). If False, orders
+            that already have a row keep it.
+        chunk_size: Rows per INSERT statement.
+
+    Returns:
+        The number of rows passed to the database.
+    """
+    event_ids = event_ids or {}
+    results = (GeocodeResult(*result) for result in results)
+    written_at = now()
+    written = 0
+    written_event_ids = set()
+    while True:
+        chunk = list(islice(results, chunk_size))
+        if not chunk:
+            break
+
+        missing = [result.order_pk for result in chunk if result.order_pk not in event_ids]
+        if missing:
+            event_ids.update(Order.objects.filter(pk__in=missing).values_list('pk', 'event_id'))
+
+        rows = {}
+        for order_pk, latitude, longitude, status, attempts, match_level, address_hash in chunk:
+            if order_pk not in event_ids:
+                logger.warning(f"Order PK {order_pk} not found, geocoding result not saved.")
+                continue
+            if status is None:
+                found = latitude is not None and longitude is not None
+                status = OrderGeocodeData.STATUS_OK if found else OrderGeocodeData.STATUS_NOT_FOUND
+            row = OrderGeocodeData(order_id=order_pk, event_id=event_ids[order_pk],
+                                   latitude=latitude, longitude=longitude, status=status, attempts=attempts,
+                                   match_level=match_level if latitude is not None else None, address_hash=address_hash,
+                                   next_retry_at=get_next_retry_at(status, attempts, written_at))
+            row.update_derived_fields()  # bulk_create bypasses save()
+            rows[order_pk] = row  # An upsert may not touch the same row twice
+
+        with transaction.atomic():
+            if overwrite:
+                OrderGeocodeData.objects.bulk_create(
+                    rows.values(), update_conflicts=True,
+                    unique_fields=['order'], update_fields=UPSERT_UPDATE_FIELDS,
+                )
+            else:
+                OrderGeocodeData.objects.bulk_create(rows.values(), ignore_conflicts=True)
+        written += len(rows)
+        written_event_ids.update(row.event_id for row in rows.values())
+        for status, count in Counter(row.status for row in rows.values()).items():
+            inc(geocode_results, count, status=status)
+
+    if written_event_ids:
+        transaction.on_commit(lambda: schedule_aggregate_refresh(written_event_ids))
+        transaction.on_commit(lambda: schedule_density_prerender(written_event_ids))
+    return written
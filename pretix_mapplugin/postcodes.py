@@ -0,0 +1,153 @@
+import csv
+import io
+import logging
+import mmap
+import os
+import struct
+import threading
+import zipfile
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# --- Binary Table Format ---
+# Header: magic, record count. Records: country (2 bytes) + postcode (10 bytes, NUL padded),
+# latitude and longitude as float32 (~1m precision), sorted by key for binary search.
+POSTCODE_FILE_MAGIC = b'PMPC0001'
+_HEADER = struct.Struct('<8sI')
+_RECORD = struct.Struct('<12sff')
+COUNTRY_LENGTH = 2
+POSTCODE_LENGTH = 10
+KEY_LENGTH = COUNTRY_LENGTH + POSTCODE_LENGTH
+
+
+def normalize_postcode(postcode: str) -> str:
+    """Removes whitespace and uppercases a postcode, so '1012 ab' and '1012AB' match."""
+    return ''.join((postcode or '').split()).upper()
+
+
+def postcode_key(country: str, postcode: str) -> bytes | None:
+    """Returns the fixed-size lookup key, or None if the postcode cannot be stored."""
+    country = (country or '').strip().upper()
+    postcode = normalize_postcode(postcode)
+    try:
+        country_bytes = country.encode('ascii')
+        postcode_bytes = postcode.encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    if len(country_bytes) != COUNTRY_LENGTH or not postcode_bytes or len(postcode_bytes) > POSTCODE_LENGTH:
+        return None
+    return country_bytes + postcode_bytes.ljust(POSTCODE_LENGTH, b'\0')
+
+
+# --- Import ---
+def _open_geonames_dump(source_path: str):
+    """Opens a GeoNames postal code dump, either the .txt file or the .zip it is distributed in."""
+    if zipfile.is_zipfile(source_path):
+        archive = zipfile.ZipFile(source_path)
+        names = [n for n in archive.namelist() if n.endswith('.txt') and not n.lower().startswith('readme')]
+        if not names:
+            raise ValueError(f"No postal code data found in {source_path}.")
+        return io.TextIOWrapper(archive.open(names[0]), encoding='utf-8', newline='')
+    return open(source_path, encoding='utf-8', newline='')
+
+
+def build_postcode_file(source_path: str, target_path: str) -> int:
+    """
+    Builds the binary lookup table from a GeoNames postal code dump (tab
+    separated: country, postcode, place names and codes, latitude, longitude).
+    Postcodes listed for several places are placed at the mean of their
+    coordinates. The table is written to a temporary file and moved into
+    place, so running lookups keep working while it is rebuilt.
+
+    Returns:
+        The number of postcodes written.
+    """
+    sums = defaultdict(lambda: [0.0, 0.0, 0])
+    skipped = 0
+    with _open_geonames_dump(source_path) as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            try:
+                key = postcode_key(row[0], row[1])
+                latitude, longitude = float(row[9]), float(row[10])
+            except (IndexError, ValueError):
+                key = None
+            if key is None:
+                skipped += 1
+                continue
+            entry = sums[key]
+            entry[0] += latitude
+            entry[1] += longitude
+            entry[2] += 1
+    if skipped:
+        logger.info(f"Skipped {skipped} rows of {source_path} without valid country, postcode or coordinates.")
+
+    tmp_path = f"{target_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(POSTCODE_FILE_MAGIC, len(sums)))
+        for key in sorted(sums):
+            latitude_sum, longitude_sum, count = sums[key]
+            f.write(_RECORD.pack(key, latitude_sum / count, longitude_sum / count))
+    os.replace(tmp_path, target_path)
+    return len(sums)
+
+
+# --- Lookup ---
+class PostcodeTable:
+    """
+    Read-only view of a table built by `build_postcode_file`. The file is
+    memory-mapped, so it is shared between processes through the page cache
+    and a lookup is a binary search touching only a few pages.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{path} is not a postcode table.")
+        magic, self.count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != POSTCODE_FILE_MAGIC or len(self._mmap) < _HEADER.size + self.count * _RECORD.size:
+            raise ValueError(f"{path} is not a postcode table (build it with the import_postcode_centroids command).")
+        self.mtime = os.stat(path).st_mtime
+
+    def __len__(self):
+        return self.count
+
+    def _key_at(self, index: int) -> bytes:
+        offset = _HEADER.size + index * _RECORD.size
+        return self._mmap[offset:offset + KEY_LENGTH]
+
+    def lookup(self, country: str, postcode: str) -> tuple[float, float] | None:
+        """Returns the (latitude, longitude) centroid of a postcode, or None if unknown."""
+        key = postcode_key(country, postcode)
+        if key is None:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key_at(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.count and self._key_at(low) == key:
+            _, latitude, longitude = _RECORD.unpack_from(self._mmap, _HEADER.size + low * _RECORD.size)
+            return round(latitude, 5), round(longitude, 5)
+        return None
+
+    def close(self):
+        self._mmap.close()
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_postcode_table(path: str) -> PostcodeTable:
+    """Returns the per-process table for the given file, reopened if the file was rebuilt."""
+    with _tables_lock:
+        table = _tables.get(path)
+        if table is None or os.stat(path).st_mtime != table.mtime:
+            # A replaced table keeps its old mapping valid, it is only released with the object
+            table = _tables[path] = PostcodeTable(path)
+        return table
@@ -0,0 +1,115 @@
+import logging
+import time
+
+from django.core.cache import cache as default_cache
+
+from .backends import get_backend_class
+from .config import get_int_setting
+from .metrics import observe, rate_limiter_wait
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# rate_limit: Requests per second across ALL workers and processes (Nominatim policy: 1). 0 disables limiting.
+#   Applies to public Nominatim, other backends use <identifier>_rate_limit (see backends.py).
+# rate_limit_burst: Number of requests that may be sent back-to-back after an idle period.
+DEFAULT_RATE_LIMIT = 1.0
+DEFAULT_RATE_LIMIT_BURST = 1
+RATE_LIMIT_CACHE_PREFIX = 'pretix_mapplugin:ratelimit'
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all processes through the Django cache, so N Celery
+    workers and the management command together never exceed `rate` requests
+    per second, while no caller waits longer than needed when capacity is free.
+
+    Implemented as a "generic cell rate algorithm": the cache stores the
+    theoretical arrival time of the next request, every caller atomically
+    reserves a slot and then sleeps until its slot starts. This requires a
+    cache shared between processes (e.g. redis) to be effective across workers;
+    any cache instance (e.g. LocMemCache) can be passed in for tests.
+    """
+
+    def __init__(self, name: str = 'geocoder', rate: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_RATE_LIMIT_BURST,
+                 cache=None, lock_timeout: float = 5.0):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.cache = cache if cache is not None else default_cache
+        self.lock_timeout = lock_timeout
+        self.state_key = f'{RATE_LIMIT_CACHE_PREFIX}:{name}:tat'
+        self.lock_key = f'{RATE_LIMIT_CACHE_PREFIX}:{name}:lock'
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate is not None and self.rate > 0
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.rate
+
+    def _lock(self) -> bool:
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            if self.cache.add(self.lock_key, 1, timeout=max(1, int(self.lock_timeout))):
+                return True
+            time.sleep(0.005)
+        return False
+
+    def _unlock(self):
+        self.cache.delete(self.lock_key)
+
+    def reserve(self) -> float:
+        """
+        Reserves the next free request slot.
+
+        Returns:
+            The number of seconds the caller has to wait before sending its request.
+        """
+        if not self.enabled:
+            return 0.0
+
+        locked = self._lock()
+        if not locked:
+            # Should only happen if a lock holder died; its lock expires on its own.
+            logger.warning(f"Could not acquire rate limiter lock '{self.lock_key}', reserving without lock.")
+        try:
+            current = time.time()
+            tat = max(self.cache.get(self.state_key) or current, current)
+            # Up to `burst` requests may start before their steady-rate slot
+            allowed_at = tat - (self.burst - 1) * self.interval
+            wait = max(0.0, allowed_at - current)
+            new_tat = tat + self.interval
+            self.cache.set(self.state_key, new_tat, timeout=int(new_tat - current) + 60)
+            observe(rate_limiter_wait, wait, limiter=self.name)
+            return wait
+        finally:
+            if locked:
+                self._unlock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until the caller may send a request.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+# --- Shared Limiter for the Geocoding Service ---
+def get_rate_limiter(rate: float | None = None, backend: str | None = None) -> RateLimiter:
+    """
+    Returns the limiter shared by geocode_order_task and the management command
+    for the configured geocoder backend (or the one with the given identifier),
+    using the backend's rate limit from pretix.cfg unless an explicit rate is given.
+    """
+    backend_class = get_backend_class(backend)
+    if rate is None:
+        rate = backend_class.get_rate_limit()
+    burst = get_int_setting('rate_limit_burst', DEFAULT_RATE_LIMIT_BURST)
+    return RateLimiter(name=f'geocoder:{backend_class.identifier}', rate=rate, burst=burst)
@@ -4,13 +4,26 @@ from django.urls import reverse, NoReverseMatch
 from django.utils.translation import gettext_lazy as _
 from django.http import HttpRequest
 from django.conf import settings
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
 
 # --- Pretix Signals ---
-from pretix.base.signals import order_paid
+from pretix.base.signals import order_changed, order_modified, order_paid, periodic_task
 from pretix.control.signals import nav_event
+# --- Pretix Models ---
+from pretix.base.models import Order
 
 # --- Tasks ---
-from .tasks import geocode_order_task
+from .tasks import (
+    geocode_order_task,
+    geocode_pending_orders_task,
+    retry_failed_geocodes_task,
+    schedule_pending_geocoding,
+)
+from .models import OrderGeocodeData, PendingGeocode
+from .config import get_bool_setting, get_setting
+# --- Geocode Cache ---
+from .geocache import get_order_address_hash, purge_expired_cache_entries
 # --- Geocoding Default ---
 from .geocoding import DEFAULT_NOMINATIM_USER_AGENT
 
@@ -22,12 +35,25 @@ REQUIRED_MAP_PERMISSION = 'can_view_orders'
 PLUGIN_NAME = 'pretix_mapplugin'
 
 
+# --- Read User-Agent from settings ---
+def get_nominatim_user_agent() -> str:
+    """
+    Returns the Nominatim User-Agent configured for this plugin, or the default.
+    """
+    if hasattr(settings, 'plugins') and hasattr(settings.plugins, PLUGIN_NAME):
+        plugin_settings = getattr(settings.plugins, PLUGIN_NAME)
+        return plugin_settings.get('nominatim_user_agent', DEFAULT_NOMINATIM_USER_AGENT)
+    return get_setting('nominatim_user_agent', DEFAULT_NOMINATIM_USER_AGENT)
+
+
 # --- Signal Receiver for Geocoding (Passes organizer_pk) ---
 @receiver(order_paid, dispatch_uid="sales_mapper_order_paid_geocode")
 def trigger_geocoding_on_payment(sender, order, **kwargs):
     """
     Listens for the order_paid signal, reads geocoding config,
     and queues the geocoding task with order_pk, organizer_pk, and config.
+    In batch mode, the order is only recorded as pending and a debounced
+    batch task geocodes all pending orders together.
     """
     user_agent = DEFAULT_NOMINATIM_USER_AGENT
     organizer_pk = None  # Initialize
@@ -38,20 +64,22 @@ def trigger_geocoding_on_payment(sender, order, **kwargs):
             return
 
         organizer_pk = order.event.organizer.pk  # Get organizer PK
+        user_agent = get_nominatim_user_agent()
 
-        # --- Read User-Agent from settings ---
-        if hasattr(settings, 'plugins') and hasattr(settings.plugins, PLUGIN_NAME):
-            plugin_settings = getattr(settings.plugins, PLUGIN_NAME)
-            user_agent = plugin_settings.get('nominatim_user_agent', DEFAULT_NOMINATIM_USER_AGENT)
-        else:
-            logger.warning(f"Could not access settings.plugins.{PLUGIN_NAME}, using default User-Agent.")
+        # --- Batch mode: record as pending, geocode later in chunks ---
+        if get_bool_setting('batch_mode', False):
+            PendingGeocode.objects.get_or_create(order=order)
+            schedule_pending_geocoding(nominatim_user_agent=user_agent)
+            logger.info(f"Order {order.code} (PK: {order.pk}) queued for batch geocoding.")
+            return
 
         # --- Queue task with user_agent and organizer_pk as keyword arguments ---
         geocode_order_task.apply_async(
             args=[order.pk],  # Keep order_pk as positional argument
             kwargs={
                 'nominatim_user_agent': user_agent,
-                'organizer_pk': organizer_pk  # Pass organizer PK
+                'organizer_pk': organizer_pk,  # Pass organizer PK
+                'paid_at': now().timestamp(),  # Start of the paid-to-geocoded lag metric
             }
         )
         logger.info(f"Geocoding task queued for paid order {order.code} (PK: {order.pk}, Org PK: {organizer_pk}).")
@@ -64,6 +92,79 @@ def trigger_geocoding_on_payment(sender, order, **kwargs):
         logger.exception(f"Failed to queue geocoding task for order {order.code}{org_info}: {e}")
 
 
+# --- Refresh Coordinates When the Invoice Address Changes ---
+@receiver(order_modified, dispatch_uid="sales_mapper_order_modified_refresh_geocode")
+@receiver(order_changed, dispatch_uid="sales_mapper_order_changed_refresh_geocode")
+def refresh_geocoding_on_address_change(sender, order, **kwargs):
+    """
+    Queues the geocoding task again for a geocoded order whose invoice
+    address no longer matches the stored fingerprint. Other modifications
+    (attendee names, answers, ...) cost one query and queue nothing.
+    """
+    try:
+        if order.status != order.STATUS_PAID:
+            return
+        stored_hashes = OrderGeocodeData.objects.filter(order_id=order.pk).values_list('address_hash', flat=True)
+        if not stored_hashes:
+            return
+        with scopes_disabled():
+            # The sender's order object may still carry the previous invoice address
+            current = Order.objects.select_related('invoice_address').get(pk=order.pk)
+        if stored_hashes[0] == get_order_address_hash(current):
+            return
+        geocode_order_task.apply_async(
+            args=[order.pk],
+            kwargs={
+                'nominatim_user_agent': get_nominatim_user_agent(),
+                'organizer_pk': order.event.organizer_id,
+                'refresh': True,
+            }
+        )
+        logger.info(f"Invoice address of order {order.code} changed, geocoding task queued.")
+    except Exception as e:
+        logger.exception(f"Failed to queue geocoding refresh for order {order.code}: {e}")
+
+
+# --- Periodic Cleanup of the Geocode Cache ---
+@receiver(periodic_task, dispatch_uid="sales_mapper_periodic_purge_geocode_cache")
+def purge_geocode_cache(sender, **kwargs):
+    """
+    Removes expired entries from the shared address-to-coordinate cache.
+    """
+    try:
+        purge_expired_cache_entries()
+    except Exception as e:
+        logger.exception(f"Failed to purge expired geocode cache entries: {e}")
+
+
+# --- Periodic Safety Net for Batch Mode ---
+@receiver(periodic_task, dispatch_uid="sales_mapper_periodic_geocode_pending")
+def geocode_pending_orders_periodically(sender, **kwargs):
+    """
+    Queues the batch task if pending orders are left over, e.g. because a
+    debounced run was lost or the queue grew faster than a single run drains it.
+    """
+    try:
+        if PendingGeocode.objects.exists():
+            geocode_pending_orders_task.apply_async(kwargs={'nominatim_user_agent': get_nominatim_user_agent()})
+    except Exception as e:
+        logger.exception(f"Failed to queue batch geocoding task: {e}")
+
+
+# --- Periodic Retries of Timeouts and Service Errors ---
+@receiver(periodic_task, dispatch_uid="sales_mapper_periodic_retry_failed_geocodes")
+def retry_failed_geocodes_periodically(sender, **kwargs):
+    """
+    Queues the retry task if orders whose geocoding failed transiently are due
+    for another attempt (see `OrderGeocodeData.next_retry_at`).
+    """
+    try:
+        if OrderGeocodeData.objects.filter(next_retry_at__lte=now()).exists():
+            retry_failed_geocodes_task.apply_async(kwargs={'nominatim_user_agent': get_nominatim_user_agent()})
+    except Exception as e:
+        logger.exception(f"Failed to queue geocoding retry task: {e}")
+
+
 # --- Signal Receiver for Adding Navigation Item (No changes needed) ---
 @receiver(nav_event, dispatch_uid="sales_mapper_nav_event_add_map")
 def add_map_nav_item(sender, request: HttpRequest, **kwargs):
@@ -23,9 +23,13 @@ document.addEventListener('DOMContentLoaded', function () {
     const statusOverlayId = 'map-status-overlay';
     const viewToggleButtonId = 'view-toggle-btn';
     const clusterToggleButtonId = 'cluster-toggle-btn';
+    const serverClusterToggleButtonId = 'server-cluster-toggle-btn';
+    const liveUpdateToggleButtonId = 'live-update-toggle-btn';
+    const catchmentToggleButtonId = 'catchment-toggle-btn';
     const heatmapOptionsPanelId = 'heatmap-options-panel';
     const initialZoom = 5;
     const defaultMapView = 'pins';
+    const defaultLiveUpdateInterval = 30;  // Seconds, overridden by data-live-update-interval
 
     // --- Globals & State ---
     let map = null;
@@ -34,7 +38,27 @@ document.addEventListener('DOMContentLoaded', function () {
     let heatmapLayer = null;
     let currentView = defaultMapView;
     let dataUrl = null;
+    let detailsUrl = null;  // Endpoint for tooltip details, loaded when a tooltip opens
+    let clustersUrl = null;  // Endpoint for clusters aggregated server-side
+    let statisticsUrl = null;  // Endpoint for the per-event statistics shown below the map
+    let densityUrl = null;  // Endpoint for heatmap tiles rendered server-side, only set if the server supports them
+    let densityLayer = null;
+    let densityRevision = 0;  // Changes the tile URLs, so live updates load fresh tiles
+    let catchmentUrl = null;  // Endpoint for the distances between buyers and the venue
+    let catchmentLayer = null;  // Distance rings around the venue, shown on top of either view
+    let isCatchmentShown = false;
+    let isServerClustering = false;  // Pins view shows server clusters, refetched on every map move
+    let serverClusterLayer = null;
+    let clusterRequestSeq = 0;  // Responses of outdated cluster requests are dropped
+    let isFullDataLoaded = false;
     let isClusteringEnabled = true;
+    let orderUrlTemplate = null;  // Order detail URL with codePlaceholder instead of the code (columnar format)
+    let codePlaceholder = null;
+    let markersByCode = {};  // code -> pin marker, so live updates can replace single markers
+    let syncedAt = null;  // Server timestamp of the loaded data, sent as ?since= for live updates
+    let isLiveUpdating = false;
+    let liveUpdateTimer = null;
+    let liveUpdateInterval = defaultLiveUpdateInterval;
     let heatmapOptions = {
         radius: 25, blur: 15, maxZoom: 18, minOpacity: 0.2
     };
@@ -44,6 +68,9 @@ document.addEventListener('DOMContentLoaded', function () {
     const statusOverlay = document.getElementById(statusOverlayId);
     const viewToggleButton = document.getElementById(viewToggleButtonId);
     const clusterToggleButton = document.getElementById(clusterToggleButtonId);
+    const serverClusterToggleButton = document.getElementById(serverClusterToggleButtonId);
+    const liveUpdateToggleButton = document.getElementById(liveUpdateToggleButtonId);
+    const catchmentToggleButton = document.getElementById(catchmentToggleButtonId);
     const heatmapOptionsPanel = document.getElementById(heatmapOptionsPanelId);
     const heatmapRadiusInput = document.getElementById('heatmap-radius');
     const heatmapBlurInput = document.getElementById('heatmap-blur');
@@ -95,6 +122,16 @@ document.addEventListener('DOMContentLoaded', function () {
             return;
         }
         console.log(`Data URL found: ${dataUrl}`);
+        detailsUrl = mapElement.dataset.detailsUrl || null;
+        clustersUrl = mapElement.dataset.clustersUrl || null;
+        statisticsUrl = mapElement.dataset.statisticsUrl || null;
+        densityUrl = mapElement.dataset.densityUrl || null;
+        catchmentUrl = mapElement.dataset.catchmentUrl || null;
+        // Large events start with server-side clusters instead of loading every point
+        const pointCount = parseInt(mapElement.dataset.pointCount, 10) || 0;
+        const serverClusterThreshold = parseInt(mapElement.dataset.serverClusterThreshold, 10) || Infinity;
+        isServerClustering = !!clustersUrl && pointCount > serverClusterThreshold;
+        liveUpdateInterval = parseInt(mapElement.dataset.liveUpdateInterval, 10) || defaultLiveUpdateInterval;
         updateStatus("Initializing map...");
 
         try {
@@ -111,8 +148,20 @@ document.addEventListener('DOMContentLoaded', function () {
 
             if (viewToggleButton) setupViewToggleButton();
             if (clusterToggleButton) setupClusterToggleButton();
+            if (serverClusterToggleButton) setupServerClusterToggleButton();
+            if (liveUpdateToggleButton) setupLiveUpdateToggleButton();
+            if (catchmentToggleButton && catchmentUrl) setupCatchmentToggleButton();
             setupHeatmapControls();
-            fetchDataAndDraw();
+            map.on('moveend', () => {
+                if (isServerClustering && currentView === 'pins') fetchServerClusters(false);
+            });
+            fetchStatistics();
+            if (isServerClustering) {
+                console.log("Starting in server-side clustering mode.");
+                fetchServerClusters(true);
+            } else {
+                fetchDataAndDraw();
+            }
 
         } catch (error) {
             console.error("ERROR during Leaflet initialization:", error);
@@ -121,22 +170,106 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
 
+    // --- Data URL & Format Helpers ---
+    function buildDataUrl(params) {
+        const url = new URL(dataUrl, window.location.origin);
+        Object.entries(params || {}).forEach(([key, value]) => url.searchParams.set(key, value));
+        return url.toString();
+    }
+
+    // Converts the compact columnar payload (parallel arrays) into location objects
+    function parseColumnarData(data) {
+        orderUrlTemplate = data.order_url_template || null;
+        codePlaceholder = data.code_placeholder || null;
+        return {locations: columnarToLocations(data)};
+    }
+
+    function columnarToLocations(data) {
+        const codes = data.codes || [];
+        const locations = new Array(codes.length);
+        for (let i = 0; i < codes.length; i++) {
+            locations[i] = {lat: data.lat[i], lon: data.lon[i], code: codes[i]};
+        }
+        return locations;
+    }
+
+    function buildOrderUrl(code) {
+        if (!orderUrlTemplate || !codePlaceholder || !code) return null;
+        return orderUrlTemplate.replace(codePlaceholder, encodeURIComponent(code));
+    }
+
+    function buildTooltip(code) {
+        return code ? `<strong>Order:</strong> ${code}` : null;
+    }
+
+
+    // --- Lazy Tooltip Details ---
+    const orderDetailsCache = {};  // code -> tooltip HTML
+    let pendingDetailRequests = {};  // code -> callbacks waiting for its tooltip
+    let detailFlushTimer = null;
+
+    // Collects requests for a short moment, so tooltips opened together share one request
+    function requestOrderDetails(code, callback) {
+        if (orderDetailsCache[code]) {
+            callback(orderDetailsCache[code]);
+            return;
+        }
+        if (!detailsUrl) return;
+        (pendingDetailRequests[code] = pendingDetailRequests[code] || []).push(callback);
+        if (!detailFlushTimer) detailFlushTimer = setTimeout(flushOrderDetailRequests, 50);
+    }
+
+    function flushOrderDetailRequests() {
+        detailFlushTimer = null;
+        const requests = pendingDetailRequests;
+        pendingDetailRequests = {};
+        const codes = Object.keys(requests);
+        if (codes.length === 0) return;
+        const url = new URL(detailsUrl, window.location.origin);
+        url.searchParams.set('codes', codes.join(','));
+        fetch(url.toString())
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                return response.json();
+            })
+            .then(data => {
+                const orders = data.orders || {};
+                codes.forEach(code => {
+                    const details = orders[code];
+                    if (!details || !details.tooltip) return;
+                    orderDetailsCache[code] = details.tooltip;
+                    requests[code].forEach(callback => callback(details.tooltip));
+                });
+            })
+            .catch(error => console.error("Error loading order details:", error));
+    }
+
+
     // --- Data Fetching & Initial Drawing ---
     function fetchDataAndDraw() {
         if (!dataUrl) return;
-        console.log("Fetching coordinates from:", dataUrl);
+        if (isStreamingSupported()) {
+            fetchDataStreaming();
+            return;
+        }
+        const url = buildDataUrl({format: 'columnar'});
+        console.log("Fetching coordinates from:", url);
         updateStatus("Loading ticket locations...");
         if (viewToggleButton) viewToggleButton.disabled = true;
         if (clusterToggleButton) clusterToggleButton.disabled = true;
         disableHeatmapControls(true);
 
-        fetch(dataUrl)
+        fetch(url)
             .then(response => {
                 if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
                 return response.json();
             })
             .then(data => {
                 if (data.error) throw new Error(`API Error: ${data.error}`);
+                syncedAt = data.synced_at || null;
+                if (liveUpdateToggleButton) liveUpdateToggleButton.disabled = !syncedAt;
+                // Servers without the columnar format answer with the full location list
+                if (data.format === 'columnar') data = parseColumnarData(data);
                 if (!data || !data.locations || !Array.isArray(data.locations)) {
                     console.warn("Invalid data format:", data);
                     updateStatus("No valid locations found.", false);
@@ -148,15 +281,18 @@ document.addEventListener('DOMContentLoaded', function () {
                     console.log("No locations received.");
                     updateStatus("No locations found for event.", false);
                     coordinateData = [];
+                    isFullDataLoaded = true;  // Live updates may still add the first locations
                     hideStatus();
                     return;
                 }
 
                 coordinateData = data.locations;
+                isFullDataLoaded = true;
                 console.log(`Received ${coordinateData.length} coordinates.`);
 
                 if (viewToggleButton) viewToggleButton.disabled = false;
-                if (clusterToggleButton) clusterToggleButton.disabled = (currentView !== 'pins');
+                if (clusterToggleButton) clusterToggleButton.disabled = (currentView !== 'pins' || isServerClustering);
+                if (serverClusterToggleButton) serverClusterToggleButton.disabled = !clustersUrl;
                 disableHeatmapControls(false);
 
                 createAllLayers();
@@ -181,6 +317,391 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
 
+    // --- Streamed Data (NDJSON) ---
+    function isStreamingSupported() {
+        return typeof ReadableStream !== 'undefined' && typeof TextDecoder !== 'undefined'
+            && typeof Response !== 'undefined' && 'body' in Response.prototype;
+    }
+
+    // Reads the data view's NDJSON stream line by line and adds the pins of every chunk as soon as it arrives
+    function fetchDataStreaming() {
+        const url = buildDataUrl({format: 'columnar', stream: 'ndjson'});
+        console.log("Streaming coordinates from:", url);
+        updateStatus("Loading ticket locations...");
+        if (viewToggleButton) viewToggleButton.disabled = true;
+        if (clusterToggleButton) clusterToggleButton.disabled = true;
+        disableHeatmapControls(true);
+
+        coordinateData = [];
+        markersByCode = {};
+        if (pinLayer && map.hasLayer(pinLayer)) map.removeLayer(pinLayer);
+        pinLayer = isClusteringEnabled ? L.markerClusterGroup({chunkedLoading: true}) : L.layerGroup();
+        if (currentView === 'pins' && !isServerClustering) map.addLayer(pinLayer);
+        let isComplete = false;
+
+        function handleLine(line) {
+            const record = JSON.parse(line);
+            if (record.error) throw new Error(`API Error: ${record.error}`);
+            if (record.stream) {
+                orderUrlTemplate = record.order_url_template || null;
+                codePlaceholder = record.code_placeholder || null;
+                syncedAt = record.synced_at || null;
+            } else if (record.codes) {
+                addStreamedLocations(columnarToLocations(record));
+            } else if (record.done) {
+                isComplete = true;
+            }
+        }
+
+        fetch(url)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                function pump() {
+                    return reader.read().then(({done, value}) => {
+                        buffer += done ? decoder.decode() : decoder.decode(value, {stream: true});
+                        const lines = buffer.split('\n');
+                        buffer = done ? '' : lines.pop();  // Keep the incomplete last line for the next chunk
+                        lines.forEach(line => {
+                            if (line.trim()) handleLine(line);
+                        });
+                        if (!done) return pump();
+                    });
+                }
+
+                return pump();
+            })
+            .then(() => {
+                if (!isComplete) throw new Error("Incomplete data stream");
+                finishStreaming();
+            })
+            .catch(error => {
+                console.error('Error streaming data:', error);
+                updateStatus(`Error loading map data: ${error.message}.`, true);
+            });
+    }
+
+    function addStreamedLocations(locations) {
+        if (locations.length === 0) return;
+        coordinateData = coordinateData.concat(locations);
+        const markers = [];
+        locations.forEach(loc => {
+            const marker = createOrderMarker(loc);
+            if (!marker) return;
+            markersByCode[loc.code] = marker;
+            markers.push(marker);
+        });
+        if (typeof pinLayer.addLayers === 'function') pinLayer.addLayers(markers);
+        else markers.forEach(marker => pinLayer.addLayer(marker));
+        if (coordinateData.length === locations.length) {
+            // First chunk: show the map right away and center it on the first locations
+            hideStatus();
+            if (currentView === 'pins' && !isServerClustering) adjustMapBounds();
+        }
+        console.log(`Streamed ${coordinateData.length} coordinates so far.`);
+    }
+
+    function finishStreaming() {
+        isFullDataLoaded = true;
+        if (liveUpdateToggleButton) liveUpdateToggleButton.disabled = !syncedAt;
+        if (serverClusterToggleButton) serverClusterToggleButton.disabled = !clustersUrl;
+        if (coordinateData.length === 0) {
+            console.log("No locations received.");
+            if (pinLayer && map.hasLayer(pinLayer)) map.removeLayer(pinLayer);
+            pinLayer = null;  // Live updates may still add the first locations
+            hideStatus();
+            return;
+        }
+        console.log(`Received ${coordinateData.length} coordinates.`);
+        if (viewToggleButton) viewToggleButton.disabled = false;
+        if (clusterToggleButton) clusterToggleButton.disabled = (currentView !== 'pins' || isServerClustering);
+        disableHeatmapControls(false);
+        // The heatmap is drawn once with all points instead of being recomputed per chunk
+        createHeatmapLayer();
+        showCurrentView();
+        adjustMapBounds();
+        hideStatus();
+        if (map) map.invalidateSize();
+    }
+
+
+    // --- Server-side Clusters ---
+    function fetchServerClusters(fitToExtent) {
+        if (!map || !clustersUrl) return;
+        const seq = ++clusterRequestSeq;
+        // Views panned past the antimeridian are moved back around -180..180, the server splits boxes crossing it
+        const bounds = map.wrapLatLngBounds(map.getBounds());
+        const bbox = [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+            .map(v => v.toFixed(5)).join(',');
+        const url = new URL(clustersUrl, window.location.origin);
+        url.searchParams.set('zoom', map.getZoom());
+        url.searchParams.set('bbox', bbox);
+        if (fitToExtent) updateStatus("Loading ticket locations...");
+
+        fetch(url.toString())
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                return response.json();
+            })
+            .then(data => {
+                if (data.error) throw new Error(`API Error: ${data.error}`);
+                if (seq !== clusterRequestSeq) return;  // A newer request is on its way
+                if (viewToggleButton) viewToggleButton.disabled = false;
+                if (serverClusterToggleButton) serverClusterToggleButton.disabled = false;
+                if (clusterToggleButton) clusterToggleButton.disabled = true;
+                if (liveUpdateToggleButton) liveUpdateToggleButton.disabled = false;
+                hideStatus();
+                if (fitToExtent && data.extent) {
+                    // Fitting fires 'moveend', which fetches the clusters for the new view
+                    map.fitBounds([[data.extent.south, data.extent.west], [data.extent.north, data.extent.east]],
+                        {padding: [50, 50]});
+                    return;
+                }
+                createServerClusterLayer(data.clusters || []);
+                if (currentView === 'pins') showCurrentView();
+            })
+            .catch(error => {
+                console.error('Error fetching server clusters:', error);
+                updateStatus(`Error loading map data: ${error.message}.`, true);
+            });
+    }
+
+    function createServerClusterLayer(clusters) {
+        // Draw clusters on the copy of the world in view, which may lie beyond the antimeridian
+        const centerLng = map.getCenter().lng;
+        const markers = clusters.map(cluster => {
+            const lon = cluster.lon + 360 * Math.round((centerLng - cluster.lon) / 360);
+            if (cluster.count === 1) return createOrderMarker({lat: cluster.lat, lon: lon, code: cluster.code});
+            const size = cluster.count < 10 ? 'small' : (cluster.count < 100 ? 'medium' : 'large');
+            const marker = L.marker(L.latLng(cluster.lat, lon), {
+                icon: L.divIcon({
+                    html: `<div><span>${cluster.count}</span></div>`,
+                    className: `marker-cluster marker-cluster-${size}`,
+                    iconSize: L.point(40, 40)
+                })
+            });
+            marker.bindTooltip(`${cluster.count} orders`);
+            marker.on('click', () => map.setView(marker.getLatLng(), Math.min(map.getZoom() + 2, map.getMaxZoom())));
+            return marker;
+        }).filter(m => m !== null);
+        if (serverClusterLayer && map.hasLayer(serverClusterLayer)) map.removeLayer(serverClusterLayer);
+        serverClusterLayer = L.layerGroup(markers);
+        console.log(`Server cluster layer created with ${markers.length} markers.`);
+    }
+
+
+    // --- Statistics Panel ---
+    function fetchStatistics() {
+        if (!statisticsUrl) return;
+        fetch(statisticsUrl)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                return response.json();
+            })
+            .then(data => {
+                if (data.error) throw new Error(`API Error: ${data.error}`);
+                renderStatistics(data);
+            })
+            .catch(error => console.error('Error loading statistics:', error));
+    }
+
+    function renderStatistics(data) {
+        const summary = document.getElementById('statistics-summary');
+        if (summary) summary.textContent = `${data.total} geocoded orders`;
+        const noVenue = document.getElementById('statistics-no-venue');
+        if (noVenue) noVenue.style.display = data.venue ? 'none' : 'block';
+        renderStatisticsTable('statistics-rings', (data.rings || []).map(ring => {
+            return {label: ring.key.endsWith('+') ? `${ring.key.slice(0, -1)} km and more` : `${ring.key} km`, count: ring.count};
+        }), data.total);
+        renderStatisticsTable('statistics-countries', (data.countries || []).map(c => ({label: c.label || c.key, count: c.count})), data.total);
+        renderStatisticsTable('statistics-cities', (data.cities || []).map(c => ({label: c.key, count: c.count})), data.total);
+        renderStatisticsTable('statistics-postcodes', (data.postcodes || []).map(p => ({label: p.key, count: p.count})), data.total);
+    }
+
+    // Rows are built with textContent, city names and postcodes are entered by buyers
+    function renderStatisticsTable(tbodyId, items, total) {
+        const tbody = document.getElementById(tbodyId);
+        if (!tbody) return;
+        tbody.replaceChildren(...items.map(item => {
+            const row = document.createElement('tr');
+            const share = total > 0 ? ` (${Math.round(item.count * 100 / total)}%)` : '';
+            [item.label, `${item.count}${share}`].forEach((text, index) => {
+                const cell = document.createElement('td');
+                cell.textContent = text;
+                if (index === 1) cell.className = 'text-right';
+                row.appendChild(cell);
+            });
+            return row;
+        }));
+    }
+
+
+    // --- Catchment Overlay (Distance Rings Around the Venue) ---
+    function fetchCatchment() {
+        fetch(catchmentUrl)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                return response.json();
+            })
+            .then(data => {
+                if (data.error) throw new Error(`API Error: ${data.error}`);
+                if (!isCatchmentShown) return;  // Hidden while loading
+                drawCatchment(data);
+            })
+            .catch(error => console.error('Error loading distances:', error));
+    }
+
+    function drawCatchment(data) {
+        if (catchmentLayer) map.removeLayer(catchmentLayer);
+        catchmentLayer = null;
+        if (!data.venue) {
+            isCatchmentShown = false;
+            updateCatchmentToggleButtonText();
+            catchmentToggleButton.disabled = true;
+            catchmentToggleButton.title = "Set the event's location in the event settings to see distances.";
+            return;
+        }
+        const center = [data.venue.lat, data.venue.lon];
+        const layers = [L.circleMarker(center, {radius: 6, color: '#c0392b', fillOpacity: 1}).bindTooltip('Venue')];
+        (data.rings || []).forEach(ring => {
+            if (ring.outer_km == null) return;
+            const share = Math.round(ring.share * 1000) / 10;
+            layers.push(L.circle(center, {radius: ring.outer_km * 1000, color: '#2c3e50', weight: 1, fill: false})
+                .bindTooltip(`${ring.within} of ${data.count} orders (${share}%) within ${ring.outer_km} km`, {sticky: true}));
+        });
+        const percentiles = data.percentiles || {};
+        [['p50', 'Half'], ['p90', '90%']].forEach(([key, label]) => {
+            if (percentiles[key] == null) return;
+            layers.push(L.circle(center, {radius: percentiles[key] * 1000, color: '#c0392b', weight: 2, dashArray: '6 6', fill: false})
+                .bindTooltip(`${label} of the orders within ${percentiles[key]} km`, {sticky: true}));
+        });
+        catchmentLayer = L.layerGroup(layers).addTo(map);
+    }
+
+    function setupCatchmentToggleButton() {
+        updateCatchmentToggleButtonText();
+        catchmentToggleButton.addEventListener('click', () => {
+            isCatchmentShown = !isCatchmentShown;
+            updateCatchmentToggleButtonText();
+            if (isCatchmentShown) {
+                fetchCatchment();
+            } else if (catchmentLayer) {
+                map.removeLayer(catchmentLayer);
+                catchmentLayer = null;
+            }
+        });
+    }
+
+
+    // --- Live Updates ---
+    function pollForUpdates() {
+        if (document.hidden) return;  // Catch up on the next poll once the tab is visible again
+        if (isServerClustering && currentView === 'pins') fetchServerClusters(false);
+        if (isFullDataLoaded && syncedAt) fetchDelta();
+        if (densityLayer && currentView === 'heatmap') {
+            densityRevision++;
+            densityLayer.setUrl(buildDensityTileUrl());
+        }
+        fetchStatistics();
+        if (isCatchmentShown) fetchCatchment();
+    }
+
+    function fetchDelta() {
+        const url = buildDataUrl({since: syncedAt});
+        fetch(url)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                return response.json();
+            })
+            .then(data => {
+                if (data.error) throw new Error(`API Error: ${data.error}`);
+                syncedAt = data.synced_at || syncedAt;
+                mergeDelta(data);
+                // Deleted orders are not listed as removed, more locations than the server has means some were
+                if (typeof data.total === 'number' && coordinateData.length > data.total) removeDeletedLocations();
+            })
+            .catch(error => console.error('Error fetching map updates:', error));
+    }
+
+    // Drops locations of orders that no longer exist, compared against all current codes
+    function removeDeletedLocations() {
+        fetch(buildDataUrl({format: 'columnar'}))
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status} ${response.statusText}`);
+                return response.json();
+            })
+            .then(data => {
+                if (data.error) throw new Error(`API Error: ${data.error}`);
+                if (data.format !== 'columnar') return;
+                const current = new Set(data.codes || []);
+                const deleted = coordinateData.map(loc => loc.code).filter(code => !current.has(code));
+                mergeDelta(Object.assign({}, data, {codes: [], lat: [], lon: [], removed: deleted}));
+            })
+            .catch(error => console.error('Error fetching map updates:', error));
+    }
+
+    // Applies new, moved and removed locations to the loaded data and both layers without rebuilding them
+    function mergeDelta(data) {
+        const known = new Map(coordinateData.map(loc => [loc.code, loc]));
+        // Deltas overlap a little with the previous one, skip locations that did not change
+        const changed = parseColumnarData(data).locations.filter(loc => {
+            const previous = known.get(loc.code);
+            return !previous || previous.lat !== loc.lat || previous.lon !== loc.lon;
+        });
+        const removed = (data.removed || []).filter(code => known.has(code));
+        if (changed.length === 0 && removed.length === 0) return;
+        console.log(`Live update: ${changed.length} new/moved, ${removed.length} removed locations.`);
+
+        const outdated = new Set(removed.concat(changed.map(loc => loc.code)));
+        coordinateData = coordinateData.filter(loc => !outdated.has(loc.code)).concat(changed);
+
+        const hadLayers = !!pinLayer && (!!heatmapLayer || !!densityUrl);
+        if (pinLayer) {
+            outdated.forEach(code => {
+                const marker = markersByCode[code];
+                if (!marker) return;
+                pinLayer.removeLayer(marker);
+                delete markersByCode[code];
+            });
+            const markers = [];
+            changed.forEach(loc => {
+                const marker = createOrderMarker(loc);
+                if (!marker) return;
+                markersByCode[loc.code] = marker;
+                markers.push(marker);
+            });
+            if (typeof pinLayer.addLayers === 'function') pinLayer.addLayers(markers);
+            else markers.forEach(marker => pinLayer.addLayer(marker));
+        } else {
+            createPinLayer();
+        }
+        if (heatmapLayer) {
+            heatmapLayer.setLatLngs(buildHeatPoints());
+        } else {
+            createHeatmapLayer();
+        }
+        if (!hadLayers) {
+            if (viewToggleButton) viewToggleButton.disabled = false;
+            disableHeatmapControls(false);
+            if (!(isServerClustering && currentView === 'pins')) showCurrentView();
+        }
+    }
+
+    function startLiveUpdates() {
+        stopLiveUpdates();
+        liveUpdateTimer = setInterval(pollForUpdates, liveUpdateInterval * 1000);
+        pollForUpdates();
+    }
+
+    function stopLiveUpdates() {
+        if (liveUpdateTimer) clearInterval(liveUpdateTimer);
+        liveUpdateTimer = null;
+    }
+
+
     // --- Layer Creation Functions ---
     function createAllLayers() {
         createPinLayer();
@@ -188,9 +709,26 @@ document.addEventListener('DOMContentLoaded', function () {
         console.log("Layers created/updated.");
     }
 
+    function createOrderMarker(loc) {
+        if (loc.lat == null || loc.lon == null || isNaN(loc.lat) || isNaN(loc.lon)) return null;
+        const marker = L.marker(L.latLng(loc.lat, loc.lon));
+        const tooltip = loc.tooltip || buildTooltip(loc.code);
+        const orderUrl = loc.order_url || buildOrderUrl(loc.code);
+        if (tooltip) marker.bindTooltip(tooltip);
+        if (!loc.tooltip && loc.code && detailsUrl) {
+            // Date and item count are only loaded for tooltips actually opened
+            marker.on('tooltipopen', () => requestOrderDetails(loc.code, html => marker.setTooltipContent(html)));
+        }
+        if (orderUrl) {
+            marker.on('click', () => window.open(orderUrl, '_blank'));
+        }
+        return marker;
+    }
+
     function createPinLayer() {
         console.log(`Creating pin layer (Clustering: ${isClusteringEnabled})...`);
         pinLayer = null;
+        markersByCode = {};
         if (coordinateData.length === 0) {
             console.warn("No data for pin layer.");
             return;
@@ -198,13 +736,10 @@ document.addEventListener('DOMContentLoaded', function () {
         const markers = [];
         coordinateData.forEach((loc, index) => {
             try {
-                if (loc.lat == null || loc.lon == null || isNaN(loc.lat) || isNaN(loc.lon)) return;
-                const marker = L.marker(L.latLng(loc.lat, loc.lon));
-                if (loc.tooltip) marker.bindTooltip(loc.tooltip);
-                if (loc.order_url) {
-                    marker.on('click', () => window.open(loc.order_url, '_blank'));
-                }
+                const marker = createOrderMarker(loc);
+                if (!marker) return;
                 markers.push(marker);
+                if (loc.code) markersByCode[loc.code] = marker;
             } catch (e) {
                 console.error(`Error creating marker ${index}:`, e);
             }
@@ -224,19 +759,15 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     function createHeatmapLayer() {
-        console.log("Creating heatmap layer...");
         heatmapLayer = null;
+        if (densityUrl) return;  // Rendered server-side, see getDensityLayer
+        console.log("Creating heatmap layer...");
         if (coordinateData.length === 0) {
             console.warn("No data for heatmap.");
             return;
         }
         try {
-            const heatPoints = coordinateData.map(loc => {
-                if (loc.lat != null && loc.lon != null && !isNaN(loc.lat) && !isNaN(loc.lon)) {
-                    return [loc.lat, loc.lon, 1.0];
-                }
-                return null;
-            }).filter(p => p !== null);
+            const heatPoints = buildHeatPoints();
             if (heatPoints.length > 0) {
                 heatmapLayer = L.heatLayer(heatPoints, heatmapOptions);
                 console.log("Heatmap created:", heatmapOptions);
@@ -249,6 +780,34 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
 
+    // Server-rendered heatmap: image tiles instead of computing the heatmap from every point in the browser
+    function buildDensityTileUrl() {
+        const url = new URL(densityUrl, window.location.origin);
+        url.searchParams.set('radius', heatmapOptions.radius);
+        if (densityRevision) url.searchParams.set('rev', densityRevision);
+        // Leaflet fills in the placeholders per tile, they must not be URL-encoded
+        return `${url.toString()}&zoom={z}&x={x}&y={y}`;
+    }
+
+    function getDensityLayer() {
+        if (!densityLayer) {
+            densityLayer = L.tileLayer(buildDensityTileUrl(), {maxZoom: 18, minZoom: 0});
+            console.log("Density tile layer created.");
+        }
+        return densityLayer;
+    }
+
+
+    function buildHeatPoints() {
+        return coordinateData.map(loc => {
+            if (loc.lat != null && loc.lon != null && !isNaN(loc.lat) && !isNaN(loc.lon)) {
+                return [loc.lat, loc.lon, 1.0];
+            }
+            return null;
+        }).filter(p => p !== null);
+    }
+
+
     // --- Layer Update Functions ---
     function redrawPinLayer() {
         if (!map) return;
@@ -330,18 +889,23 @@ document.addEventListener('DOMContentLoaded', function () {
         viewToggleButton.addEventListener('click', () => {
             console.log("View toggle clicked!");
             currentView = (currentView === 'pins') ? 'heatmap' : 'pins';
-            showCurrentView();
             updateViewToggleButtonText();
-            if (clusterToggleButton) clusterToggleButton.disabled = (currentView !== 'pins');
+            if (clusterToggleButton) clusterToggleButton.disabled = (currentView !== 'pins' || isServerClustering);
+            if (currentView === 'heatmap' && !isFullDataLoaded && !densityUrl) {
+                fetchDataAndDraw();  // The heatmap needs every point, load them on first use
+                return;
+            }
+            if (currentView === 'pins' && isServerClustering) fetchServerClusters(false);
+            showCurrentView();
         });
         console.log("View toggle listener setup.");
     }
 
     function setupClusterToggleButton() {
         updateClusterToggleButtonText();
-        clusterToggleButton.disabled = (currentView !== 'pins');
+        clusterToggleButton.disabled = (currentView !== 'pins' || isServerClustering);
         clusterToggleButton.addEventListener('click', () => {
-            if (currentView !== 'pins') return;
+            if (currentView !== 'pins' || isServerClustering) return;
             console.log("Cluster toggle clicked!");
             isClusteringEnabled = !isClusteringEnabled;
             redrawPinLayer();
@@ -350,6 +914,38 @@ document.addEventListener('DOMContentLoaded', function () {
         console.log("Cluster toggle listener setup.");
     }
 
+    function setupServerClusterToggleButton() {
+        updateServerClusterToggleButtonText();
+        serverClusterToggleButton.disabled = true;  // Enabled once data has been loaded
+        serverClusterToggleButton.addEventListener('click', () => {
+            console.log("Server cluster toggle clicked!");
+            isServerClustering = !isServerClustering;
+            updateServerClusterToggleButtonText();
+            if (clusterToggleButton) clusterToggleButton.disabled = (currentView !== 'pins' || isServerClustering);
+            if (isServerClustering) {
+                fetchServerClusters(false);
+            } else if (!isFullDataLoaded) {
+                fetchDataAndDraw();
+            } else {
+                showCurrentView();
+            }
+        });
+        console.log("Server cluster toggle listener setup.");
+    }
+
+    function setupLiveUpdateToggleButton() {
+        updateLiveUpdateToggleButtonText();
+        liveUpdateToggleButton.disabled = true;  // Enabled once data has been loaded
+        liveUpdateToggleButton.addEventListener('click', () => {
+            console.log("Live update toggle clicked!");
+            isLiveUpdating = !isLiveUpdating;
+            updateLiveUpdateToggleButtonText();
+            if (isLiveUpdating) startLiveUpdates();
+            else stopLiveUpdates();
+        });
+        console.log("Live update toggle listener setup.");
+    }
+
     function setupHeatmapControls() {
         if (!heatmapRadiusInput || !heatmapBlurInput || !heatmapMaxZoomInput || !radiusValueSpan || !blurValueSpan || !maxZoomValueSpan) {
             console.error("Heatmap controls missing.");
@@ -365,7 +961,11 @@ document.addEventListener('DOMContentLoaded', function () {
             const v = parseFloat(e.target.value);
             heatmapOptions.radius = v;
             radiusValueSpan.textContent = v;
-            updateHeatmap();
+            if (!densityUrl) updateHeatmap();
+        });
+        // Density tiles are rendered per radius, load them once the slider is released
+        heatmapRadiusInput.addEventListener('change', () => {
+            if (densityLayer) densityLayer.setUrl(buildDensityTileUrl());
         });
         heatmapBlurInput.addEventListener('input', (e) => {
             const v = parseFloat(e.target.value);
@@ -383,9 +983,10 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     function disableHeatmapControls(disabled) {
-        if (heatmapRadiusInput) heatmapRadiusInput.disabled = disabled;
-        if (heatmapBlurInput) heatmapBlurInput.disabled = disabled;
-        if (heatmapMaxZoomInput) heatmapMaxZoomInput.disabled = disabled;
+        if (heatmapRadiusInput) heatmapRadiusInput.disabled = disabled && !densityUrl;
+        // Blur and max zoom only apply to the heatmap computed in the browser
+        if (heatmapBlurInput) heatmapBlurInput.disabled = disabled || !!densityUrl;
+        if (heatmapMaxZoomInput) heatmapMaxZoomInput.disabled = disabled || !!densityUrl;
     }
 
 
@@ -398,19 +999,22 @@ document.addEventListener('DOMContentLoaded', function () {
         }
         console.log("Removing layers...");
         if (pinLayer && map.hasLayer(pinLayer)) map.removeLayer(pinLayer);
+        if (serverClusterLayer && map.hasLayer(serverClusterLayer)) map.removeLayer(serverClusterLayer);
         if (heatmapLayer && map.hasLayer(heatmapLayer)) map.removeLayer(heatmapLayer);
+        if (densityLayer && map.hasLayer(densityLayer)) map.removeLayer(densityLayer);
         console.log(`Adding ${currentView} layer...`);
         let layerToAdd = null;
         if (currentView === 'pins') {
-            layerToAdd = pinLayer;
+            layerToAdd = isServerClustering ? serverClusterLayer : pinLayer;
             if (heatmapOptionsPanel) heatmapOptionsPanel.style.display = 'none';
             if (clusterToggleButton) {
                 clusterToggleButton.style.display = 'inline-block';
-                clusterToggleButton.disabled = false;
+                clusterToggleButton.disabled = isServerClustering;
             }
         } else {
-            layerToAdd = heatmapLayer;
+            layerToAdd = densityUrl ? getDensityLayer() : heatmapLayer;
             if (heatmapOptionsPanel) heatmapOptionsPanel.style.display = 'block';
+            if (densityUrl) disableHeatmapControls(false);
             if (clusterToggleButton) {
                 clusterToggleButton.style.display = 'none';
                 clusterToggleButton.disabled = true;
@@ -439,6 +1043,22 @@ document.addEventListener('DOMContentLoaded', function () {
         console.log(`View Btn text: ${viewToggleButton.textContent}`);
     }
 
+    function updateServerClusterToggleButtonText() {
+        if (!serverClusterToggleButton) return;
+        serverClusterToggleButton.textContent = isServerClustering
+            ? 'Disable Server-side Clustering' : 'Enable Server-side Clustering';
+    }
+
+    function updateLiveUpdateToggleButtonText() {
+        if (!liveUpdateToggleButton) return;
+        liveUpdateToggleButton.textContent = isLiveUpdating ? 'Disable Live Updates' : 'Enable Live Updates';
+    }
+
+    function updateCatchmentToggleButtonText() {
+        if (!catchmentToggleButton) return;
+        catchmentToggleButton.textContent = isCatchmentShown ? 'Hide Distance Rings' : 'Show Distance Rings';
+    }
+
     function updateClusterToggleButtonText() {
         if (!clusterToggleButton) return;
         clusterToggleButton.textContent = isClusteringEnabled ? 'Disable Clustering' : 'Enable Clustering';
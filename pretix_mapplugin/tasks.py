@@ -1,33 +1,75 @@
 import logging
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.timezone import now
 
 # --- Import django-scopes ---
-from django_scopes import scope
+from django_scopes import scope, scopes_disabled
 
 # --- Use Pretix Celery app instance ---
 from pretix.celery_app import app
 # --- Import necessary Pretix models ---
-from pretix.base.models import Order, Organizer  # Import Organizer
+from pretix.base.models import Event, Order, Organizer  # Import Organizer
 
 # --- Import your Geocode model and geocoding functions ---
-from .models import OrderGeocodeData
+from .aggregates import AGGREGATES_SCHEDULED_CACHE_PREFIX, refresh_event_aggregates
+from .asyncgeocoding import AsyncGeocodingEngine, async_geocoding_enabled
+from .config import get_int_setting
+from .density import DENSITY_PRERENDER_SCHEDULED_CACHE_PREFIX, prerender_density_tiles
+from .metrics import inc, observe, paid_to_geocoded, task_retries
+from .models import OrderGeocodeData, PendingGeocode
 from .geocoding import (
+    GeocodeOutcome,
+    geocode_address_with_status,
+    get_address_components_from_order,
+    format_address,
+    format_cache_address,
     get_formatted_address_from_order,
-    geocode_address,
+    get_shared_geolocator,
     DEFAULT_NOMINATIM_USER_AGENT
 )
+from .geocache import (
+    address_cache_key,
+    geocode_address_cached,
+    get_order_address_hash,
+    lookup_cached_outcomes_many,
+    store_cached_coordinates,
+)
+from .persistence import GeocodeResult, save_geocode_results
+from .ratelimit import get_rate_limiter
 
 logger = logging.getLogger(__name__)
 
+# --- Batch Mode Defaults (override under [pretix_mapplugin] in pretix.cfg) ---
+# batch_size: Orders loaded and written per chunk.
+# batch_delay: Seconds the signal waits before the batch task runs, collecting more paid orders meanwhile.
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_DELAY = 30
+BATCH_SCHEDULED_CACHE_KEY = 'pretix_mapplugin:batch:scheduled'
+BATCH_LOCK_CACHE_KEY = 'pretix_mapplugin:batch:lock'
+BATCH_LOCK_TIMEOUT = 60 * 30
+# Chunks processed per task run before the task re-queues itself, to keep single runs short.
+BATCH_MAX_CHUNKS_PER_RUN = 10
+# Retries of timeouts and service errors (schedule: retry_* settings, see persistence.py)
+RETRY_LOCK_CACHE_KEY = 'pretix_mapplugin:retry:lock'
+
 
 @app.task(bind=True, max_retries=3, default_retry_delay=60, ignore_result=True)
 # --- Accept organizer_pk as kwarg ---
-def geocode_order_task(self, order_pk: int, organizer_pk: int | None = None, nominatim_user_agent: str | None = None):
+def geocode_order_task(self, order_pk: int, organizer_pk: int | None = None, nominatim_user_agent: str | None = None,
+                       refresh: bool = False, paid_at: float | None = None):
     """
     Celery task to geocode the address for a given order PK.
     Accepts organizer_pk and Nominatim User-Agent as arguments.
     Fetches Organizer first, then activates scope.
+    With `refresh`, an order that was geocoded before is geocoded again if
+    its invoice address changed since (see `OrderGeocodeData.address_hash`).
+    `paid_at` (seconds since the epoch) is the time the order was paid, to
+    measure how long orders wait for their coordinates.
     """
     organizer = None
     order = None
@@ -64,39 +106,43 @@ def geocode_order_task(self, order_pk: int, organizer_pk: int | None = None, nom
 
             # --- Rest of the logic runs within scope ---
             relation_name = 'geocode_data'
-            if OrderGeocodeData.objects.filter(order_id=order_pk).exists():
-                logger.info(f"Geocode data already exists for Order {order.code} (checked within scope). Skipping.")
-                return
-
             address_str = get_formatted_address_from_order(order)
+            address_hash = get_order_address_hash(order)
+            stored_hashes = OrderGeocodeData.objects.filter(order_id=order_pk).values_list('address_hash', flat=True)
+            if stored_hashes:
+                if not refresh:
+                    logger.info(f"Geocode data already exists for Order {order.code} (checked within scope). Skipping.")
+                    return
+                if stored_hashes[0] == address_hash:
+                    logger.info(f"Address of Order {order.code} is unchanged. Skipping refresh.")
+                    return
+                logger.info(f"Address of Order {order.code} changed. Geocoding it again.")
+
             if not address_str:
                 logger.info(f"Order {order.code} has no address suitable for geocoding. Storing null coordinates.")
-                with transaction.atomic():
-                    OrderGeocodeData.objects.update_or_create(
-                        order=order, defaults={'latitude': None, 'longitude': None}
-                    )
+                save_geocode_results([GeocodeResult(order.pk, None, None, OrderGeocodeData.STATUS_NO_ADDRESS)],
+                                     event_ids={order.pk: order.event_id})
+                if paid_at:
+                    observe(paid_to_geocoded, time.time() - paid_at, mode='task')
                 return
 
             logger.debug(f"Attempting to geocode address for Order {order.code}: '{address_str}'")
-            coordinates = geocode_address(address_str, nominatim_user_agent=nominatim_user_agent)
-
-            with transaction.atomic():
-                if coordinates:
-                    latitude, longitude = coordinates
-                    obj, created = OrderGeocodeData.objects.update_or_create(
-                        order=order, defaults={'latitude': latitude, 'longitude': longitude}
-                    )
-                    log_level = logging.INFO if created else logging.DEBUG
-                    logger.log(log_level,
-                               f"Saved{' new' if created else ' updated'} geocode data for Order {order.code}: ({latitude}, {longitude})")
-                else:
-                    logger.warning(f"Geocoding failed for Order {order.code}. Storing null coordinates.")
-                    obj, created = OrderGeocodeData.objects.update_or_create(
-                        order=order, defaults={'latitude': None, 'longitude': None}
-                    )
-                    log_level = logging.INFO if created else logging.DEBUG
-                    logger.log(log_level,
-                               f"Saved{' new' if created else ' updated'} null geocode data for Order {order.code} after failed attempt.")
+            # Shared address cache first, the geocoding service only on a miss
+            outcome, from_cache = geocode_address_cached(address_str, nominatim_user_agent=nominatim_user_agent,
+                                                         components=get_address_components_from_order(order))
+            if from_cache:
+                logger.info(f"Used cached geocoding result for Order {order.code}.")
+
+            # Single upsert instead of SELECT + INSERT/UPDATE
+            result = _to_geocode_result(order.pk, outcome, address_hash=address_hash)
+            save_geocode_results([result], event_ids={order.pk: order.event_id})
+            if paid_at:
+                observe(paid_to_geocoded, time.time() - paid_at, mode='task')
+            if outcome.coordinates:
+                logger.info(f"Saved geocode data for Order {order.code}: ({result.latitude}, {result.longitude}), "
+                            f"matched on {outcome.match_level}")
+            else:
+                logger.warning(f"Geocoding failed for Order {order.code} ({outcome.status}). Stored null coordinates.")
         # --- Scope deactivated automatically ---
 
     # --- Outer exception handling ---
@@ -110,4 +156,262 @@ def geocode_order_task(self, order_pk: int, organizer_pk: int | None = None, nom
         order_info = f" (Order PK: {order_pk})" if order_pk else ""
         logger.exception(f"Unexpected error in geocode_order_task{org_info}{order_info}: {e}")
         # Retry on potentially temporary errors
+        inc(task_retries, task_name=self.name)
+        raise self.retry(exc=e)
+
+
+# --- Batch Mode ---
+def schedule_pending_geocoding(nominatim_user_agent: str | None = None):
+    """
+    Debounced trigger for `geocode_pending_orders_task`: only one run is queued
+    per `batch_delay` window, no matter how many orders are paid meanwhile.
+    """
+    delay = get_int_setting('batch_delay', DEFAULT_BATCH_DELAY)
+    if cache.add(BATCH_SCHEDULED_CACHE_KEY, 1, timeout=max(delay * 2, 60)):
+        geocode_pending_orders_task.apply_async(
+            kwargs={'nominatim_user_agent': nominatim_user_agent},
+            countdown=delay,
+        )
+        logger.debug(f"Batch geocoding task scheduled in {delay}s.")
+
+
+def _geocode_orders(orders, geolocator, rate_limiter, engine=None,
+                    attempts_by_pk: dict[int, int] | None = None) -> tuple[list[GeocodeResult], int]:
+    """
+    Geocodes many loaded orders: deduplicates their addresses, resolves cached
+    addresses with a single query and geocodes the remaining unique addresses
+    (concurrently if an `AsyncGeocodingEngine` is given).
+
+    Args:
+        attempts_by_pk: Attempts so far of orders geocoded again, counted up
+            in the results. Other orders count as first attempts.
+
+    Returns:
+        A tuple (results for `save_geocode_results`, geocoding requests sent).
+    """
+    attempts_by_pk = attempts_by_pk or {}
+    results = []
+
+    # --- Group orders by normalized, language-neutral address ---
+    orders_by_key = defaultdict(list)
+    address_by_key = {}
+    components_by_key = {}
+    cache_address_by_key = {}
+    for order in orders:
+        components = get_address_components_from_order(order)
+        address_str = format_address(components) if components else None
+        if not address_str:
+            results.append(GeocodeResult(order.pk, None, None, OrderGeocodeData.STATUS_NO_ADDRESS,
+                                         attempts_by_pk.get(order.pk, 0) + 1))
+            continue
+        cache_address = format_cache_address(components)
+        key = address_cache_key(cache_address)
+        orders_by_key[key].append(order)
+        if key not in address_by_key:
+            address_by_key[key] = address_str
+            components_by_key[key] = components
+            cache_address_by_key[key] = cache_address
+
+    # --- Resolve unique addresses: cache first, geocoding service for the rest ---
+    outcomes_by_key = lookup_cached_outcomes_many(cache_address_by_key.values())
+    misses = {key: (address_str, components_by_key[key])
+              for key, address_str in address_by_key.items() if key not in outcomes_by_key}
+    if engine is not None:
+        geocoded = engine.geocode_many(misses)
+    else:
+        geocoded = {key: geocode_address_with_status(address_str, rate_limiter=rate_limiter, geolocator=geolocator,
+                                                     components=components)
+                    for key, (address_str, components) in misses.items()}
+    for key, outcome in geocoded.items():
+        store_cached_coordinates(cache_address_by_key[key], outcome.coordinates, outcome.status, outcome.match_level)
+        outcomes_by_key[key] = outcome
+
+    for key, key_orders in orders_by_key.items():
+        for order in key_orders:
+            # The cache key is the order's address fingerprint (see get_order_address_hash)
+            results.append(_to_geocode_result(order.pk, outcomes_by_key[key], attempts_by_pk.get(order.pk, 0) + 1,
+                                              address_hash=key))
+    return results, len(misses)
+
+
+def _to_geocode_result(order_pk: int, outcome: GeocodeOutcome, attempts: int = 1,
+                       address_hash: str | None = None) -> GeocodeResult:
+    latitude, longitude = outcome.coordinates if outcome.coordinates else (None, None)
+    return GeocodeResult(order_pk, latitude, longitude, outcome.status, attempts, outcome.match_level, address_hash)
+
+
+def _geocode_pending_chunk(pending_pks: list[int], geolocator, rate_limiter, engine=None,
+                           queued_at: dict | None = None) -> tuple[int, int]:
+    """
+    Geocodes one chunk of queued orders: loads them with a single query,
+    geocodes them with `_geocode_orders` and writes all results at once.
+    `queued_at` maps order PKs to the time they were paid and queued.
+
+    Returns:
+        A tuple (rows written, geocoding requests sent).
+    """
+    existing_pks = set(
+        OrderGeocodeData.objects.filter(order_id__in=pending_pks).values_list('order_id', flat=True)
+    )
+    orders = [
+        order for order in Order.objects.filter(pk__in=pending_pks).select_related('invoice_address')
+        if order.pk not in existing_pks
+    ]
+    results, requests_sent = _geocode_orders(orders, geolocator, rate_limiter, engine)
+
+    # --- Write all results of the chunk at once ---
+    event_ids = {order.pk: order.event_id for order in orders}
+    with transaction.atomic():
+        # overwrite=False: a row may have been created by the command in the meantime
+        written = save_geocode_results(results, event_ids=event_ids, overwrite=False)
+        PendingGeocode.objects.filter(order_id__in=pending_pks).delete()
+    stored_at = now()
+    for order in orders:
+        if queued_at and order.pk in queued_at:
+            observe(paid_to_geocoded, (stored_at - queued_at[order.pk]).total_seconds(), mode='batch')
+    return written, requests_sent
+
+
+def _create_engine(geolocator, rate_limiter):
+    """Returns an `AsyncGeocodingEngine` if async_geocoding is enabled and available, otherwise None."""
+    if not async_geocoding_enabled():
+        return None
+    try:
+        return AsyncGeocodingEngine(geolocator, rate_limiter=rate_limiter)
+    except ImportError as e:
+        logger.error(f"Async geocoding is enabled but not available, geocoding sequentially: {e}")
+        return None
+
+
+@app.task(bind=True, max_retries=3, default_retry_delay=60, ignore_result=True)
+def geocode_pending_orders_task(self, nominatim_user_agent: str | None = None):
+    """
+    Celery task draining the queue of pending orders (see `PendingGeocode`) in
+    chunks of `batch_size`, reusing a single geocoder session for all requests.
+    Runs across all organizers, so scopes are disabled for its queries.
+    """
+    # Allow the next paid order to schedule a follow-up run
+    cache.delete(BATCH_SCHEDULED_CACHE_KEY)
+    if not cache.add(BATCH_LOCK_CACHE_KEY, 1, timeout=BATCH_LOCK_TIMEOUT):
+        logger.info("Batch geocoding task already running. Skipping this run.")
+        return
+
+    batch_size = get_int_setting('batch_size', DEFAULT_BATCH_SIZE)
+    geolocator = get_shared_geolocator(nominatim_user_agent)
+    rate_limiter = get_rate_limiter()
+    # Many requests in flight at once for providers that allow it (async_geocoding=on)
+    engine = _create_engine(geolocator, rate_limiter)
+    try:
+        with scopes_disabled():
+            for _ in range(BATCH_MAX_CHUNKS_PER_RUN):
+                queued_at = dict(
+                    PendingGeocode.objects.order_by('queued_at').values_list('order_id', 'queued_at')[:batch_size]
+                )
+                if not queued_at:
+                    break
+                pending_pks = list(queued_at)
+                written, requests_sent = _geocode_pending_chunk(pending_pks, geolocator, rate_limiter, engine,
+                                                                queued_at=queued_at)
+                logger.info(f"Batch geocoding: {len(pending_pks)} queued orders processed, {written} rows written, "
+                            f"{requests_sent} geocoding requests sent.")
+            else:
+                if PendingGeocode.objects.exists():
+                    # More work left, continue in a fresh run
+                    geocode_pending_orders_task.apply_async(kwargs={'nominatim_user_agent': nominatim_user_agent})
+    except Exception as e:
+        logger.exception(f"Unexpected error in geocode_pending_orders_task: {e}")
+        inc(task_retries, task_name=self.name)
+        raise self.retry(exc=e)
+    finally:
+        cache.delete(BATCH_LOCK_CACHE_KEY)
+
+
+# --- Retries of Transient Failures ---
+@app.task(bind=True, max_retries=3, default_retry_delay=60, ignore_result=True)
+def retry_failed_geocodes_task(self, nominatim_user_agent: str | None = None):
+    """
+    Celery task geocoding orders again whose last attempt timed out or hit a
+    service error, once their `next_retry_at` is due. Each attempt is counted;
+    the next one is scheduled with exponential backoff until `retry_max_attempts`
+    is reached. Orders whose address was not found are never retried.
+    Runs across all organizers, so scopes are disabled for its queries.
+    """
+    if not cache.add(RETRY_LOCK_CACHE_KEY, 1, timeout=BATCH_LOCK_TIMEOUT):
+        logger.info("Geocoding retry task already running. Skipping this run.")
+        return
+
+    batch_size = get_int_setting('batch_size', DEFAULT_BATCH_SIZE)
+    geolocator = get_shared_geolocator(nominatim_user_agent)
+    rate_limiter = get_rate_limiter()
+    engine = _create_engine(geolocator, rate_limiter)
+    try:
+        with scopes_disabled():
+            for _ in range(BATCH_MAX_CHUNKS_PER_RUN):
+                attempts_by_pk = dict(
+                    OrderGeocodeData.objects.filter(next_retry_at__lte=now())
+                    .order_by('next_retry_at').values_list('order_id', 'attempts')[:batch_size]
+                )
+                if not attempts_by_pk:
+                    break
+                orders = list(Order.objects.filter(pk__in=attempts_by_pk).select_related('invoice_address'))
+                results, requests_sent = _geocode_orders(orders, geolocator, rate_limiter, engine, attempts_by_pk)
+                save_geocode_results(results, event_ids={order.pk: order.event_id for order in orders})
+                found = sum(1 for result in results if result.latitude is not None)
+                logger.info(f"Geocoding retries: {len(results)} orders attempted again, {found} found, "
+                            f"{requests_sent} geocoding requests sent.")
+    except Exception as e:
+        logger.exception(f"Unexpected error in retry_failed_geocodes_task: {e}")
+        inc(task_retries, task_name=self.name)
+        raise self.retry(exc=e)
+    finally:
+        cache.delete(RETRY_LOCK_CACHE_KEY)
+
+
+# --- Per-event Aggregates ---
+@app.task(bind=True, max_retries=3, default_retry_delay=60, ignore_result=True)
+def refresh_event_aggregates_task(self, event_id: int):
+    """
+    Celery task rebuilding the country, city, postcode and distance ring
+    counts of one event (see aggregates.py), queued by
+    `schedule_aggregate_refresh` after its geocode data was written.
+    """
+    # Allow the next write to schedule a follow-up run
+    cache.delete(f'{AGGREGATES_SCHEDULED_CACHE_PREFIX}:{event_id}')
+    try:
+        with scopes_disabled():
+            try:
+                event = Event.objects.get(pk=event_id)
+            except ObjectDoesNotExist:
+                logger.error(f"Event with PK {event_id} not found, geo aggregates not rebuilt.")
+                return
+            total = refresh_event_aggregates(event)
+        logger.info(f"Rebuilt geo aggregates of event {event.slug} ({total} geocoded orders).")
+    except Exception as e:
+        logger.exception(f"Unexpected error in refresh_event_aggregates_task (Event PK: {event_id}): {e}")
+        inc(task_retries, task_name=self.name)
+        raise self.retry(exc=e)
+
+
+# --- Density Tiles ---
+@app.task(bind=True, max_retries=3, default_retry_delay=60, ignore_result=True)
+def prerender_density_tiles_task(self, event_id: int):
+    """
+    Celery task rendering the heatmap density tiles of one event whose data
+    changed (see density.py), queued by `schedule_density_prerender` after
+    its geocode data was written.
+    """
+    # Allow the next write to schedule a follow-up run
+    cache.delete(f'{DENSITY_PRERENDER_SCHEDULED_CACHE_PREFIX}:{event_id}')
+    try:
+        with scopes_disabled():
+            try:
+                event = Event.objects.get(pk=event_id)
+            except ObjectDoesNotExist:
+                logger.error(f"Event with PK {event_id} not found, density tiles not rendered.")
+                return
+            rendered = prerender_density_tiles(event)
+        logger.info(f"Pre-rendered {rendered} density tiles of event {event.slug}.")
+    except Exception as e:
+        logger.exception(f"Unexpected error in prerender_density_tiles_task (Event PK: {event_id}): {e}")
+        inc(task_retries, task_name=self.name)
         raise self.retry(exc=e)
@@ -1,6 +1,14 @@
 from django.urls import re_path
 
-from .views import SalesMapDataView, SalesMapView  # Import your views
+from .views import (  # Import your views
+    SalesMapCatchmentView,
+    SalesMapClusterView,
+    SalesMapDataView,
+    SalesMapDensityTileView,
+    SalesMapOrderDetailView,
+    SalesMapStatisticsView,
+    SalesMapView,
+)
 
 # Define the URL patterns for the event settings area
 # These URLs will be prefixed with /control/event/<organizer>/<event>/
@@ -12,6 +20,36 @@ urlpatterns = [
         SalesMapDataView.as_view(),
         name="event.settings.salesmap.data",  # Unique name for URL reversing
     ),
+    # URL for the on-demand tooltip details of individual orders
+    re_path(
+        r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/sales-map/details/',
+        SalesMapOrderDetailView.as_view(),
+        name="event.settings.salesmap.details",
+    ),
+    # URL for clusters aggregated server-side for the visible area and zoom level
+    re_path(
+        r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/sales-map/clusters/',
+        SalesMapClusterView.as_view(),
+        name="event.settings.salesmap.clusters",
+    ),
+    # URL for the per-event statistics (rings around the venue, countries, cities, postcodes)
+    re_path(
+        r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/sales-map/statistics/',
+        SalesMapStatisticsView.as_view(),
+        name="event.settings.salesmap.statistics",
+    ),
+    # URL for heatmap tiles rendered server-side
+    re_path(
+        r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/sales-map/density/',
+        SalesMapDensityTileView.as_view(),
+        name="event.settings.salesmap.density",
+    ),
+    # URL for the distances between buyers and the venue
+    re_path(
+        r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/sales-map/catchment/',
+        SalesMapCatchmentView.as_view(),
+        name="event.settings.salesmap.catchment",
+    ),
     # URL for the HTML page displaying the map
     re_path(
         r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/sales-map/',
@@ -1,15 +1,36 @@
+import json
 import logging
-from django.db.models import Prefetch  # Needed for prefetch_related optimization
-from django.http import HttpResponse, JsonResponse  # Import HttpResponse
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Avg, Count, Max, Min, Q
+from django.db.models.functions import Substr
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse  # Import HttpResponse
 
 # --- CORRECTED IMPORTS ---
 from django.urls import reverse  # Needed to generate URLs
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
 from django.utils.formats import date_format  # For localized date formatting
+from django.utils.http import http_date
+from django.utils.timezone import is_naive, make_aware, now
+from django.utils import translation
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import TemplateView, View
+from django_countries import countries
+from django_scopes import scopes_disabled
 from pretix.base.models import Order  # Make sure Order is imported
 from pretix.control.views.event import EventSettingsViewMixin
 
+from .aggregates import get_event_aggregates, get_venue_location
+from .catchment import DEFAULT_HISTOGRAM_BINS, MAX_HISTOGRAM_BINS, catchment_available, get_event_catchment
+from .config import get_int_setting
+from .density import DENSITY_MAX_ZOOM, density_tiles_available, get_density_tile
+from .geohash import bbox_prefixes, precision_for_cell_width
+from .metrics import data_view_build_duration, data_view_rows, observe
 from .models import OrderGeocodeData
 
 # --- END CORRECTED IMPORTS ---
@@ -23,88 +44,604 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# --- Response Formats of SalesMapDataView ---
+# ?format=columnar: Parallel arrays of order codes and coordinates, tooltips and URLs are built client-side.
+COLUMNAR_FORMAT = 'columnar'
+# Default: List of dicts including tooltip HTML and order URL.
+FULL_FORMAT = 'full'
+# Decimal places kept for coordinates in the columnar format (~1m, about the precision of a float32).
+COORDINATE_PRECISION = 5
+# Stands in for the order code in the order URL template, must match pretix' order code pattern [0-9A-Z]+.
+ORDER_CODE_PLACEHOLDER = 'ORDERCODE'
+# ?stream=ndjson: Newline-delimited JSON written while rows are read, see SalesMapDataView.stream_data.
+NDJSON_STREAM = 'ndjson'
+# Locations per NDJSON line and rows fetched per round trip from the database cursor.
+STREAM_CHUNK_SIZE = 2000
+
+
+# Delta updates (?since=) also return rows up to this many seconds older than requested,
+# as rows are timestamped before their transaction commits. Clients merge idempotently.
+DELTA_OVERLAP_SECONDS = 30
+# Rendered map data is cached per event and data version (override with data_cache_timeout in pretix.cfg).
+MAP_DATA_CACHE_PREFIX = 'pretix_mapplugin:mapdata'
+DEFAULT_MAP_DATA_CACHE_TIMEOUT = 3600
+# Maximum number of orders the detail view answers for in one request.
+MAX_DETAIL_CODES = 100
+
+
+# --- Server-side Clustering ---
+# Grid cells per 256px map tile at the requested zoom level (4 -> cells of ~64px on screen).
+CLUSTER_CELLS_PER_TILE = 4
+# Highest zoom level accepted by the cluster view, matching the tile layer's maxZoom.
+CLUSTER_MAX_ZOOM = 18
+# Above this number of geocoded orders, the map starts in server-side clustering mode
+# (override with server_cluster_threshold under [pretix_mapplugin] in pretix.cfg).
+DEFAULT_SERVER_CLUSTER_THRESHOLD = 10000
+# Countries, cities and postcodes listed by the statistics view, ?limit= may ask for up to MAX_STATISTICS_LIMIT.
+DEFAULT_STATISTICS_LIMIT = 10
+MAX_STATISTICS_LIMIT = 100
+# Seconds between delta requests of the map page's live update mode
+# (override with live_update_interval under [pretix_mapplugin] in pretix.cfg).
+DEFAULT_LIVE_UPDATE_INTERVAL = 30
+
+
+# --- Tooltip Helper ---
+def build_order_tooltip(code: str, order_datetime, position_count: int) -> str:
+    """
+    Builds the HTML tooltip shown for an order's pin: code, date and item count.
+    """
+    tooltip_parts = [f"<strong>Order:</strong> {code}"]
+
+    # Format order date (using Django's localized formatting)
+    try:
+        formatted_date = date_format(order_datetime, format='SHORT_DATETIME_FORMAT', use_l10n=True)
+        tooltip_parts.append(f"<strong>Date:</strong> {formatted_date}")
+    except Exception as e:
+        logger.warning(f"Could not format date for order {code}: {e}")
+        tooltip_parts.append("<strong>Date:</strong> N/A")  # Fallback
+
+    tooltip_parts.append(f"<strong>Items:</strong> {position_count}")
+
+    # Combine tooltip parts with HTML line breaks
+    return "<br>".join(tooltip_parts)
+
 
 # --- SalesMapDataView (Modified to provide more data) ---
 class SalesMapDataView(EventSettingsViewMixin, View):
     permission = 'can_view_orders'
 
+    def get_order_url_template(self) -> str | None:
+        """
+        Returns the URL of the order detail page with ORDER_CODE_PLACEHOLDER in
+        place of the order code, so clients can build order URLs themselves.
+        """
+        try:
+            return reverse('control:event.order', kwargs={
+                'organizer': self.request.organizer.slug,
+                'event': self.request.event.slug,
+                'code': ORDER_CODE_PLACEHOLDER,
+            })
+        except Exception as e:
+            logger.warning(f"Could not reverse order URL template: {e}")
+            return None
+
+    def iter_columnar_chunks(self, rows=None, chunk_size: int | None = None):
+        """
+        Yields (codes, latitudes, longitudes) lists of up to `chunk_size`
+        (default: STREAM_CHUNK_SIZE) locations, read from the database cursor. Only the three needed
+        columns are read, no model instances are built.
+        """
+        chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        if rows is None:
+            rows = OrderGeocodeData.objects.filter(
+                order__event=self.request.event,
+                latitude__isnull=False,
+                longitude__isnull=False
+            )
+        codes, latitudes, longitudes = [], [], []
+        for code, latitude, longitude in rows.values_list('order__code', 'latitude', 'longitude').iterator(
+                chunk_size=chunk_size):
+            codes.append(code)
+            latitudes.append(round(latitude, COORDINATE_PRECISION))
+            longitudes.append(round(longitude, COORDINATE_PRECISION))
+            if len(codes) >= chunk_size:
+                yield codes, latitudes, longitudes
+                codes, latitudes, longitudes = [], [], []
+        if codes:
+            yield codes, latitudes, longitudes
+
+    def get_columnar_data(self, rows=None) -> dict:
+        """
+        Builds the compact columnar payload: parallel arrays of order codes,
+        latitudes and longitudes instead of one dict per location.
+        """
+        codes, latitudes, longitudes = [], [], []
+        for chunk_codes, chunk_latitudes, chunk_longitudes in self.iter_columnar_chunks(rows):
+            codes.extend(chunk_codes)
+            latitudes.extend(chunk_latitudes)
+            longitudes.extend(chunk_longitudes)
+        return {
+            'format': COLUMNAR_FORMAT,
+            'count': len(codes),
+            'codes': codes,
+            'lat': latitudes,
+            'lon': longitudes,
+            'order_url_template': self.get_order_url_template(),
+            'code_placeholder': ORDER_CODE_PLACEHOLDER,
+        }
+
+    def get_delta_data(self, since: datetime) -> dict:
+        """
+        Builds a columnar payload with only the locations geocoded after
+        `since`, plus the codes of orders whose coordinates were removed
+        (re-geocoded without result) in the same period.
+
+        Deleted orders take their geocode data with them and are not listed
+        in `removed`. `total` is the current number of locations instead,
+        clients holding more than that reload the codes to drop them.
+        """
+        synced_at = now()
+        # Rows are timestamped before their transaction commits, look back a little to not miss any
+        changed = OrderGeocodeData.objects.filter(
+            event=self.request.event,
+            last_geocoded_at__gt=since - timedelta(seconds=DELTA_OVERLAP_SECONDS),
+        )
+        data = self.get_columnar_data(changed.filter(latitude__isnull=False, longitude__isnull=False))
+        data['delta'] = True
+        data['removed'] = list(
+            changed.filter(Q(latitude__isnull=True) | Q(longitude__isnull=True)).values_list('order__code', flat=True)
+        )
+        data['total'] = OrderGeocodeData.objects.filter(
+            event=self.request.event, latitude__isnull=False, longitude__isnull=False,
+        ).count()
+        data['synced_at'] = synced_at.isoformat()
+        return data
+
+    @staticmethod
+    def parse_since(value: str) -> datetime:
+        """Parses ?since= as ISO 8601 timestamp or as seconds since the epoch."""
+        try:
+            return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+        except ValueError:
+            pass
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid timestamp: {value}")
+        if is_naive(parsed):
+            parsed = make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+    def get_full_data(self) -> dict:
+        """
+        Builds the full payload: one dict per location including tooltip HTML
+        and order URL.
+        """
+        return {'locations': list(self.iter_full_locations())}
+
+    def iter_full_locations(self):
+        """Yields the locations of the full payload one by one, read from the database cursor."""
+        # Single query reading only the needed columns, positions are counted in SQL
+        geocode_rows = OrderGeocodeData.objects.filter(
+            order__event=self.request.event,
+            latitude__isnull=False,
+            longitude__isnull=False
+        ).values(
+            'order_id', 'latitude', 'longitude', 'order__code', 'order__datetime'
+        ).annotate(
+            # order.positions excludes canceled positions, count the same way
+            position_count=Count('order__all_positions', filter=Q(order__all_positions__canceled=False))
+        ).order_by()
+
+        # 1. Order URLs are built from one reversed template instead of reversing per order
+        order_url_template = self.get_order_url_template()
+
+        # Stream rows from the database cursor, no model instances are built
+        for row in geocode_rows.iterator(chunk_size=STREAM_CHUNK_SIZE):
+            code = row['order__code']
+            order_url = order_url_template.replace(ORDER_CODE_PLACEHOLDER, code) if order_url_template else None
+
+            # 2. Build Tooltip String
+            tooltip_string = build_order_tooltip(code, row['order__datetime'], row['position_count'])
+
+            # 3. Yield data for the list or stream
+            yield {
+                "lat": row['latitude'],
+                "lon": row['longitude'],
+                "tooltip": tooltip_string,  # The enhanced tooltip
+                "order_url": order_url,  # The URL for clicking
+            }
+
+    def stream_data(self, data_format: str, synced_at: str, language: str):
+        """
+        Yields the map data as NDJSON: a header line (format, order URL
+        template, synced_at), one line per chunk of up to STREAM_CHUNK_SIZE
+        locations and a final line {"done": true, "count": N}. Rows are
+        serialized as they are read, so memory stays bounded by one chunk and
+        the first locations reach the client right away. Errors while
+        streaming end the stream with an {"error": ...} line instead.
+        """
+        started = time.perf_counter()
+        header = {'format': data_format, 'stream': NDJSON_STREAM, 'synced_at': synced_at}
+        if data_format == COLUMNAR_FORMAT:
+            header['order_url_template'] = self.get_order_url_template()
+            header['code_placeholder'] = ORDER_CODE_PLACEHOLDER
+        yield json.dumps(header) + '\n'
+
+        count = 0
+        try:
+            # The body is iterated after the view returned, outside the request's scope and language
+            with scopes_disabled(), translation.override(language or None):
+                if data_format == COLUMNAR_FORMAT:
+                    for codes, latitudes, longitudes in self.iter_columnar_chunks():
+                        count += len(codes)
+                        yield json.dumps({'codes': codes, 'lat': latitudes, 'lon': longitudes}) + '\n'
+                else:
+                    locations = []
+                    for location in self.iter_full_locations():
+                        locations.append(location)
+                        if len(locations) >= STREAM_CHUNK_SIZE:
+                            count += len(locations)
+                            yield json.dumps({'locations': locations}, cls=DjangoJSONEncoder) + '\n'
+                            locations = []
+                    if locations:
+                        count += len(locations)
+                        yield json.dumps({'locations': locations}, cls=DjangoJSONEncoder) + '\n'
+        except Exception as e:
+            logger.exception(f"Error streaming geocode data for event {self.request.event.slug}: {e}")
+            yield json.dumps({'error': str(_('Could not retrieve coordinate data due to a server error.'))}) + '\n'
+            return
+        yield json.dumps({'done': True, 'count': count}) + '\n'
+        observe(data_view_build_duration, time.perf_counter() - started, format=f'{data_format}_{NDJSON_STREAM}')
+        observe(data_view_rows, count, format=f'{data_format}_{NDJSON_STREAM}')
+
+    def get_data_version(self) -> tuple[int, datetime | None]:
+        """
+        Returns (row count, latest last_geocoded_at) of the event's geocode
+        data. Any write to the event's rows changes it, so it identifies the
+        current state of the data for ETags and the response cache.
+        """
+        version = OrderGeocodeData.objects.filter(event=self.request.event).aggregate(
+            count=Count('order_id'), last=Max('last_geocoded_at'),
+        )
+        return version['count'], version['last']
+
+    def get_orders_version(self) -> datetime | None:
+        """
+        Returns the latest last_modified of the event's orders. Tooltips of the
+        full format show the number of items, which changes with the order
+        rather than with its geocode data.
+        """
+        return Order.objects.filter(event=self.request.event).aggregate(last=Max('last_modified'))['last']
+
     def get(self, request, *args, **kwargs):
         event = self.request.event
-        organizer = request.organizer  # Get organizer for URL generation
+        data_format = COLUMNAR_FORMAT if request.GET.get('format') == COLUMNAR_FORMAT else FULL_FORMAT
+        stream = request.GET.get('stream') == NDJSON_STREAM
 
-        locations_data = []  # Initialize list to hold data for JSON
+        # --- Delta updates for live polling: always columnar, never cached ---
+        if 'since' in request.GET:
+            try:
+                since = self.parse_since(request.GET['since'])
+            except (ValueError, OverflowError):
+                return JsonResponse({'error': _('Invalid timestamp.')}, status=400)
+            try:
+                started = time.perf_counter()
+                data = self.get_delta_data(since)
+                observe(data_view_build_duration, time.perf_counter() - started, format='delta')
+                observe(data_view_rows, data['count'], format='delta')
+                response = JsonResponse(data)
+                response['Cache-Control'] = 'no-store'
+                return response
+            except Exception as e:
+                logger.exception(f"Error retrieving geocode data changes for event {event.slug}: {e}")
+                return JsonResponse({'error': _('Could not retrieve coordinate data due to a server error.')},
+                                    status=500)
 
         try:
-            # Fetch geocode entries, prefetch related order and its positions
-            geocode_entries = OrderGeocodeData.objects.filter(
-                order__event=event,
-                latitude__isnull=False,
-                longitude__isnull=False
-            ).select_related(
-                'order'  # Select the direct foreign key
-            ).prefetch_related(
-                Prefetch('order__positions')  # Use Prefetch for better control if needed, or just 'order__positions'
-            )
+            # --- Conditional request: answer 304 if the browser's copy is still current ---
+            count, last_geocoded_at = self.get_data_version()
+            last_modified = int(last_geocoded_at.timestamp()) if last_geocoded_at else None
+            # Tooltips of the full format contain localized dates
+            language = request.LANGUAGE_CODE if data_format == FULL_FORMAT else ''
+            version = f"{count}-{last_geocoded_at.timestamp() if last_geocoded_at else 0}"
+            if data_format == FULL_FORMAT:
+                # ... and item counts, which change with the orders
+                orders_modified_at = self.get_orders_version()
+                if orders_modified_at:
+                    version += f"-{orders_modified_at.timestamp()}"
+                    last_modified = max(last_modified or 0, int(orders_modified_at.timestamp()))
+            variant = f'{data_format}{language}-{NDJSON_STREAM}' if stream else f'{data_format}{language}'
+            etag = f'"{event.pk}-{variant}-{version}"'
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None and stream:
+                # --- Streamed, never held in memory as a whole and therefore not cached ---
+                synced_at = (last_geocoded_at or now()).isoformat()
+                response = StreamingHttpResponse(self.stream_data(data_format, synced_at, language),
+                                                 content_type='application/x-ndjson')
+                response['X-Accel-Buffering'] = 'no'  # Let nginx pass chunks on as they are written
+            elif response is None:
+                # --- Response cache, keyed by the data version so writes invalidate it ---
+                cache_key = f"{MAP_DATA_CACHE_PREFIX}:{event.pk}:{data_format}:{language}:{version}"
+                content = cache.get(cache_key)
+                if content is None:
+                    started = time.perf_counter()
+                    data = self.get_columnar_data() if data_format == COLUMNAR_FORMAT else self.get_full_data()
+                    observe(data_view_build_duration, time.perf_counter() - started, format=data_format)
+                    observe(data_view_rows, data['count'] if data_format == COLUMNAR_FORMAT else len(data['locations']),
+                            format=data_format)
+                    # Starting point for delta updates (?since=) of clients loading this data
+                    data['synced_at'] = (last_geocoded_at or now()).isoformat()
+                    content = json.dumps(data, cls=DjangoJSONEncoder)
+                    cache.set(cache_key, content, get_int_setting('data_cache_timeout', DEFAULT_MAP_DATA_CACHE_TIMEOUT))
+                    logger.debug(f"Built {data_format} map data for event {event.slug} ({count} rows)")
+                else:
+                    logger.debug(f"Serving cached {data_format} map data for event {event.slug}")
+                response = HttpResponse(content, content_type='application/json')
+
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # Browsers must revalidate, which is cheap thanks to the ETag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
 
-            for entry in geocode_entries:
-                order = entry.order
-                order_url = None
-                tooltip_parts = []
-
-                # 1. Generate Order URL
-                try:
-                    # Use the standard name for the control panel order detail view
-                    # Ensure 'control:event.order' is the correct name in your Pretix version
-                    order_url = reverse('control:event.order', kwargs={
-                        'organizer': organizer.slug,
-                        'event': event.slug,
-                        'code': order.code,
-                    })
-                except Exception as e:
-                    logger.warning(f"Could not reverse URL for order {order.code}: {e}")
-
-                # 2. Build Tooltip String
-                tooltip_parts.append(f"<strong>Order:</strong> {order.code}")
-
-                # Format order date (using Django's localized formatting)
-                try:
-                    formatted_date = date_format(order.datetime, format='SHORT_DATETIME_FORMAT', use_l10n=True)
-                    tooltip_parts.append(f"<strong>Date:</strong> {formatted_date}")
-                except Exception as e:
-                    logger.warning(f"Could not format date for order {order.code}: {e}")
-                    tooltip_parts.append("<strong>Date:</strong> N/A")  # Fallback
-
-                # Count positions (tickets/items) - efficient due to prefetch_related
-                position_count = order.positions.count()  # count() is efficient on prefetched QuerySets
-                tooltip_parts.append(f"<strong>Items:</strong> {position_count}")
-
-                # Combine tooltip parts with HTML line breaks
-                tooltip_string = "<br>".join(tooltip_parts)
-
-                # 3. Append data to the list
-                locations_data.append({
-                    "lat": entry.latitude,
-                    "lon": entry.longitude,
-                    "tooltip": tooltip_string,  # The enhanced tooltip
-                    "order_url": order_url,  # The URL for clicking
-                })
-
-            logger.debug(f"Returning {len(locations_data)} enriched coordinates for event {event.slug}")
-            return JsonResponse({'locations': locations_data})
-
-        except OrderGeocodeData.DoesNotExist:
-            logger.info(f"No geocode data found for event {event.slug}")
-            return JsonResponse({'locations': []})
         except Exception as e:
             logger.exception(f"Error retrieving or processing geocode data for event {event.slug}: {e}")
             # Provide a more generic error in production
             return JsonResponse({'error': _('Could not retrieve coordinate data due to a server error.')}, status=500)
 
 
+# --- SalesMapOrderDetailView (Tooltips loaded on demand) ---
+class SalesMapOrderDetailView(EventSettingsViewMixin, View):
+    """
+    Returns tooltip details for a few orders (?codes=CODE1,CODE2), requested by
+    the map when a tooltip opens instead of precomputing them for every pin.
+    """
+    permission = 'can_view_orders'
+
+    def get(self, request, *args, **kwargs):
+        event = self.request.event
+        codes = [c.strip().upper() for c in request.GET.get('codes', '').split(',') if c.strip()]
+        if not codes:
+            return JsonResponse({'error': _('No order codes given.')}, status=400)
+        if len(codes) > MAX_DETAIL_CODES:
+            return JsonResponse({'error': _('Too many order codes requested.')}, status=400)
+
+        try:
+            orders = Order.objects.filter(
+                event=event,
+                code__in=codes,
+            ).annotate(
+                # order.positions excludes canceled positions, count the same way
+                position_count=Count('all_positions', filter=Q(all_positions__canceled=False))
+            ).values_list('code', 'datetime', 'position_count')
+
+            details = {}
+            for code, order_datetime, position_count in orders:
+                details[code] = {
+                    'tooltip': build_order_tooltip(code, order_datetime, position_count),
+                    'date': order_datetime.isoformat(),
+                    'items': position_count,
+                }
+            return JsonResponse({'orders': details})
+        except Exception as e:
+            logger.exception(f"Error retrieving order details for event {event.slug}: {e}")
+            return JsonResponse({'error': _('Could not retrieve order details due to a server error.')}, status=500)
+
+
+# --- SalesMapClusterView (Pre-aggregated clusters for the visible area) ---
+class SalesMapClusterView(EventSettingsViewMixin, View):
+    """
+    Returns the geocoded orders inside a bounding box, aggregated into geohash
+    cells sized for the given zoom level (?zoom=Z&bbox=west,south,east,north).
+    Each cluster carries its order count and centroid, so the payload size
+    depends on the screen size instead of the number of orders.
+    """
+    permission = 'can_view_orders'
+
+    @staticmethod
+    def parse_bbox(value: str) -> list[tuple[float, float, float, float]]:
+        """
+        Parses ?bbox=west,south,east,north into boxes within -180..180.
+        Maps panned across the antimeridian send longitudes beyond it
+        (e.g. 170,...,190), such a box is split in two at the antimeridian.
+        """
+        west, south, east, north = (float(v) for v in value.split(','))
+        south, north = max(-90.0, south), min(90.0, north)
+        if west > east or south > north or not all(map(math.isfinite, (west, east))):
+            raise ValueError("Empty bounding box")
+        if east - west >= 360.0:
+            return [(-180.0, south, 180.0, north)]
+        shift = math.floor((west + 180.0) / 360.0) * 360.0
+        west, east = west - shift, east - shift
+        if east <= 180.0:
+            return [(west, south, east, north)]
+        return [(west, south, 180.0, north), (-180.0, south, east - 360.0, north)]
+
+    def get(self, request, *args, **kwargs):
+        event = self.request.event
+        try:
+            zoom = min(max(int(request.GET.get('zoom', 0)), 0), CLUSTER_MAX_ZOOM)
+            boxes = self.parse_bbox(request.GET.get('bbox', '-180,-90,180,90'))
+        except (TypeError, ValueError):
+            return JsonResponse({'error': _('Invalid zoom level or bounding box.')}, status=400)
+
+        # Cells are geohash prefixes sized for ~64px on screen at this zoom level
+        precision = precision_for_cell_width(360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE)
+
+        try:
+            geocoded = OrderGeocodeData.objects.filter(
+                event=event,
+                geohash__isnull=False,
+            )
+            extent = geocoded.aggregate(
+                south=Min('latitude'), north=Max('latitude'), west=Min('longitude'), east=Max('longitude'),
+            )
+
+            # Range scans on the (event, geohash) index, refined by the exact bounding boxes
+            box_filter = Q()
+            for west, south, east, north in boxes:
+                prefix_filter = Q()
+                for prefix in bbox_prefixes(west, south, east, north):
+                    prefix_filter |= Q(geohash__startswith=prefix)
+                box_filter |= prefix_filter & Q(
+                    latitude__gte=south, latitude__lte=north,
+                    longitude__gte=west, longitude__lte=east,
+                )
+            cells = geocoded.filter(box_filter).annotate(
+                cell=Substr('geohash', 1, precision),
+            ).values('cell').annotate(
+                count=Count('order_id'),
+                lat=Avg('latitude'),
+                lon=Avg('longitude'),
+                code=Min('order__code'),  # Only meaningful for single-order cells
+            ).order_by()
+
+            clusters = []
+            total = 0
+            for cell in cells:
+                cluster = {
+                    'lat': round(cell['lat'], COORDINATE_PRECISION),
+                    'lon': round(cell['lon'], COORDINATE_PRECISION),
+                    'count': cell['count'],
+                }
+                if cell['count'] == 1:
+                    cluster['code'] = cell['code']
+                clusters.append(cluster)
+                total += cell['count']
+
+            return JsonResponse({
+                'zoom': zoom,
+                'total': total,
+                'clusters': clusters,
+                'extent': extent if extent['south'] is not None else None,
+            })
+        except Exception as e:
+            logger.exception(f"Error aggregating clusters for event {event.slug}: {e}")
+            return JsonResponse({'error': _('Could not retrieve coordinate data due to a server error.')}, status=500)
+
+
+# --- SalesMapStatisticsView (Materialized per-event aggregates) ---
+class SalesMapStatisticsView(EventSettingsViewMixin, View):
+    """
+    Returns the number of geocoded orders per distance ring around the venue
+    and the largest countries, cities and postcodes (?limit=N), read from the
+    aggregates materialized by `refresh_event_aggregates_task`.
+    """
+    permission = 'can_view_orders'
+
+    def get(self, request, *args, **kwargs):
+        event = self.request.event
+        try:
+            limit = min(max(int(request.GET.get('limit', DEFAULT_STATISTICS_LIMIT)), 1), MAX_STATISTICS_LIMIT)
+        except ValueError:
+            return JsonResponse({'error': _('Invalid limit.')}, status=400)
+
+        try:
+            data = get_event_aggregates(event, limit)
+            for country in data['countries']:
+                country['label'] = str(countries.name(country['key']) or country['key'])
+            venue = get_venue_location(event)
+            data['venue'] = {'lat': venue[0], 'lon': venue[1]} if venue else None
+            response = JsonResponse(data)
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        except Exception as e:
+            logger.exception(f"Error retrieving geo statistics for event {event.slug}: {e}")
+            return JsonResponse({'error': _('Could not retrieve statistics due to a server error.')}, status=500)
+
+
+# --- SalesMapDensityTileView (Heatmap rendered server-side) ---
+class SalesMapDensityTileView(EventSettingsViewMixin, View):
+    """
+    Returns one heatmap tile of the event as PNG (?zoom=Z&x=X&y=Y, optionally
+    &radius=R in pixels), so the browser draws image tiles instead of
+    computing the heatmap from every point. Requires NumPy on the server.
+    """
+    permission = 'can_view_orders'
+
+    def get(self, request, *args, **kwargs):
+        event = self.request.event
+        if not density_tiles_available():
+            return JsonResponse({'error': _('Density tiles require NumPy on the server.')}, status=501)
+        try:
+            zoom = int(request.GET['zoom'])
+            x, y = int(request.GET['x']), int(request.GET['y'])
+            radius = int(request.GET['radius']) if request.GET.get('radius') else None
+            if not 0 <= zoom <= DENSITY_MAX_ZOOM or not 0 <= x < 2 ** zoom or not 0 <= y < 2 ** zoom:
+                raise ValueError("Tile out of range")
+        except (KeyError, ValueError):
+            return JsonResponse({'error': _('Invalid tile.')}, status=400)
+
+        try:
+            content, version = get_density_tile(event, zoom, x, y, radius)
+            etag = f'"{event.pk}-density-{zoom}-{x}-{y}-{version}"'
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(content, content_type='image/png')
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        except Exception as e:
+            logger.exception(f"Error rendering density tile {zoom}/{x}/{y} for event {event.slug}: {e}")
+            return JsonResponse({'error': _('Could not render the density tile due to a server error.')}, status=500)
+
+
+# --- SalesMapCatchmentView (Distances between buyers and the venue) ---
+class SalesMapCatchmentView(EventSettingsViewMixin, View):
+    """
+    Returns how far buyers travel: distance percentiles, orders per distance
+    ring and a histogram (?bins=N). Distances are measured from the event's
+    location, or from ?lat=&lon= if given. Requires NumPy on the server.
+    """
+    permission = 'can_view_orders'
+
+    def get(self, request, *args, **kwargs):
+        event = self.request.event
+        if not catchment_available():
+            return JsonResponse({'error': _('The catchment analysis requires NumPy on the server.')}, status=501)
+        try:
+            bins = min(max(int(request.GET.get('bins', DEFAULT_HISTOGRAM_BINS)), 1), MAX_HISTOGRAM_BINS)
+            venue = get_venue_location(event)
+            if request.GET.get('lat') or request.GET.get('lon'):
+                venue = float(request.GET['lat']), float(request.GET['lon'])
+                if not -90 <= venue[0] <= 90 or not -180 <= venue[1] <= 180:
+                    raise ValueError("Location out of range")
+        except (KeyError, ValueError):
+            return JsonResponse({'error': _('Invalid location or number of bins.')}, status=400)
+        if venue is None:
+            # Nothing to measure from, the map explains how to set the event's location
+            return JsonResponse({'venue': None, 'count': 0})
+
+        try:
+            response = JsonResponse(get_event_catchment(event, venue, bins))
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        except Exception as e:
+            logger.exception(f"Error computing the catchment of event {event.slug}: {e}")
+            return JsonResponse({'error': _('Could not compute distances due to a server error.')}, status=500)
+
+
 class SalesMapView(EventSettingsViewMixin, TemplateView):
     permission = 'can_view_orders'
     template_name = 'pretix_mapplugin/map_page.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Lets the map decide whether to load all points or start with server-side clusters
+        context['geocoded_count'] = OrderGeocodeData.objects.filter(
+            event=self.request.event,
+            geohash__isnull=False,
+        ).count()
+        context['server_cluster_threshold'] = get_int_setting('server_cluster_threshold',
+                                                              DEFAULT_SERVER_CLUSTER_THRESHOLD)
+        context['live_update_interval'] = get_int_setting('live_update_interval', DEFAULT_LIVE_UPDATE_INTERVAL)
+        # Without NumPy, the heatmap is computed in the browser from all points
+        context['density_tiles_available'] = density_tiles_available()
+        context['catchment_available'] = catchment_available()
+        return context
+
     def get(self, request, *args, **kwargs):
         try:
             response = super().get(request, *args, **kwargs)
@@ -135,6 +672,7 @@ class SalesMapView(EventSettingsViewMixin, TemplateView):
         map_csp_additions = {
             'img-src': [
                 'https://*.tile.openstreetmap.org',
+                "'self'",  # Density tiles of the heatmap
             ],
             'style-src': [
                 "'unsafe-inline'",  # Allow inline styles needed by Leaflet/plugins
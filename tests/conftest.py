@@ -1 +1,92 @@
 # put your pytest fixtures here
+import configparser
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, InvoiceAddress, Order, Organizer, Team, User
+
+from pretix_mapplugin.config import PLUGIN_CONFIG_SECTION
+from pretix_mapplugin.geocoding import reset_shared_geolocators
+from pretix_mapplugin.models import OrderGeocodeData
+
+
+@pytest.fixture
+def plugin_config(settings):
+    """Sets options under [pretix_mapplugin] in pretix.cfg for the duration of a test."""
+    config = configparser.RawConfigParser()
+    config.add_section(PLUGIN_CONFIG_SECTION)
+    settings.CONFIG_FILE = config
+
+    def _set(**options):
+        for option, value in options.items():
+            config.set(PLUGIN_CONFIG_SECTION, option, str(value))
+        reset_shared_geolocators()
+
+    yield _set
+    reset_shared_geolocators()
+
+
+@pytest.fixture
+@scopes_disabled()
+def organizer():
+    return Organizer.objects.create(name='Dummy', slug='dummy')
+
+
+@pytest.fixture
+@scopes_disabled()
+def event(organizer):
+    return Event.objects.create(
+        organizer=organizer, name='Dummy', slug='dummy',
+        date_from=now() + timedelta(days=30),
+        plugins='pretix_mapplugin',
+    )
+
+
+@pytest.fixture
+def make_order(event):
+    """Factory for paid orders with an invoice address."""
+    counter = {'n': 0}
+
+    @scopes_disabled()
+    def _make_order(street='Heidelberger Str. 1', zipcode='10115', city='Berlin', country='DE',
+                    status=Order.STATUS_PAID):
+        counter['n'] += 1
+        order = Order.objects.create(
+            code=f'ORD{counter["n"]:04d}', event=event, email='dummy@example.org',
+            status=status, datetime=now(), expires=now() + timedelta(days=10),
+            total=Decimal('23.00'), sales_channel=event.organizer.sales_channels.get(identifier='web'),
+        )
+        InvoiceAddress.objects.create(order=order, street=street, zipcode=zipcode, city=city, country=country)
+        return order
+
+    return _make_order
+
+
+@pytest.fixture
+def geocoded_order(make_order):
+    """Factory for paid orders that already have coordinates."""
+    @scopes_disabled()
+    def _geocoded_order(latitude=52.53, longitude=13.38, **kwargs):
+        order = make_order(**kwargs)
+        OrderGeocodeData.objects.create(order=order, latitude=latitude, longitude=longitude)
+        return order
+
+    return _geocoded_order
+
+
+@pytest.fixture
+@scopes_disabled()
+def user(organizer):
+    user = User.objects.create_user('dummy@dummy.dummy', 'dummy')
+    team = Team.objects.create(organizer=organizer, all_events=True, all_event_permissions=True)
+    team.members.add(user)
+    return user
+
+
+@pytest.fixture
+def logged_in_client(client, user):
+    client.login(email='dummy@dummy.dummy', password='dummy')
+    return client
@@ -0,0 +1,117 @@
+from unittest import mock
+
+import pytest
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin import aggregates
+from pretix_mapplugin.aggregates import get_event_aggregates, get_ring_key, haversine_km, refresh_event_aggregates
+from pretix_mapplugin.models import EventGeoAggregate
+from pretix_mapplugin.persistence import save_geocode_results
+
+
+def test_ring_keys():
+    edges = [10.0, 25.0, 50.0]
+    assert get_ring_key(0.0, edges) == '0-10'
+    assert get_ring_key(10.0, edges) == '10-25'
+    assert get_ring_key(49.9, edges) == '25-50'
+    assert get_ring_key(800.0, edges) == '50+'
+    assert haversine_km(52.52, 13.405, 48.137, 11.575) == pytest.approx(504, abs=1)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_refresh_event_aggregates(event, geocoded_order, make_order):
+    event.geo_lat, event.geo_lon = 52.52, 13.405  # Berlin
+    event.save()
+    geocoded_order(latitude=52.53, longitude=13.38, zipcode='10115', city='Berlin')
+    geocoded_order(latitude=52.50, longitude=13.42, zipcode='10 115', city=' berlin')
+    geocoded_order(latitude=48.137, longitude=11.575, zipcode='80331', city='München')
+    geocoded_order(latitude=48.2, longitude=16.37, zipcode='1010', city='Wien', country='AT')
+    make_order()  # Not geocoded
+
+    assert refresh_event_aggregates(event) == 4
+    counts = {(row.dimension, row.key): row.count for row in EventGeoAggregate.objects.filter(event=event)}
+    assert counts[('total', '52.52,13.405 10,25,50,100,250,500')] == 4
+    assert counts[('country', 'DE')] == 3
+    assert counts[('city', 'Berlin (DE)')] == 2
+    assert counts[('postcode', 'DE 10115')] == 2
+    assert counts[('postcode', 'AT 1010')] == 1
+    assert counts[('ring', '0-10')] == 2
+    assert counts[('ring', '500+')] == 2
+
+    data = get_event_aggregates(event, limit=1)
+    assert data['total'] == 4
+    assert data['countries'] == [{'key': 'DE', 'count': 3}]
+    assert [ring['key'] for ring in data['rings']] == ['0-10', '500+']
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_aggregates_rebuilt_after_writes(event, make_order, django_capture_on_commit_callbacks):
+    orders = [make_order() for _ in range(3)]
+    with django_capture_on_commit_callbacks(execute=True):
+        save_geocode_results([(order.pk, 52.53, 13.38) for order in orders[:2]] + [(orders[2].pk, None, None)])
+    assert EventGeoAggregate.objects.get(event=event, dimension='total').count == 2
+    assert not EventGeoAggregate.objects.filter(event=event, dimension='ring').exists()  # No venue location
+
+    with django_capture_on_commit_callbacks(execute=True):
+        save_geocode_results([(orders[2].pk, 48.137, 11.575)])
+    assert EventGeoAggregate.objects.get(event=event, dimension='total').count == 3
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_overlapping_rebuilds(event, geocoded_order):
+    geocoded_order(latitude=52.53, longitude=13.38)
+    assert refresh_event_aggregates(event) == 1
+    # A rebuild finishing while the statistics view waited for the lock is kept
+    with mock.patch('pretix_mapplugin.aggregates.compute_event_aggregates') as compute:
+        assert refresh_event_aggregates(event, if_outdated=True) == 1
+    assert not compute.called
+
+    # Rebuilds overlapping each other replace the rows instead of duplicating keys
+    geocoded_order(latitude=48.137, longitude=11.575)
+    real_compute = aggregates.compute_event_aggregates
+
+    def compute_with_overlap(event):
+        counts = real_compute(event)
+        if not compute.overlapped:
+            compute.overlapped = True
+            refresh_event_aggregates(event)
+        return counts
+
+    with mock.patch('pretix_mapplugin.aggregates.compute_event_aggregates', side_effect=compute_with_overlap) as compute:
+        compute.overlapped = False
+        assert refresh_event_aggregates(event) == 2
+    assert EventGeoAggregate.objects.filter(event=event, dimension='total').count() == 1
+    assert get_event_aggregates(event, limit=5)['total'] == 2
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_aggregates_rebuilt_after_venue_changes(event, geocoded_order, plugin_config):
+    geocoded_order(latitude=52.53, longitude=13.38)
+    assert get_event_aggregates(event, limit=5)['rings'] == []
+
+    event.geo_lat, event.geo_lon = 52.52, 13.405
+    event.save()
+    assert get_event_aggregates(event, limit=5)['rings'] == [{'key': '0-10', 'count': 1}]
+    event.geo_lat, event.geo_lon = 48.137, 11.575
+    event.save()
+    assert get_event_aggregates(event, limit=5)['rings'] == [{'key': '500+', 'count': 1}]
+
+    plugin_config(distance_rings='1000')
+    assert get_event_aggregates(event, limit=5)['rings'] == [{'key': '0-1000', 'count': 1}]
+    assert EventGeoAggregate.objects.filter(event=event, dimension='total').count() == 1
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_long_keys_are_merged(event, geocoded_order):
+    prefix = 'Llanfair' * 30  # 240 characters, longer than EventGeoAggregate.key
+    geocoded_order(city=f'{prefix} North')
+    geocoded_order(city=f'{prefix} South')
+
+    assert refresh_event_aggregates(event) == 2
+    cities = EventGeoAggregate.objects.filter(event=event, dimension='city')
+    assert [(len(city.key), city.key[-5:], city.count) for city in cities] == [(190, ' (DE)', 2)]
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+from django.core.cache.backends.locmem import LocMemCache
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin.asyncgeocoding import AsyncGeocodingEngine
+from pretix_mapplugin.backends import GeocoderBackend
+from pretix_mapplugin.geocoding import get_geolocator
+from pretix_mapplugin.models import OrderGeocodeData, PendingGeocode
+from pretix_mapplugin.ratelimit import RateLimiter
+from pretix_mapplugin.tasks import geocode_pending_orders_task
+
+
+@pytest.fixture
+def fake_nominatim():
+    """Local stand-in for a self-hosted Nominatim, recording how many requests were in flight at once."""
+    state = {'queries': [], 'in_flight': 0, 'max_in_flight': 0, 'flaky_failures': 1}
+
+    async def search(request):
+        # Free-form or structured query (street, postalcode, city), see backends.build_nominatim_query
+        query = request.query.get('q') or ', '.join(
+            request.query[key] for key in ('street', 'postalcode', 'city') if key in request.query
+        )
+        state['queries'].append(query)
+        state['in_flight'] += 1
+        state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+        try:
+            await asyncio.sleep(0.05)
+            if query.startswith('Flaky') and state['flaky_failures'] > 0:
+                state['flaky_failures'] -= 1
+                return web.Response(status=503)
+            if query.startswith('Nowhere'):
+                return web.json_response([])
+            return web.json_response([{'lat': '52.5', 'lon': '13.4', 'display_name': query}])
+        finally:
+            state['in_flight'] -= 1
+
+    app = web.Application()
+    app.router.add_get('/search', search)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{port}', state
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+def test_engine_bounded_concurrency_and_retries(plugin_config, fake_nominatim):
+    url, state = fake_nominatim
+    plugin_config(geocoder='nominatim_selfhosted', nominatim_selfhosted_url=url, nominatim_selfhosted_concurrency=4)
+    engine = AsyncGeocodingEngine(get_geolocator(), backoff=0.01)
+    queries = {i: (f'Street {i}, Berlin', None) for i in range(12)}
+    queries['flaky'] = ('Flaky Street 1, Berlin', None)
+    queries['nowhere'] = ('Nowhere 1', None)
+
+    results = engine.geocode_many(queries)
+
+    assert results[0] == ((52.5, 13.4), 'ok', 'address')
+    assert results['flaky'] == ((52.5, 13.4), 'ok', 'address')  # Retried after the 503
+    assert results['nowhere'] == (None, 'not_found', None)
+    assert state['queries'].count('Flaky Street 1, Berlin') == 2
+    assert 1 < state['max_in_flight'] <= 4
+
+
+@pytest.mark.django_db
+def test_batch_task_uses_async_engine(plugin_config, fake_nominatim, make_order):
+    url, state = fake_nominatim
+    plugin_config(geocoder='nominatim_selfhosted', nominatim_selfhosted_url=url, async_geocoding='on')
+    orders = [make_order(city=f'City {i}') for i in range(5)]
+    with scopes_disabled():
+        for order in orders:
+            PendingGeocode.objects.create(order=order)
+    geocode_pending_orders_task()
+    assert len(state['queries']) == 5
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.filter(latitude=52.5, longitude=13.4).count() == 5
+
+
+def test_engine_throttles_fallback(plugin_config):
+    class NotFound(GeocoderBackend):
+        identifier = 'not_found'
+        default_concurrency = 8
+
+        def geocode(self, address_string, components=None):
+            return None
+
+    class Fallback(GeocoderBackend):
+        identifier = 'fallback'
+
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def geocode(self, address_string, components=None):
+            self.calls.append(time.monotonic())
+            return (52.5, 13.4)
+
+    backend = NotFound()
+    backend.fallback = Fallback()
+    limiter = RateLimiter(name='test:fallback', rate=20.0, cache=LocMemCache('fallback', {}))
+    engine = AsyncGeocodingEngine(backend, fallback_rate_limiter=limiter)
+
+    started = time.monotonic()
+    results = engine.geocode_many({i: (f'Street {i}, Berlin', None) for i in range(8)})
+
+    assert all(outcome.coordinates == (52.5, 13.4) for outcome in results.values())
+    # All eight requests run at once, but the n-th fallback call has to wait for the n-th limiter slot
+    calls = sorted(backend.fallback.calls)
+    assert len(calls) == 8
+    assert all(call >= started + n * limiter.interval - 0.005 for n, call in enumerate(calls))
@@ -0,0 +1,74 @@
+from unittest import mock
+
+import pytest
+from geopy.exc import GeocoderTimedOut
+
+from pretix_mapplugin.backends import (
+    NominatimBackend, PhotonBackend, PostcodeCentroidBackend, get_backend_class,
+)
+from pretix_mapplugin.geocoding import geocode_address, get_geolocator, get_shared_geolocator
+from pretix_mapplugin.postcodes import build_postcode_file
+from pretix_mapplugin.ratelimit import get_rate_limiter
+
+GEONAMES_ROWS = [
+    # country, postcode, place, admin1 name, admin1 code, admin2 name, admin2 code, admin3 name, admin3 code, lat, lon, accuracy
+    ['DE', '10115', 'Berlin', 'Berlin', 'BE', '', '00', 'Berlin, Stadt', '11000', '52.5323', '13.3846', '4'],
+    ['NL', '1012 AB', 'Amsterdam', 'Noord-Holland', '07', '', '', '', '', '52.3738', '4.8910', '6'],
+]
+
+
+@pytest.fixture
+def postcode_file(tmp_path):
+    source = tmp_path / 'allCountries.txt'
+    source.write_text('\n'.join('\t'.join(row) for row in GEONAMES_ROWS) + '\n', encoding='utf-8')
+    target = tmp_path / 'postcodes.bin'
+    build_postcode_file(str(source), str(target))
+    return str(target)
+
+
+def test_default_backend_is_public_nominatim(plugin_config):
+    plugin_config(rate_limit=2)
+    assert get_backend_class() is NominatimBackend
+    assert get_rate_limiter().rate == 2.0
+
+
+def test_self_hosted_backend_settings(plugin_config):
+    plugin_config(geocoder='photon', photon_url='http://photon.internal:2322/', photon_concurrency=16)
+    geolocator = get_geolocator()
+    assert isinstance(geolocator, PhotonBackend)
+    assert (geolocator.scheme, geolocator.domain) == ('http', 'photon.internal:2322')
+    assert geolocator.concurrency == 16
+    assert not get_rate_limiter().enabled
+
+
+def test_unknown_backend_falls_back_to_nominatim(plugin_config):
+    plugin_config(geocoder='does.not.Exist')
+    assert get_backend_class() is NominatimBackend
+
+
+def test_postcode_backend(plugin_config, postcode_file):
+    plugin_config(geocoder='postcode', postcode_file=postcode_file)
+    geolocator = get_geolocator()
+    assert isinstance(geolocator, PostcodeCentroidBackend)
+    assert geocode_address('Heidelberger Str. 1, Berlin, 10115, Germany', geolocator=geolocator,
+                           components={'country': 'DE', 'zipcode': '10115'}) == (52.5323, 13.3846)
+    assert geolocator.geocode('', components={'country': 'nl', 'zipcode': '1012ab'}) == (52.3738, 4.891)
+    assert geolocator.geocode('', components={'country': 'DE', 'zipcode': '99999'}) is None
+    assert geolocator.geocode('Berlin, Germany') is None
+
+
+def test_postcode_fallback(plugin_config, postcode_file):
+    plugin_config(geocoder_fallback='postcode', postcode_file=postcode_file)
+    geolocator = get_geolocator('test-agent')
+    assert isinstance(geolocator, NominatimBackend)
+    with mock.patch.object(geolocator, 'geocode', side_effect=GeocoderTimedOut()):
+        assert geocode_address('Somewhere, 10115, Germany', geolocator=geolocator,
+                               components={'country': 'DE', 'zipcode': '10115'}) == (52.5323, 13.3846)
+
+
+def test_shared_geolocator_pools_connections(plugin_config):
+    plugin_config(nominatim_pool_size=4)
+    geolocator = get_shared_geolocator('pool-test-agent')
+    assert get_shared_geolocator('pool-test-agent') is geolocator
+    session = geolocator.geocoder.adapter.session
+    assert session.get_adapter('https://nominatim.openstreetmap.org/')._pool_maxsize == 4
@@ -0,0 +1,195 @@
+"""
+Benchmarks of the map data path and the geocoding pipeline on synthetic events.
+
+Opt-in, as they take minutes for large events:
+
+    PRETIX_MAP_BENCHMARK=1 python -m pytest tests/test_benchmarks.py -s
+
+Environment variables:
+    PRETIX_MAP_BENCHMARK_SIZES: Comma separated paid orders per event (default: 1000,10000,100000).
+    PRETIX_MAP_BENCHMARK_ROUNDS: Requests per data view measurement (default: 3).
+    PRETIX_MAP_BENCHMARK_TASK_SAMPLE: Orders geocoded one by one with geocode_order_task (default: 500).
+    PRETIX_MAP_BENCHMARK_LATENCY: Simulated latency of the fake geocoder in ms (default: 0).
+    PRETIX_MAP_BENCHMARK_OUTPUT: JSON file the results are written to (default: benchmark-results.json).
+
+Runs of different commits are compared by the `results` entries, keyed by
+`name` and `size`. The fake geocoder answers with coordinates derived from
+the address, so only the plugin's own overhead is measured.
+"""
+import hashlib
+import io
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+import pretix
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import InvoiceAddress, Order
+
+from pretix_mapplugin.backends import GEOCODER_BACKENDS, GeocoderBackend
+from pretix_mapplugin.catchment import catchment_available
+from pretix_mapplugin.models import OrderGeocodeData
+from pretix_mapplugin.tasks import geocode_order_task
+
+pytestmark = pytest.mark.skipif(not os.environ.get('PRETIX_MAP_BENCHMARK'),
+                                reason='Benchmarks are opt-in, set PRETIX_MAP_BENCHMARK=1 to run them.')
+
+SIZES = [int(size) for size in os.environ.get('PRETIX_MAP_BENCHMARK_SIZES', '1000,10000,100000').split(',')]
+ROUNDS = int(os.environ.get('PRETIX_MAP_BENCHMARK_ROUNDS', 3))
+TASK_SAMPLE = int(os.environ.get('PRETIX_MAP_BENCHMARK_TASK_SAMPLE', 500))
+LATENCY = float(os.environ.get('PRETIX_MAP_BENCHMARK_LATENCY', 0)) / 1000
+OUTPUT = os.environ.get('PRETIX_MAP_BENCHMARK_OUTPUT', 'benchmark-results.json')
+# Share of orders sharing their address with another order (repeat buyers, group bookings)
+DUPLICATE_ADDRESS_SHARE = 0.2
+BULK_BATCH_SIZE = 2000
+
+
+class BenchmarkGeocoderBackend(GeocoderBackend):
+    """Local fake geocoder: deterministic coordinates in Central Europe, after LATENCY seconds."""
+    identifier = 'benchmark'
+    verbose_name = 'Benchmark (fake)'
+    default_concurrency = 8
+
+    def geocode(self, address_string: str, components: dict | None = None) -> tuple[float, float] | None:
+        if LATENCY:
+            time.sleep(LATENCY)
+        digest = hashlib.sha256(address_string.encode()).digest()
+        return 47.0 + digest[0] / 255 * 8, 6.0 + digest[1] / 255 * 9
+
+
+@pytest.fixture(scope='module')
+def benchmark_report():
+    """Collects the results of all sizes and writes them to OUTPUT once the module is done."""
+    results = []
+    yield results
+    report = {
+        'created_at': now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pretix': pretix.__version__,
+        'database': connection.vendor,
+        'geocoder_latency_ms': LATENCY * 1000,
+        'results': results,
+    }
+    with open(OUTPUT, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results written to {OUTPUT}:")
+    for result in results:
+        print(f"  {json.dumps(result)}")
+
+
+@pytest.fixture
+def benchmark_geocoder(plugin_config, monkeypatch):
+    monkeypatch.setitem(GEOCODER_BACKENDS, BenchmarkGeocoderBackend.identifier, BenchmarkGeocoderBackend)
+    plugin_config(geocoder=BenchmarkGeocoderBackend.identifier)
+
+
+@scopes_disabled()
+def create_synthetic_orders(event, size: int) -> list[int]:
+    """Creates `size` paid orders with invoice addresses in bulk, returns their primary keys."""
+    sales_channel = event.organizer.sales_channels.get(identifier='web')
+    unique_addresses = max(1, int(size * (1 - DUPLICATE_ADDRESS_SHARE)))
+    created_at = now()
+    order_pks = []
+    for start in range(0, size, BULK_BATCH_SIZE):
+        orders = Order.objects.bulk_create([
+            Order(code=f'B{i:07d}', event=event, organizer=event.organizer, email=f'buyer{i}@example.org',
+                  status=Order.STATUS_PAID, datetime=created_at, expires=created_at + timedelta(days=10), total=Decimal('23.00'),
+                  sales_channel=sales_channel)
+            for i in range(start, min(start + BULK_BATCH_SIZE, size))
+        ])
+        addresses = []
+        for order in orders:
+            n = int(order.code[1:]) % unique_addresses
+            addresses.append(InvoiceAddress(order=order, street=f'Teststr. {n // 500 + 1}', zipcode=f'{10000 + n % 500}',
+                                            city=f'City {n % 500}', country='DE'))
+        InvoiceAddress.objects.bulk_create(addresses)
+        order_pks.extend(order.pk for order in orders)
+    return order_pks
+
+
+def measure_request(client, url: str, params: dict) -> dict:
+    """Median and best latency over ROUNDS requests, plus queries and peak Python memory of one more."""
+    durations = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        response = client.get(url, params)
+        content_length = len(read_content(response))
+        durations.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        read_content(client.get(url, params))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'median_s': round(statistics.median(durations), 4),
+        'min_s': round(min(durations), 4),
+        'queries': len(queries),
+        'peak_memory_bytes': peak,
+        'response_bytes': content_length,
+    }
+
+
+def read_content(response) -> bytes:
+    """Reads the whole body, streamed responses are only produced while being read."""
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('size', SIZES)
+def test_benchmark(size, event, logged_in_client, benchmark_geocoder, benchmark_report, tmp_path):
+    started = time.perf_counter()
+    order_pks = create_synthetic_orders(event, size)
+    benchmark_report.append({'name': 'setup.create_orders', 'size': size,
+                             'seconds': round(time.perf_counter() - started, 3)})
+
+    # --- Backfill of all orders by the management command ---
+    started = time.perf_counter()
+    call_command('geocode_existing_orders', delay=0, checkpoint_file=str(tmp_path / 'checkpoint.json'),
+                 stdout=io.StringIO())
+    seconds = time.perf_counter() - started
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.filter(event=event, latitude__isnull=False).count() == size
+    benchmark_report.append({'name': 'geocode_existing_orders', 'size': size, 'orders': size,
+                             'seconds': round(seconds, 3), 'orders_per_s': round(size / seconds, 1)})
+
+    # --- Map data, cold (the test settings use a dummy cache) ---
+    url = f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/data/'
+    for name, params in (('columnar', {'format': 'columnar'}), ('full', {}),
+                         ('columnar_ndjson', {'format': 'columnar', 'stream': 'ndjson'})):
+        result = measure_request(logged_in_client, url, params)
+        benchmark_report.append({'name': f'data_view.{name}', 'size': size, **result})
+
+    # --- Distances from the venue (NumPy only) ---
+    if catchment_available():
+        event.geo_lat, event.geo_lon = 51.0, 10.5
+        event.save()
+        result = measure_request(logged_in_client, f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/catchment/', {})
+        benchmark_report.append({'name': 'catchment_view', 'size': size, **result})
+
+    # --- Single orders as geocoded after payment, with the shared address cache already filled ---
+    sample = order_pks[:min(TASK_SAMPLE, size)]
+    with scopes_disabled():
+        OrderGeocodeData.objects.filter(order_id__in=sample).delete()
+    started = time.perf_counter()
+    for order_pk in sample:
+        geocode_order_task.apply(args=[order_pk], kwargs={'organizer_pk': event.organizer.pk})
+    seconds = time.perf_counter() - started
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.filter(order_id__in=sample, latitude__isnull=False).count() == len(sample)
+    benchmark_report.append({'name': 'geocode_order_task', 'size': size, 'orders': len(sample),
+                             'seconds': round(seconds, 3), 'orders_per_s': round(len(sample) / seconds, 1)})
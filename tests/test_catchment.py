@@ -0,0 +1,67 @@
+import pytest
+
+from pretix_mapplugin.aggregates import haversine_km
+from pretix_mapplugin.catchment import catchment_available, compute_catchment, haversine_km_many
+
+requires_numpy = pytest.mark.skipif(not catchment_available(), reason='The catchment analysis requires NumPy.')
+
+
+def catchment_url(event):
+    return f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/catchment/'
+
+
+@requires_numpy
+def test_compute_catchment():
+    import numpy as np
+
+    latitudes = np.array([52.53, 52.50, 48.137, 48.2])
+    longitudes = np.array([13.38, 13.42, 11.575, 16.37])
+    distances = haversine_km_many(52.52, 13.405, latitudes, longitudes)
+    assert distances.tolist() == pytest.approx([haversine_km(52.52, 13.405, lat, lon)
+                                                for lat, lon in zip(latitudes, longitudes)])
+
+    data = compute_catchment(latitudes, longitudes, (52.52, 13.405), [10.0, 500.0], bins=4)
+    assert data['count'] == 4
+    assert [(ring['key'], ring['count'], ring['within']) for ring in data['rings']] == [
+        ('0-10', 2, 2), ('10-500', 0, 2), ('500+', 2, 4),
+    ]
+    assert data['rings'][0]['share'] == 0.5
+    assert data['percentiles']['p50'] == pytest.approx(np.median(distances), abs=0.01)
+    assert sum(data['histogram']['counts']) + data['histogram']['overflow'] == 4
+    assert len(data['histogram']['edges_km']) == 5
+
+    empty = compute_catchment(np.array([]), np.array([]), (52.52, 13.405), [10.0])
+    assert empty['count'] == 0 and empty['histogram'] is None
+    assert [ring['count'] for ring in empty['rings']] == [0, 0]
+
+
+@requires_numpy
+@pytest.mark.django_db
+def test_catchment_view(logged_in_client, event, geocoded_order):
+    geocoded_order(latitude=52.53, longitude=13.38)
+    geocoded_order(latitude=48.137, longitude=11.575)
+    # Without the event's location there is nothing to measure from
+    assert logged_in_client.get(catchment_url(event)).json() == {'venue': None, 'count': 0}
+
+    event.geo_lat, event.geo_lon = 52.52, 13.405
+    event.save()
+    data = logged_in_client.get(catchment_url(event), {'bins': 5}).json()
+    assert data['venue'] == {'lat': 52.52, 'lon': 13.405}
+    assert data['count'] == 2
+    assert data['rings'][0] == {'key': '0-10', 'inner_km': 0.0, 'outer_km': 10.0, 'count': 1, 'within': 1, 'share': 0.5}
+    assert len(data['histogram']['counts']) == 5
+
+    # A location given in the request takes precedence
+    data = logged_in_client.get(catchment_url(event), {'lat': 48.137, 'lon': 11.575}).json()
+    assert data['venue'] == {'lat': 48.137, 'lon': 11.575}
+    assert data['max_km'] == pytest.approx(504, abs=1)
+
+    assert logged_in_client.get(catchment_url(event), {'lat': 95, 'lon': 0}).status_code == 400
+    assert logged_in_client.get(catchment_url(event), {'lat': 48}).status_code == 400
+    assert logged_in_client.get(catchment_url(event), {'bins': 'x'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_catchment_view_without_numpy(logged_in_client, event, monkeypatch):
+    monkeypatch.setattr('pretix_mapplugin.catchment.np', None)
+    assert logged_in_client.get(catchment_url(event)).status_code == 501
@@ -0,0 +1,65 @@
+import json
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin.geocoding import GeocodeOutcome
+from pretix_mapplugin.models import OrderGeocodeData
+from pretix_mapplugin.postcodes import PostcodeTable
+
+COMMAND_MODULE = 'pretix_mapplugin.management.commands.geocode_existing_orders'
+FOUND = GeocodeOutcome((52.53, 13.38), 'ok', 'address')
+
+
+@pytest.mark.django_db
+def test_geocode_existing_orders_in_chunks_with_workers(make_order, tmp_path):
+    orders = [make_order(city=f'City {i}') for i in range(5)] + [make_order(street='', zipcode='', city='', country='')]
+    checkpoint = tmp_path / 'checkpoint.json'
+    with mock.patch(f'{COMMAND_MODULE}.geocode_address_with_status', return_value=FOUND) as geocode:
+        call_command('geocode_existing_orders', chunk_size=2, workers=3, delay=0, checkpoint_file=str(checkpoint))
+    assert geocode.call_count == 5
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.filter(latitude=52.53).count() == 5
+        assert OrderGeocodeData.objects.filter(order=orders[-1], latitude__isnull=True).exists()
+    assert json.loads(checkpoint.read_text())['last_order_pk'] == orders[-1].pk
+
+
+@pytest.mark.django_db
+def test_geocode_existing_orders_resume(make_order, tmp_path):
+    orders = [make_order(city=f'City {i}') for i in range(4)]
+    checkpoint = tmp_path / 'checkpoint.json'
+    selection = {'organizer': None, 'event': None, 'force_recode': True}
+    checkpoint.write_text(json.dumps({'selection': selection, 'last_order_pk': orders[1].pk}))
+    with mock.patch(f'{COMMAND_MODULE}.geocode_address_with_status', return_value=GeocodeOutcome((48.1, 11.5), 'ok', 'address')):
+        call_command('geocode_existing_orders', force_recode=True, resume=True, delay=0,
+                     checkpoint_file=str(checkpoint))
+    with scopes_disabled():
+        assert set(OrderGeocodeData.objects.values_list('order_id', flat=True)) == {orders[2].pk, orders[3].pk}
+
+
+def test_import_postcode_centroids(tmp_path):
+    source = tmp_path / 'DE.txt'
+    source.write_text('DE\t10115\tBerlin\tBerlin\tBE\t\t00\t\t11000\t52.5323\t13.3846\t4\n', encoding='utf-8')
+    target = tmp_path / 'postcodes.bin'
+    call_command('import_postcode_centroids', str(source), output=str(target))
+    assert PostcodeTable(str(target)).lookup('DE', '10115') == (52.5323, 13.3846)
+
+
+@pytest.mark.django_db
+def test_geocode_existing_orders_changed_only(geocoded_order, tmp_path):
+    orders = [geocoded_order(city=f'City {i}') for i in range(3)]
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    with mock.patch(f'{COMMAND_MODULE}.geocode_address_with_status', return_value=FOUND) as geocode:
+        # Rows of earlier versions have no fingerprint yet, they record the current address
+        call_command('geocode_existing_orders', changed_only=True, delay=0, checkpoint_file=checkpoint)
+        assert geocode.call_count == 0
+        with scopes_disabled():
+            assert not OrderGeocodeData.objects.filter(address_hash__isnull=True).exists()
+            orders[1].invoice_address.city = 'Potsdam'
+            orders[1].invoice_address.save()
+
+        call_command('geocode_existing_orders', changed_only=True, delay=0, checkpoint_file=checkpoint)
+    assert geocode.call_count == 1
+    assert 'Potsdam' in geocode.call_args[0][0]
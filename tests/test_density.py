@@ -0,0 +1,113 @@
+import struct
+import zlib
+
+import pytest
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin.density import (
+    TILE_SIZE,
+    density_tiles_available,
+    encode_png,
+    get_covered_tiles,
+    get_tile_version,
+    load_event_coordinates,
+    prerender_density_tiles,
+    project,
+    render_density_grid,
+)
+
+requires_numpy = pytest.mark.skipif(not density_tiles_available(), reason='Density tiles require NumPy.')
+
+
+def density_url(event):
+    return f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/density/'
+
+
+@requires_numpy
+def test_render_density_grid():
+    import numpy as np
+
+    # Center of tile 1/1 at zoom 1 is pixel (384, 384)
+    px, py = np.array([384.0, 511.0]), np.array([384.0, 384.0])
+    grid = render_density_grid(px, py, 1, 1, radius=10)
+    assert grid.shape == (TILE_SIZE, TILE_SIZE)
+    assert grid[128, 128] == pytest.approx(1.0)
+    assert grid[128, 118] == pytest.approx(grid[128, 138])
+    # A point on the neighbouring tile reaches in over the edge
+    assert render_density_grid(np.array([250.0]), np.array([384.0]), 1, 1, radius=10)[128, 0] > 0
+
+    x, y = project(np.array([0.0]), np.array([0.0]), 0)
+    assert (x[0], y[0]) == pytest.approx((128.0, 128.0))
+
+
+@requires_numpy
+def test_encode_png():
+    import numpy as np
+
+    rgba = np.zeros((2, 3, 4), dtype=np.uint8)
+    rgba[1, 2] = (255, 0, 0, 200)
+    png = encode_png(rgba)
+    assert png.startswith(b'\x89PNG\r\n\x1a\n')
+    assert struct.unpack('>II', png[16:24]) == (3, 2)
+    idat_length = struct.unpack('>I', png[33:37])[0]
+    raw = zlib.decompress(png[41:41 + idat_length])
+    assert raw == b'\x00' + b'\x00' * 12 + b'\x00' + b'\x00' * 8 + bytes((255, 0, 0, 200))
+
+
+@requires_numpy
+@pytest.mark.django_db
+def test_density_tile_view(logged_in_client, event, geocoded_order):
+    geocoded_order(latitude=52.53, longitude=13.38)  # Berlin, tile 4/8/5
+    response = logged_in_client.get(density_url(event), {'zoom': 4, 'x': 8, 'y': 5})
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'image/png'
+    assert response.content.startswith(b'\x89PNG')
+    etag = response['ETag']
+    assert logged_in_client.get(density_url(event), {'zoom': 4, 'x': 8, 'y': 5},
+                                HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    # Only tiles around new coordinates change their version
+    with scopes_disabled():
+        far_version = get_tile_version(event, 4, 0, 0, 25)
+        geocoded_order(latitude=52.4, longitude=13.5)
+        assert get_tile_version(event, 4, 0, 0, 25) == far_version
+    assert logged_in_client.get(density_url(event), {'zoom': 4, 'x': 8, 'y': 5},
+                                HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    assert logged_in_client.get(density_url(event), {'zoom': 4, 'x': 16, 'y': 0}).status_code == 400
+    assert logged_in_client.get(density_url(event), {'zoom': 4}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_density_tile_view_without_numpy(logged_in_client, event, monkeypatch):
+    monkeypatch.setattr('pretix_mapplugin.density.np', None)
+    assert logged_in_client.get(density_url(event), {'zoom': 0, 'x': 0, 'y': 0}).status_code == 501
+
+
+@requires_numpy
+@pytest.mark.django_db
+@scopes_disabled()
+def test_prerender_density_tiles(event, geocoded_order, plugin_config):
+    plugin_config(density_prerender_max_zoom=2)
+    assert prerender_density_tiles(event) == 0
+    geocoded_order(latitude=41.0, longitude=45.0)  # Far from tile edges up to zoom 2
+    # One tile per zoom level, the test settings' dummy cache never skips one
+    assert prerender_density_tiles(event) == 3
+
+
+@requires_numpy
+@pytest.mark.django_db
+@scopes_disabled()
+def test_prerender_computes_tile_versions_in_memory(event, geocoded_order, plugin_config, django_assert_num_queries):
+    plugin_config(density_prerender_max_zoom=4)
+    for latitude, longitude in ((52.53, 13.38), (52.4, 13.5), (48.137, 11.575), (0.0, 0.0), (-33.9, 151.2)):
+        geocoded_order(latitude=latitude, longitude=longitude)
+    latitudes, longitudes, timestamps = load_event_coordinates(event, timestamps=True)
+    for zoom in range(5):
+        px, py = project(latitudes, longitudes, zoom)
+        for x, y, count, last in get_covered_tiles(px, py, timestamps, zoom, 25):
+            assert get_tile_version(event, zoom, x, y, 25) == f"{count}-{last}-25-100"
+
+    # One query for all coordinates, none per tile
+    with django_assert_num_queries(1):
+        assert prerender_density_tiles(event) > 5
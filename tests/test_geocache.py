@@ -0,0 +1,61 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.utils.timezone import now
+
+from pretix_mapplugin.geocache import (
+    address_cache_key,
+    geocode_address_cached,
+    lookup_cached_outcomes_many,
+    normalize_address,
+    purge_expired_cache_entries,
+    store_cached_coordinates,
+)
+from pretix_mapplugin.geocoding import GeocodeOutcome
+from pretix_mapplugin.models import GeocodeCacheEntry
+
+
+def test_normalize_address():
+    assert normalize_address("  Heidelberger Str. 1 ,Berlin,, 10115 ,  Germany ") == \
+        "heidelberger str. 1, berlin, 10115, germany"
+    assert normalize_address("Main\nStreet 5, Berlin") == "main street 5, berlin"
+    assert address_cache_key("Main Street 5, BERLIN") == address_cache_key("main street 5,berlin")
+
+
+@pytest.mark.django_db
+def test_cache_roundtrip_and_negative_results():
+    assert lookup_cached_outcomes_many(["Somewhere 1, Berlin"]) == {}
+    store_cached_coordinates("Somewhere 1, Berlin", (52.5, 13.4), match_level='full')
+    store_cached_coordinates("Nowhere 1, Atlantis", None)
+    assert lookup_cached_outcomes_many(["somewhere 1,  berlin", "Nowhere 1, Atlantis", "Elsewhere 1, Paris"]) == {
+        address_cache_key("Somewhere 1, Berlin"): GeocodeOutcome((52.5, 13.4), 'ok', 'full'),
+        address_cache_key("Nowhere 1, Atlantis"): GeocodeOutcome(None, 'not_found'),
+    }
+
+
+@pytest.mark.django_db
+def test_expired_entries_are_ignored_and_purged():
+    store_cached_coordinates("Somewhere 1, Berlin", (52.5, 13.4))
+    GeocodeCacheEntry.objects.update(expires_at=now() - timedelta(seconds=1))
+    assert lookup_cached_outcomes_many(["Somewhere 1, Berlin"]) == {}
+    assert purge_expired_cache_entries() == 1
+
+
+@pytest.mark.django_db
+def test_geocode_address_cached_only_requests_once():
+    outcome = GeocodeOutcome((52.5, 13.4), 'ok', 'postcode')
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=outcome) as geocode:
+        assert geocode_address_cached("Somewhere 1, Berlin") == (outcome, False)
+        assert geocode_address_cached("Somewhere 1,  berlin") == (outcome, True)
+    assert geocode.call_count == 1
+
+
+@pytest.mark.django_db
+def test_transient_failures_are_not_cached():
+    outcome = GeocodeOutcome(None, 'timeout')
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=outcome) as geocode:
+        assert geocode_address_cached("Somewhere 1, Berlin") == (outcome, False)
+        assert geocode_address_cached("Somewhere 1, Berlin") == (outcome, False)
+    assert geocode.call_count == 2
+    assert not GeocodeCacheEntry.objects.exists()
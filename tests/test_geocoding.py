@@ -0,0 +1,64 @@
+from unittest import mock
+
+import pytest
+from geopy.exc import GeocoderTimedOut
+
+from pretix_mapplugin.backends import build_nominatim_query
+from pretix_mapplugin.geocoding import (
+    geocode_address_with_status,
+    get_address_components_from_order,
+    get_formatted_address_from_order,
+    get_geolocator,
+    get_query_ladder,
+    normalize_street,
+)
+
+COMPONENTS = {'street': 'Heidelberger Str. 1', 'zipcode': '10115', 'city': 'Berlin', 'state': '',
+              'country': 'DE', 'country_name': 'Germany'}
+
+
+def test_normalize_street():
+    assert normalize_street('c/o Miller\nHeidelberger  Str. 1') == 'Heidelberger Str. 1'
+    assert normalize_street('Main Street 5 Apt 3') == 'Main Street 5'
+    assert normalize_street('Hauptstr. 5, Whg. 12, 2. OG') == 'Hauptstr. 5'
+    assert normalize_street('Flat B, 10 Downing Street') == '10 Downing Street'
+    assert normalize_street('Attn: Accounting, Apartment Road 5 #12') == 'Apartment Road 5'
+
+
+@pytest.mark.django_db
+def test_formatted_address_is_normalized(make_order):
+    order = make_order(street='z. Hd. Frau Meier\nHeidelberger Str. 1  App. 4', zipcode=' 1012 ab ')
+    assert get_address_components_from_order(order)['zipcode'] == '1012 AB'
+    assert get_formatted_address_from_order(order) == 'Heidelberger Str. 1, Berlin, 1012 AB, Germany'
+
+
+def test_query_ladder(plugin_config):
+    assert [(level, query) for level, query, _ in get_query_ladder('full', COMPONENTS)] == [
+        ('address', 'full'), ('postcode', 'Berlin, 10115, Germany'), ('city', 'Berlin, Germany'),
+    ]
+    assert [level for level, _, _ in get_query_ladder('full', {**COMPONENTS, 'street': ''})] == ['address', 'city']
+    plugin_config(query_ladder='off')
+    assert len(get_query_ladder('full', COMPONENTS)) == 1
+
+
+def test_nominatim_structured_query():
+    assert build_nominatim_query('full', COMPONENTS) == (
+        {'street': 'Heidelberger Str. 1', 'postalcode': '10115', 'city': 'Berlin'}, {'country_codes': 'de'}
+    )
+    assert build_nominatim_query('full', None) == ('full', {})
+
+
+def test_ladder_records_matching_level(plugin_config):
+    plugin_config()
+    geolocator = get_geolocator('test-agent')
+    answers = {'Berlin, 10115, Germany': (52.53, 13.38)}
+    with mock.patch.object(geolocator, 'geocode', side_effect=lambda query, components: answers.get(query)) as geocode:
+        assert geocode_address_with_status('full', geolocator=geolocator, components=COMPONENTS) == \
+            ((52.53, 13.38), 'ok', 'postcode')
+    assert geocode.call_count == 2
+
+    # A transient failure is retried later with the precise query instead of settling for a coarser one
+    with mock.patch.object(geolocator, 'geocode', side_effect=GeocoderTimedOut()) as geocode:
+        assert geocode_address_with_status('full', geolocator=geolocator, components=COMPONENTS) == \
+            (None, 'timeout', None)
+    assert geocode.call_count == 1
@@ -0,0 +1,41 @@
+import importlib
+
+import pytest
+from django.apps import apps
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin import geohash
+from pretix_mapplugin.models import OrderGeocodeData
+
+
+def test_encode_known_values():
+    assert geohash.encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert geohash.encode(52.52, 13.405, 5) == 'u33dc'
+
+
+def test_decode_bbox_contains_point():
+    west, south, east, north = geohash.decode_bbox(geohash.encode(52.52, 13.405, 7))
+    assert west <= 13.405 <= east and south <= 52.52 <= north
+
+
+def test_bbox_prefixes_cover_box():
+    prefixes = geohash.bbox_prefixes(5.8, 47.2, 15.1, 55.1)
+    assert 0 < len(prefixes) <= geohash.MAX_COVER_PREFIXES
+    for lat, lon in [(47.2, 5.8), (55.1, 15.1), (52.52, 13.405), (48.14, 11.58)]:
+        assert any(geohash.encode(lat, lon).startswith(p) for p in prefixes)
+
+
+@pytest.mark.django_db
+def test_derived_fields_filled_on_save_and_backfill(event, geocoded_order):
+    order = geocoded_order(latitude=52.52, longitude=13.405)
+    with scopes_disabled():
+        row = OrderGeocodeData.objects.get(order=order)
+        assert row.event_id == event.pk
+        assert row.geohash == geohash.encode(52.52, 13.405)
+
+        OrderGeocodeData.objects.update(event=None, geohash=None)
+        migration = importlib.import_module('pretix_mapplugin.migrations.0005_ordergeocodedata_event_geohash')
+        migration.backfill_event_and_geohash(apps, None)
+        row.refresh_from_db()
+        assert row.event_id == event.pk
+        assert row.geohash == geohash.encode(52.52, 13.405)
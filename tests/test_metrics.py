@@ -0,0 +1,36 @@
+from unittest import mock
+
+import pytest
+from django.core.cache.backends.locmem import LocMemCache
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin import metrics
+from pretix_mapplugin.geocoding import geocode_address_with_status
+from pretix_mapplugin.persistence import save_geocode_results
+from pretix_mapplugin.ratelimit import RateLimiter
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_stored_results_counted_by_status(make_order):
+    orders = [make_order() for _ in range(3)]
+    with mock.patch.object(metrics.geocode_results, 'inc') as inc:
+        save_geocode_results([(orders[0].pk, 52.53, 13.38), (orders[1].pk, 48.1, 11.5), (orders[2].pk, None, None)])
+    assert sorted(inc.call_args_list) == [mock.call(1, status='not_found'), mock.call(2, status='ok')]
+
+
+def test_request_latency_and_rate_limiter_wait_recorded():
+    geolocator = mock.Mock(identifier='nominatim', fallback=None, match_level=None)
+    geolocator.geocode.return_value = None
+    limiter = RateLimiter(name='test', rate=1000, cache=LocMemCache('metrics', {}))
+    with mock.patch.object(metrics.geocode_request_duration, 'observe') as request_duration, \
+            mock.patch.object(metrics.rate_limiter_wait, 'observe') as wait:
+        outcome = geocode_address_with_status('Nowhere 1, Atlantis', rate_limiter=limiter, geolocator=geolocator)
+    assert outcome.status == 'not_found'
+    assert request_duration.call_args.kwargs == {'backend': 'nominatim', 'status': 'not_found'}
+    assert wait.call_args.kwargs == {'limiter': 'test'}
+
+
+def test_recording_never_raises():
+    with mock.patch.object(metrics.task_retries, 'inc', side_effect=ConnectionError('redis down')):
+        metrics.inc(metrics.task_retries, task_name='pretix_mapplugin.tasks.geocode_order_task')
@@ -0,0 +1,32 @@
+import pytest
+from django_scopes import scopes_disabled
+
+from pretix_mapplugin.geohash import encode
+from pretix_mapplugin.models import OrderGeocodeData
+from pretix_mapplugin.persistence import save_geocode_results
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_save_geocode_results_upserts_in_chunks(event, make_order, geocoded_order, django_assert_max_num_queries):
+    existing = geocoded_order(latitude=1.0, longitude=1.0)
+    new_orders = [make_order() for _ in range(4)]
+    results = [(existing.pk, 52.53, 13.38)] + [(order.pk, 48.1, 11.5) for order in new_orders[:3]]
+    results.append((new_orders[3].pk, None, None))
+
+    # Per chunk: one query for the events, one INSERT (plus the transaction's savepoint)
+    with django_assert_max_num_queries(8):
+        assert save_geocode_results(results, chunk_size=3) == 5
+
+    row = OrderGeocodeData.objects.get(order=existing)
+    assert (row.latitude, row.longitude, row.geohash) == (52.53, 13.38, encode(52.53, 13.38))
+    assert OrderGeocodeData.objects.filter(event=event, latitude=48.1).count() == 3
+    assert OrderGeocodeData.objects.get(order=new_orders[3]).geohash is None
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_save_geocode_results_without_overwrite(geocoded_order):
+    existing = geocoded_order(latitude=1.0, longitude=1.0)
+    save_geocode_results([(existing.pk, 52.53, 13.38)], overwrite=False)
+    assert OrderGeocodeData.objects.get(order=existing).latitude == 1.0
@@ -0,0 +1,27 @@
+import random
+
+from pretix_mapplugin.postcodes import PostcodeTable, build_postcode_file
+
+
+def test_postcode_table_lookup(tmp_path):
+    random.seed(1)
+    rows = {}
+    for i in range(500):
+        country = random.choice(['DE', 'AT', 'CH', 'NL'])
+        postcode = f'{random.randint(1000, 99999)}'
+        rows[(country, postcode)] = (round(random.uniform(45, 55), 4), round(random.uniform(5, 15), 4))
+    lines = [f'{c}\t{p}\tPlace\t\t\t\t\t\t\t{lat}\t{lon}\t4' for (c, p), (lat, lon) in rows.items()]
+    # Postcodes listed for two places are placed in between, broken rows are skipped
+    lines += ['LU\tL-1111\tA\t\t\t\t\t\t\t49.0\t6.0\t4', 'LU\tL-1111\tB\t\t\t\t\t\t\t50.0\t7.0\t4', 'broken']
+    source = tmp_path / 'dump.txt'
+    source.write_text('\n'.join(lines), encoding='utf-8')
+    target = tmp_path / 'postcodes.bin'
+
+    assert build_postcode_file(str(source), str(target)) == len(rows) + 1
+    table = PostcodeTable(str(target))
+    for (country, postcode), (lat, lon) in rows.items():
+        found = table.lookup(country.lower(), f' {postcode} ')
+        assert abs(found[0] - lat) < 1e-4 and abs(found[1] - lon) < 1e-4
+    assert table.lookup('LU', 'l-1111') == (49.5, 6.5)
+    assert table.lookup('DE', '00000') is None
+    assert table.lookup('FR', '') is None
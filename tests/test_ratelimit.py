@@ -0,0 +1,34 @@
+import uuid
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from pretix_mapplugin.ratelimit import RateLimiter
+
+
+def _cache():
+    # LocMemCache instances with the same name share their storage
+    return LocMemCache(f'pretix_mapplugin_test_{uuid.uuid4()}', {})
+
+
+def test_reservations_are_spaced_by_rate():
+    limiter = RateLimiter(name='test', rate=10, cache=_cache())
+    assert limiter.reserve() == 0
+    assert 0.05 < limiter.reserve() <= 0.1
+    assert 0.15 < limiter.reserve() <= 0.2
+
+
+def test_limiters_sharing_a_cache_share_the_budget():
+    cache = _cache()
+    worker_a = RateLimiter(name='test', rate=10, cache=cache)
+    worker_b = RateLimiter(name='test', rate=10, cache=cache)
+    assert worker_a.reserve() == 0
+    assert worker_b.reserve() > 0.05
+
+
+def test_burst_and_disabled_limiter():
+    limiter = RateLimiter(name='test', rate=10, burst=3, cache=_cache())
+    assert [limiter.reserve() for _ in range(3)] == [0, 0, 0]
+    assert limiter.reserve() > 0
+
+    unlimited = RateLimiter(name='test', rate=0, cache=_cache())
+    assert unlimited.acquire() == 0
@@ -0,0 +1,135 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.utils import translation
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.signals import order_modified
+
+from pretix_mapplugin.geocache import get_order_address_hash
+from pretix_mapplugin.geocoding import GeocodeOutcome, get_formatted_address_from_order
+from pretix_mapplugin.models import GeocodeCacheEntry, OrderGeocodeData, PendingGeocode
+from pretix_mapplugin.tasks import geocode_order_task, geocode_pending_orders_task, retry_failed_geocodes_task
+
+FOUND = GeocodeOutcome((52.53, 13.38), 'ok', 'address')
+
+
+@pytest.mark.django_db
+def test_geocode_order_task_reuses_cached_address(organizer, make_order):
+    first, second = make_order(), make_order()
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=FOUND) as geocode:
+        geocode_order_task(first.pk, organizer_pk=organizer.pk)
+        geocode_order_task(second.pk, organizer_pk=organizer.pk)
+    assert geocode.call_count == 1
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.filter(latitude=52.53, longitude=13.38).count() == 2
+
+
+@pytest.mark.django_db
+def test_batch_task_deduplicates_addresses(make_order):
+    orders = [make_order(), make_order(), make_order(street='', zipcode='', city='', country='')]
+    with scopes_disabled():
+        for order in orders:
+            PendingGeocode.objects.create(order=order)
+    with mock.patch('pretix_mapplugin.tasks.geocode_address_with_status', return_value=FOUND) as geocode:
+        geocode_pending_orders_task()
+    assert geocode.call_count == 1
+    with scopes_disabled():
+        assert not PendingGeocode.objects.exists()
+        assert OrderGeocodeData.objects.filter(latitude=52.53).count() == 2
+        assert OrderGeocodeData.objects.filter(order=orders[2], latitude__isnull=True).exists()
+        assert OrderGeocodeData.objects.get(order=orders[2]).status == OrderGeocodeData.STATUS_NO_ADDRESS
+
+
+@pytest.mark.django_db
+def test_retry_task_backs_off_and_gives_up_on_not_found(plugin_config, organizer, make_order):
+    plugin_config(retry_base_delay=10)
+    order = make_order()
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=GeocodeOutcome(None, 'timeout')):
+        geocode_order_task(order.pk, organizer_pk=organizer.pk)
+    with scopes_disabled():
+        data = OrderGeocodeData.objects.get(order=order)
+        assert (data.status, data.attempts) == (OrderGeocodeData.STATUS_TIMEOUT, 1)
+        assert timedelta(minutes=9) < data.next_retry_at - now() <= timedelta(minutes=10)
+
+        # Not due yet
+        with mock.patch('pretix_mapplugin.tasks.geocode_address_with_status') as geocode:
+            retry_failed_geocodes_task()
+        assert geocode.call_count == 0
+
+        OrderGeocodeData.objects.update(next_retry_at=now())
+        with mock.patch('pretix_mapplugin.tasks.geocode_address_with_status', return_value=GeocodeOutcome(None, 'service_error')):
+            retry_failed_geocodes_task()
+        data.refresh_from_db()
+        assert (data.status, data.attempts) == (OrderGeocodeData.STATUS_SERVICE_ERROR, 2)
+        assert timedelta(minutes=19) < data.next_retry_at - now() <= timedelta(minutes=20)  # Doubled
+
+        OrderGeocodeData.objects.update(next_retry_at=now())
+        with mock.patch('pretix_mapplugin.tasks.geocode_address_with_status', return_value=GeocodeOutcome(None, 'not_found')):
+            retry_failed_geocodes_task()
+        data.refresh_from_db()
+        assert (data.status, data.attempts, data.next_retry_at) == (OrderGeocodeData.STATUS_NOT_FOUND, 3, None)
+
+
+@pytest.mark.django_db
+def test_address_change_refreshes_coordinates(organizer, event, make_order):
+    order = make_order()
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=FOUND):
+        geocode_order_task(order.pk, organizer_pk=organizer.pk)
+
+    with mock.patch('pretix_mapplugin.signals.geocode_order_task') as task:
+        order_modified.send(sender=event, order=order)  # e.g. attendee names changed
+        assert task.apply_async.call_count == 0
+        with scopes_disabled():
+            order.invoice_address.street = 'Friedrichstr. 10'
+            order.invoice_address.save()
+        order_modified.send(sender=event, order=order)
+        assert task.apply_async.call_args[1]['kwargs']['refresh'] is True
+
+    moved = GeocodeOutcome((52.51, 13.39), 'ok', 'address')
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=moved) as geocode:
+        geocode_order_task(order.pk, organizer_pk=organizer.pk, refresh=True)
+        geocode_order_task(order.pk, organizer_pk=organizer.pk, refresh=True)  # Unchanged now, skipped
+    assert geocode.call_count == 1
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.get(order=order).latitude == 52.51
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_address_hash_does_not_depend_on_language(event, make_order):
+    order = make_order()
+    with translation.override('de'):
+        german = get_order_address_hash(order)
+        assert get_formatted_address_from_order(order).endswith('Deutschland')
+    with translation.override('en'):
+        assert get_order_address_hash(order) == german
+
+    # Orders modified by users of another language are not geocoded again
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=FOUND):
+        geocode_order_task(order.pk, organizer_pk=event.organizer.pk)
+    with mock.patch('pretix_mapplugin.signals.geocode_order_task') as task, translation.override('de'):
+        order_modified.send(sender=event, order=order)
+    assert task.apply_async.call_count == 0
+
+
+@pytest.mark.django_db
+def test_cache_is_shared_across_languages(organizer, make_order):
+    first, second, third = make_order(), make_order(), make_order()
+    with mock.patch('pretix_mapplugin.geocache.geocode_address_with_status', return_value=FOUND) as geocode:
+        with translation.override('de'):
+            geocode_order_task(first.pk, organizer_pk=organizer.pk)
+        with translation.override('en'):
+            geocode_order_task(second.pk, organizer_pk=organizer.pk)
+    assert geocode.call_count == 1
+    # The geocoder is still asked with the country's name in the active language
+    assert geocode.call_args[0][0].endswith('Deutschland')
+    with scopes_disabled():
+        assert GeocodeCacheEntry.objects.count() == 1
+        PendingGeocode.objects.create(order=third)
+    with mock.patch('pretix_mapplugin.tasks.geocode_address_with_status') as geocode, translation.override('en'):
+        geocode_pending_orders_task()
+    assert geocode.call_count == 0
+    with scopes_disabled():
+        assert OrderGeocodeData.objects.get(order=third).address_hash == get_order_address_hash(third)
@@ -0,0 +1,198 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Order
+
+from pretix_mapplugin.models import OrderGeocodeData
+from pretix_mapplugin.views import SalesMapClusterView
+
+
+def data_url(event):
+    return f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/data/'
+
+
+@pytest.mark.django_db
+def test_data_view_requires_permission(client, event):
+    response = client.get(data_url(event))
+    assert response.status_code in (302, 403)
+
+
+@pytest.mark.django_db
+def test_data_view_legacy_format(logged_in_client, event, geocoded_order):
+    order = geocoded_order()
+    data = logged_in_client.get(data_url(event)).json()
+    assert len(data['locations']) == 1
+    location = data['locations'][0]
+    assert (location['lat'], location['lon']) == (52.53, 13.38)
+    assert order.code in location['tooltip']
+    assert location['order_url'].endswith(f'/orders/{order.code}/')
+
+
+@pytest.mark.django_db
+def test_data_view_columnar_format(logged_in_client, event, geocoded_order):
+    first = geocoded_order(latitude=52.5300004, longitude=13.38)
+    second = geocoded_order(latitude=48.1, longitude=11.5)
+    data = logged_in_client.get(data_url(event), {'format': 'columnar'}).json()
+    assert data['format'] == 'columnar'
+    assert data['count'] == 2
+    assert dict(zip(data['codes'], zip(data['lat'], data['lon']))) == {
+        first.code: (52.53, 13.38),
+        second.code: (48.1, 11.5),
+    }
+    assert data['order_url_template'].replace(data['code_placeholder'], first.code).endswith(
+        f'/orders/{first.code}/')
+
+
+@pytest.mark.django_db
+def test_detail_view(logged_in_client, event, geocoded_order):
+    order = geocoded_order()
+    url = f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/details/'
+    data = logged_in_client.get(url, {'codes': f'{order.code},UNKNOWN'}).json()
+    assert list(data['orders']) == [order.code]
+    assert data['orders'][order.code]['items'] == 0
+    assert order.code in data['orders'][order.code]['tooltip']
+    assert logged_in_client.get(url).status_code == 400
+
+
+@pytest.mark.django_db
+def test_cluster_view_aggregates_by_grid_cell(logged_in_client, event, geocoded_order):
+    geocoded_order(latitude=52.52, longitude=13.40)
+    geocoded_order(latitude=52.53, longitude=13.41)
+    single = geocoded_order(latitude=48.14, longitude=11.58)
+    geocoded_order(latitude=40.71, longitude=-74.0)  # Outside the bounding box
+    url = f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/clusters/'
+    data = logged_in_client.get(url, {'zoom': 6, 'bbox': '5,45,16,56'}).json()
+    assert data['total'] == 3
+    clusters = sorted(data['clusters'], key=lambda c: c['count'])
+    assert [c['count'] for c in clusters] == [1, 2]
+    assert clusters[0]['code'] == single.code
+    assert clusters[1]['lat'] == pytest.approx(52.525)
+    assert data['extent']['west'] == -74.0
+
+    assert logged_in_client.get(url, {'zoom': 6, 'bbox': 'nonsense'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_cluster_view_across_the_antimeridian(logged_in_client, event, geocoded_order):
+    geocoded_order(latitude=-18.1, longitude=178.4)  # Fiji
+    geocoded_order(latitude=-13.8, longitude=-171.8)  # Samoa
+    geocoded_order(latitude=-33.9, longitude=151.2)  # Sydney, outside the bounding boxes
+    url = f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/clusters/'
+    # Maps panned across the antimeridian send unwrapped longitudes
+    for bbox in ('170,-30,190,0', '-190,-30,-170,0', '530,-30,550,0'):
+        data = logged_in_client.get(url, {'zoom': 4, 'bbox': bbox}).json()
+        assert data['total'] == 2, bbox
+    assert logged_in_client.get(url, {'zoom': 1, 'bbox': '100,-90,500,90'}).json()['total'] == 3
+
+    assert SalesMapClusterView.parse_bbox('100,-10,300,10') == [(100.0, -10.0, 180.0, 10.0), (-180.0, -10.0, -60.0, 10.0)]
+    assert SalesMapClusterView.parse_bbox('5,45,16,56') == [(5.0, 45.0, 16.0, 56.0)]
+
+
+@pytest.mark.django_db
+def test_map_page(logged_in_client, event, geocoded_order):
+    geocoded_order()
+    response = logged_in_client.get(f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/')
+    assert response.status_code == 200
+    assert b'data-point-count="1"' in response.content
+
+
+@pytest.mark.django_db
+def test_data_view_conditional_requests(logged_in_client, event, geocoded_order):
+    geocoded_order()
+    response = logged_in_client.get(data_url(event), {'format': 'columnar'})
+    etag = response['ETag']
+    assert response['Last-Modified']
+
+    response = logged_in_client.get(data_url(event), {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    # New geocode data changes the version, so the cached response is not reused
+    geocoded_order(latitude=48.1, longitude=11.5)
+    response = logged_in_client.get(data_url(event), {'format': 'columnar'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert response.json()['count'] == 2
+
+
+@pytest.mark.django_db
+def test_data_view_full_format_follows_orders(logged_in_client, event, geocoded_order):
+    order = geocoded_order()
+    etag = logged_in_client.get(data_url(event))['ETag']
+    columnar_etag = logged_in_client.get(data_url(event), {'format': 'columnar'})['ETag']
+
+    # Item counts in the tooltips change with the order, not with its geocode data
+    with scopes_disabled():
+        Order.objects.filter(pk=order.pk).update(last_modified=now() + timedelta(seconds=5))
+    response = logged_in_client.get(data_url(event), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert logged_in_client.get(data_url(event), {'format': 'columnar'},
+                                HTTP_IF_NONE_MATCH=columnar_etag).status_code == 304
+
+
+@pytest.mark.django_db
+def test_data_view_delta_since(logged_in_client, event, geocoded_order):
+    old = geocoded_order(latitude=48.1, longitude=11.5)
+    new = geocoded_order(latitude=52.53, longitude=13.38)
+    removed = geocoded_order()
+    OrderGeocodeData.objects.filter(order=old).update(last_geocoded_at=now() - timedelta(hours=1))
+    OrderGeocodeData.objects.filter(order=removed).update(latitude=None, longitude=None)
+
+    since = (now() - timedelta(minutes=5)).isoformat()
+    data = logged_in_client.get(data_url(event), {'since': since}).json()
+    assert data['delta'] is True
+    assert data['codes'] == [new.code]
+    assert data['removed'] == [removed.code]
+    assert data['total'] == 2
+    assert data['synced_at']
+
+    # Deleted orders take their geocode data with them, only the total tells
+    OrderGeocodeData.objects.filter(order=old).delete()
+    data = logged_in_client.get(data_url(event), {'since': since}).json()
+    assert data['removed'] == [removed.code]
+    assert data['total'] == 1
+
+    # Epoch seconds are accepted as well
+    epoch = (now() - timedelta(minutes=5)).timestamp()
+    assert logged_in_client.get(data_url(event), {'since': epoch}).json()['codes'] == [new.code]
+    assert logged_in_client.get(data_url(event), {'since': 'yesterday'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_statistics_view(logged_in_client, event, geocoded_order):
+    geocoded_order(city='Berlin')
+    geocoded_order(latitude=48.2, longitude=16.37, zipcode='1010', city='Wien', country='AT')
+    url = f'/control/event/{event.organizer.slug}/{event.slug}/sales-map/statistics/'
+    # Aggregates that were never built are built on first access
+    data = logged_in_client.get(url, {'limit': 5}).json()
+    assert data['total'] == 2
+    assert data['venue'] is None
+    assert data['rings'] == []
+    assert {(c['key'], c['label'], c['count']) for c in data['countries']} == {('DE', 'Germany', 1), ('AT', 'Austria', 1)}
+    assert {c['key'] for c in data['cities']} == {'Berlin (DE)', 'Wien (AT)'}
+    assert logged_in_client.get(url, {'limit': 'x'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_data_view_streams_ndjson(logged_in_client, event, geocoded_order, monkeypatch):
+    monkeypatch.setattr('pretix_mapplugin.views.STREAM_CHUNK_SIZE', 2)
+    orders = [geocoded_order(latitude=52.5 + i / 100, longitude=13.4) for i in range(3)]
+    response = logged_in_client.get(data_url(event), {'format': 'columnar', 'stream': 'ndjson'})
+    assert response.streaming
+    assert response['Content-Type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert lines[0]['format'] == 'columnar'
+    assert lines[0]['order_url_template'] and lines[0]['synced_at']
+    assert [len(line['codes']) for line in lines[1:-1]] == [2, 1]
+    assert sorted(code for line in lines[1:-1] for code in line['codes']) == sorted(order.code for order in orders)
+    assert lines[-1] == {'done': True, 'count': 3}
+
+    # Full format, and conditional requests work the same as without streaming
+    response = logged_in_client.get(data_url(event), {'stream': 'ndjson'})
+    lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert sum(len(line.get('locations', [])) for line in lines) == 3
+    assert logged_in_client.get(data_url(event), {'stream': 'ndjson'},
+                                HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304